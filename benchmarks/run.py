@@ -0,0 +1,248 @@
+"""
+Benchmark the hot paths of the scripts package on synthetic data.
+
+Usage (from the repository root):
+    python -m benchmarks.run --scales 1 10 --output benchmarks/results/today.json
+    python -m benchmarks.run --only parse_damage lag_hpi_changes --baseline benchmarks/results/before.json --threshold 1.25
+
+The command exits with status 1 when a case is slower than the baseline by more than the threshold.
+"""
+import matplotlib
+matplotlib.use('Agg')
+
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import matplotlib.pyplot as plt
+
+from benchmarks.synthetic import make_county_polygons, make_storm_events, make_hpi_panel, write_storm_files
+from scripts.clean import convert_to_numeric, parse_damage, makeColorColumn
+from scripts.extract import read_all_zipped_csv, STORM_USECOLS, STORM_DTYPES
+from scripts.aggregate import aggregate_storm_events, refresh_storm_aggregates
+from scripts.panel import lag_hpi_changes
+from scripts.stats import get_nearest_county, corr_matrix, paired_ttests, cluster_resample_mean_diff, cluster_resample_corr
+from scripts.county_panel import build_county_lookup, build_county_year_panel
+from scripts.spatial import assign_event_counties
+from scripts.mpl_plots import plot_disasters_map, plot_disasters_map1
+from scripts.plotly_plots import plot_heatmap
+from scripts.render import render_plots
+
+def _datasets(scale, workdir):
+    """
+    Generate the synthetic inputs of one scale.
+
+    Parameters:
+    - scale (int): The data scale.
+    - workdir (str): The absolute working directory of the run; storm files are written to its 'data' folder.
+
+    Returns:
+    - dict: The synthetic tables shared by the cases.
+    """
+    counties = make_county_polygons(scale)
+    storm = make_storm_events(scale, counties=counties)
+    hpi = make_hpi_panel(scale, counties=counties)
+    hpi = pd.concat([hpi, lag_hpi_changes(hpi)], axis=1)
+    write_storm_files(storm, os.path.join(workdir, 'data', str(scale)))
+
+    storm['DAMAGE'] = (parse_damage(storm['DAMAGE_PROPERTY']) + parse_damage(storm['DAMAGE_CROPS'])) / 1000000
+    lookup = build_county_lookup(counties)
+    panel, _ = build_county_year_panel(storm.dropna(subset=['DAMAGE']), hpi, lookup)
+
+    freq = panel.groupby(['State', 'County'], as_index=False)['FREQ'].sum()
+    freq = freq.merge(counties[['STUSPS', 'NAME', 'geometry']], left_on=['State', 'County'], right_on=['STUSPS', 'NAME'])
+    high = freq[freq['FREQ'] >= freq['FREQ'].quantile(0.75)].reset_index(drop=True)
+    low = freq[freq['FREQ'] <= freq['FREQ'].quantile(0.25)].reset_index(drop=True)
+    pairs = get_nearest_county(high.copy(), low)
+    matched = panel.merge(pairs[['State', 'County', 'neighbor_state', 'neighbor_county']], on=['State', 'County'])
+    matched = matched.merge(panel, left_on=['neighbor_state', 'neighbor_county', 'Year'],
+                            right_on=['State', 'County', 'Year'], suffixes=('_h', '_l'))
+
+    counties['EVENT'] = np.random.default_rng(0).integers(0, 1000, len(counties))
+    counties['affected_level'] = np.where(counties['EVENT'] >= 750, 'high', np.where(counties['EVENT'] <= 250, 'low', None))
+    return {'counties': counties, 'storm': storm, 'hpi': hpi, 'lookup': lookup, 'panel': panel,
+            'high': high, 'low': low, 'matched': matched}
+
+def _cases(data, scale):
+    """
+    Build the benchmark cases of one scale.
+
+    Parameters:
+    - data (dict): The output of _datasets.
+    - scale (int): The data scale.
+
+    Returns:
+    - dict: Case name to (rows in, zero-argument callable).
+    """
+    storm, hpi, counties, panel = data['storm'], data['hpi'], data['counties'], data['panel']
+    storm_glob = "/data/{}/*.csv.gz".format(scale)
+    lags = ['Annual Change (%)', 'lag1_hpi_change', 'lag3_hpi_change', 'lag5_hpi_change', 'lag10_hpi_change']
+    heatmap = hpi.pivot_table(values='HPI', index=['State', 'County'], columns='Year')
+    pairs = [(c + '_h', c + '_l') for c in lags]
+    specs = [{'function': 'plot_heatmap', 'args': [heatmap], 'kwargs': {'filename': 'bench_render.html'}},
+             {'function': 'plot_disasters_map', 'args': [counties, 'EVENT', 'Events', 'bench_render.png']}]
+    cold = iter(range(10 ** 6))
+    return {
+        'convert_to_numeric': (len(storm), lambda: storm['DAMAGE_PROPERTY'].apply(convert_to_numeric)),
+        'parse_damage': (len(storm), lambda: parse_damage(storm['DAMAGE_PROPERTY'])),
+        'read_all_zipped_csv': (len(storm), lambda: read_all_zipped_csv(storm_glob, usecols=STORM_USECOLS,
+                                                                           dtype=STORM_DTYPES, max_workers=1)),
+        'aggregate_storm_events': (len(storm), lambda: aggregate_storm_events(storm_glob)),
+        'refresh_storm_aggregates': (len(storm), lambda: refresh_storm_aggregates(
+            storm_glob, partition_dir="/partitions/{}/{}".format(scale, next(cold)))),
+        'refresh_storm_aggregates_unchanged': (len(storm), lambda: refresh_storm_aggregates(
+            storm_glob, partition_dir="/partitions/{}/warm".format(scale))),
+        'assign_event_counties': (len(storm), lambda: assign_event_counties(storm, counties, data['lookup'])),
+        'build_county_year_panel': (len(storm), lambda: build_county_year_panel(storm, hpi, data['lookup'])),
+        'lag_hpi_changes': (len(hpi), lambda: lag_hpi_changes(hpi)),
+        'get_nearest_county': (len(data['high']), lambda: get_nearest_county(data['high'].copy(), data['low'])),
+        'corr_matrix': (len(panel), lambda: corr_matrix(panel, ['FREQ', 'DAMAGE'], lags)),
+        'paired_ttests': (len(data['matched']), lambda: paired_ttests(data['matched'], pairs)),
+        'cluster_resample_mean_diff': (len(data['matched']), lambda: cluster_resample_mean_diff(
+            data['matched'], pairs, cluster=['State_h', 'County_h'], n_resamples=1000, max_workers=1)),
+        'cluster_resample_corr': (len(panel), lambda: cluster_resample_corr(panel, ['FREQ', 'DAMAGE'], lags,
+                                                                            n_resamples=1000, max_workers=1)),
+        'makeColorColumn': (len(counties), lambda: makeColorColumn(counties, 'EVENT', 0, 1000)),
+        'plot_disasters_map': (len(counties), lambda: plot_disasters_map(counties, 'EVENT', 'Events', 'bench_map.png')),
+        'plot_disasters_map1': (len(counties), lambda: plot_disasters_map1(counties, 'bench_map1.png')),
+        'plot_heatmap': (heatmap.size, lambda: plot_heatmap(heatmap, filename='bench_heatmap.html', show=False)),
+        'plot_heatmap_compact': (heatmap.size, lambda: plot_heatmap(heatmap, filename='bench_heatmap_c.html',
+                                                                    compact=True, show=False)),
+        'render_plots': (heatmap.size + len(counties), lambda: render_plots(specs, max_workers=1, force=True)),
+        'render_plots_unchanged': (heatmap.size + len(counties), lambda: render_plots(specs, max_workers=1)),
+    }
+
+def _measure(function, repeat):
+    """
+    Time a callable and measure its peak traced memory.
+
+    The timed runs are done without tracing; one extra run under tracemalloc gives the peak.
+
+    Parameters:
+    - function (callable): The zero-argument case.
+    - repeat (int): Number of timed runs.
+
+    Returns:
+    - dict: 'wall_s' and 'cpu_s' (best of the timed runs) and 'peak_mb'.
+    """
+    walls, cpus = [], []
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        function()
+        walls.append(time.perf_counter() - wall)
+        cpus.append(time.process_time() - cpu)
+        plt.close('all')
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    plt.close('all')
+    return {'wall_s': min(walls), 'cpu_s': min(cpus), 'peak_mb': peak / 1024 ** 2}
+
+def run_benchmarks(scales=[1], only=None, repeat=3):
+    """
+    Run the benchmark cases at several data scales in a scratch working directory.
+
+    Parameters:
+    - scales (list, optional): Data scales, multiples of the shipped data size. Default is [1].
+    - only (list, optional): Names of the cases to run. Default is None, which runs every case.
+    - repeat (int, optional): Number of timed runs per case. Default is 3.
+
+    Raises:
+    - AssertionError: If scales is not a list of positive integers or only names an unknown case.
+
+    Returns:
+    - dict: 'meta' with the environment and 'results', a list of dicts with 'case', 'scale', 'rows',
+            'wall_s', 'cpu_s' and 'peak_mb'.
+    """
+    assert isinstance(scales, list) and all(isinstance(s, int) and s > 0 for s in scales)
+    assert only is None or isinstance(only, list) and isinstance(repeat, int) and repeat > 0
+
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, 'plots'))
+        os.chdir(workdir)
+        try:
+            for scale in scales:
+                cases = _cases(_datasets(scale, workdir), scale)
+                unknown = set(only or []) - set(cases)
+                assert not unknown, "unknown benchmark cases: {}".format(sorted(unknown))
+                for name, (rows, function) in cases.items():
+                    if only is not None and name not in only:
+                        continue
+                    result = dict(case=name, scale=scale, rows=int(rows), **_measure(function, repeat))
+                    print("{case:<26} x{scale:<4} {rows:>11,} rows {wall_s:9.3f} s {peak_mb:9.1f} MB".format(**result))
+                    results.append(result)
+        finally:
+            os.chdir(cwd)
+
+    meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'repeat': repeat}
+    return {'meta': meta, 'results': results}
+
+def compare_results(current, baseline, threshold=1.25, min_seconds=0.05):
+    """
+    Find the cases that got slower than a baseline run.
+
+    Parameters:
+    - current (dict): The output of run_benchmarks.
+    - baseline (dict): An earlier output of run_benchmarks.
+    - threshold (float, optional): Allowed ratio of current to baseline wall time. Default is 1.25.
+    - min_seconds (float, optional): Cases faster than this are ignored as timing noise. Default is 0.05.
+
+    Raises:
+    - AssertionError: If threshold is not greater than 1.
+
+    Returns:
+    - list: One dict per regression with 'case', 'scale', 'baseline_s', 'current_s' and 'ratio'.
+    """
+    assert isinstance(threshold, (int, float)) and threshold > 1
+
+    before = {(r['case'], r['scale']): r['wall_s'] for r in baseline['results']}
+    regressions = []
+    for r in current['results']:
+        old = before.get((r['case'], r['scale']))
+        if old is None or r['wall_s'] < min_seconds:
+            continue
+        ratio = r['wall_s'] / max(old, 1e-9)
+        if ratio > threshold:
+            regressions.append({'case': r['case'], 'scale': r['scale'], 'baseline_s': old,
+                                'current_s': r['wall_s'], 'ratio': ratio})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scripts package on synthetic data.")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1], help="data scales, e.g. 1 10 100")
+    parser.add_argument('--only', nargs='+', default=None, help="names of the cases to run")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per case")
+    parser.add_argument('--output', default=None, help="JSON file for the results")
+    parser.add_argument('--baseline', default=None, help="JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="allowed slowdown ratio against the baseline")
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args.scales, args.only, args.repeat)
+    output = args.output or os.path.join('benchmarks', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(current, f, indent=1)
+    print("results written to", output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_results(current, json.load(f), args.threshold)
+        for r in regressions:
+            print("REGRESSION {case} x{scale}: {baseline_s:.3f} s -> {current_s:.3f} s ({ratio:.2f}x)".format(**r))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import pandas as pd
+import numpy as np
+import geopandas as gpd
+import shapely
+import os
+
+# sizes of the data shipped with the project, used as scale 1
+STORM_ROWS = 156918
+HPI_COUNTIES = 2783
+HPI_YEARS = list(range(1980, 2024))
+COUNTY_POLYGONS = 3234
+
+COUNTIES_PER_STATE = 64
+
+EVENT_TYPES = ['Thunderstorm Wind', 'Hail', 'Tornado', 'Flash Flood', 'Flood', 'Winter Storm', 'High Wind',
+               'Heavy Snow', 'Lightning', 'Drought', 'Wildfire', 'Hurricane (Typhoon)']
+
+DAMAGE_VALUES = np.array(['0', '0', '0', '500', '1K', '2.5K', '10K', '50K', '250K', '1M', '2.5M', '10M', '1B'], dtype=object)
+
+def make_county_polygons(scale=1):
+    """
+    Generate a grid of rectangular counties over the CONUS extent, shaped like cb_2022_us_county_500k.
+
+    Parameters:
+    - scale (int, optional): Multiple of the real number of counties. Default is 1.
+
+    Raises:
+    - AssertionError: If scale is not a positive integer.
+
+    Returns:
+    - gpd.GeoDataFrame: Columns 'STATEFP', 'COUNTYFP', 'STUSPS', 'NAME', 'NAMELSAD', 'LSAD' and 'geometry' in EPSG:4269.
+    """
+    assert isinstance(scale, int) and scale > 0
+
+    n = COUNTY_POLYGONS * scale
+    cols = int(np.ceil(np.sqrt(n * 58 / 24)))
+    rows = int(np.ceil(n / cols))
+    width, height = 58 / cols, 24 / rows
+    i = np.arange(n)
+    x0 = -125 + (i % cols) * width
+    y0 = 25 + (i // cols) * height
+    state = 1 + i // COUNTIES_PER_STATE
+    county = 1 + 2 * (i % COUNTIES_PER_STATE)
+    names = np.char.add('C', np.char.add(state.astype(str), np.char.add('x', county.astype(str))))
+    counties = gpd.GeoDataFrame({
+        'STATEFP': np.char.zfill(state.astype(str), 2),
+        'COUNTYFP': np.char.zfill(county.astype(str), 3),
+        'STUSPS': np.char.add('S', state.astype(str)),
+        'NAME': names,
+        'NAMELSAD': np.char.add(names, ' County'),
+        'LSAD': '06',
+    }, geometry=shapely.box(x0, y0, x0 + width, y0 + height), crs="EPSG:4269")
+    # the maps draw Alaska and Hawaii in insets, so add one county for each
+    insets = gpd.GeoDataFrame({'STATEFP': ['98', '99'], 'COUNTYFP': ['001', '001'], 'STUSPS': ['AK', 'HI'],
+                               'NAME': ['Alaska', 'Hawaii'], 'NAMELSAD': ['Alaska Borough', 'Hawaii County'],
+                               'LSAD': ['04', '06']},
+                              geometry=[shapely.box(-160, 58, -145, 68), shapely.box(-157, 19, -155, 21)], crs="EPSG:4269")
+    return pd.concat([counties, insets], ignore_index=True)
+
+def make_storm_events(scale=1, seed=0, counties=None):
+    """
+    Generate a StormEvents_details-shaped table with the columns in extract.STORM_USECOLS.
+
+    Damage strings use the NOAA K/M/B suffixes with about a third blank, county records ('C') use the FIPS
+    codes and names of counties, and about 70% of events have begin coordinates inside their county.
+
+    Parameters:
+    - scale (int, optional): Multiple of the shipped 1980-1995 row count. Default is 1.
+    - seed (int, optional): Seed of the random generator. Default is 0.
+    - counties (gpd.GeoDataFrame, optional): Counties from make_county_polygons. Default is None, which generates them at the same scale.
+
+    Raises:
+    - AssertionError: If scale is not a positive integer.
+
+    Returns:
+    - pd.DataFrame: The synthetic storm events.
+    """
+    assert isinstance(scale, int) and scale > 0
+
+    rng = np.random.default_rng(seed)
+    counties = make_county_polygons(scale) if counties is None else counties
+    n = STORM_ROWS * scale
+    pick = rng.integers(0, len(counties), n)
+    state = counties['STATEFP'].to_numpy().astype(np.int64)[pick]
+    county = counties['COUNTYFP'].to_numpy().astype(np.int64)[pick]
+    zone = rng.random(n) < 0.1
+    bounds = counties.geometry.bounds.to_numpy()[pick]
+    lat = rng.uniform(bounds[:, 1], bounds[:, 3])
+    lon = rng.uniform(bounds[:, 0], bounds[:, 2])
+    missing = rng.random(n) < 0.3
+    lat[missing], lon[missing] = np.nan, np.nan
+    year = rng.integers(HPI_YEARS[0], HPI_YEARS[-1] + 1, n)
+
+    def damage():
+        values = DAMAGE_VALUES[rng.integers(0, len(DAMAGE_VALUES), n)]
+        values[rng.random(n) < 0.35] = np.nan
+        return values
+
+    return pd.DataFrame({
+        'EVENT_ID': np.arange(1, n + 1, dtype=np.int64),
+        'STATE': np.char.add('STATE ', state.astype(str)),
+        'STATE_FIPS': state,
+        'YEAR': year,
+        'EVENT_TYPE': np.array(EVENT_TYPES, dtype=object)[rng.integers(0, len(EVENT_TYPES), n)],
+        'CZ_TYPE': np.where(zone, 'Z', 'C'),
+        'CZ_FIPS': np.where(zone, rng.integers(1, 100, n), county),
+        'CZ_NAME': np.where(zone, 'ZONE', counties['NAME'].to_numpy()[pick]).astype(object),
+        'BEGIN_DATE_TIME': pd.to_datetime(year.astype(str)).strftime('%d-%b-%y 12:00:00'),
+        'DAMAGE_PROPERTY': damage(),
+        'DAMAGE_CROPS': damage(),
+        'BEGIN_LAT': lat,
+        'BEGIN_LON': lon,
+    })
+
+def make_hpi_panel(scale=1, seed=0, counties=None):
+    """
+    Generate an annual county HPI panel shaped like HPI_AT_BDL_county.xlsx.
+
+    Parameters:
+    - scale (int, optional): Multiple of the real number of HPI counties. Default is 1.
+    - seed (int, optional): Seed of the random generator. Default is 0.
+    - counties (gpd.GeoDataFrame, optional): Counties from make_county_polygons. Default is None, which generates them at the same scale.
+
+    Raises:
+    - AssertionError: If scale is not a positive integer.
+
+    Returns:
+    - pd.DataFrame: Columns 'State', 'County', 'FIPS code', 'Year', 'Annual Change (%)' and 'HPI'.
+    """
+    assert isinstance(scale, int) and scale > 0
+
+    rng = np.random.default_rng(seed)
+    counties = make_county_polygons(scale) if counties is None else counties
+    counties = counties.iloc[:min(HPI_COUNTIES * scale, len(counties))]
+    n_years = len(HPI_YEARS)
+    change = rng.normal(4, 6, (len(counties), n_years))
+    hpi = 100 * np.cumprod(1 + change / 100, axis=1)
+    fips = counties['STATEFP'].to_numpy().astype(np.int64) * 1000 + counties['COUNTYFP'].to_numpy().astype(np.int64)
+    return pd.DataFrame({
+        'State': np.repeat(counties['STUSPS'].to_numpy(), n_years),
+        'County': np.repeat(counties['NAME'].to_numpy(), n_years),
+        'FIPS code': np.repeat(fips, n_years),
+        'Year': np.tile(HPI_YEARS, len(counties)),
+        'Annual Change (%)': change.ravel(),
+        'HPI': hpi.ravel(),
+    })
+
+def write_storm_files(storm, directory):
+    """
+    Write a storm table as one StormEvents_details .csv.gz file per year.
+
+    Parameters:
+    - storm (pd.DataFrame): The table from make_storm_events.
+    - directory (str): The absolute output directory.
+
+    Returns:
+    - list: The written file paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for year, part in storm.groupby('YEAR'):
+        file = os.path.join(directory, "StormEvents_details-ftp_v1.0_d{}_c20240101.csv.gz".format(year))
+        part.to_csv(file, index=False, compression='gzip')
+        files.append(file)
+    return files
@@ -0,0 +1,389 @@
+import pandas as pd
+import numpy as np
+import os
+import glob
+import re
+import json
+import time
+import pyarrow.feather as feather
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from scripts.clean import parse_damage, DAMAGE_UNITS
+
+AGG_KEYS = ['STATE', 'STATE_FIPS', 'CZ_TYPE', 'CZ_FIPS', 'CZ_NAME', 'YEAR', 'EVENT_TYPE']
+
+AGG_DTYPES = {
+    'EVENT_ID': 'int64',
+    'YEAR': 'int64',
+    'STATE_FIPS': 'int64',
+    'CZ_FIPS': 'int64',
+    'STATE': 'object',
+    'EVENT_TYPE': 'object',
+    'CZ_NAME': 'object',
+    'CZ_TYPE': 'object',
+    'DAMAGE_PROPERTY': 'object',
+    'DAMAGE_CROPS': 'object',
+}
+
+_SUMS = ['FREQ', 'DAMAGE_P', 'DAMAGE_C', 'DAMAGE']
+
+def _chunk_partial(chunk, keys, top_k, units):
+    """
+    Reduce one chunk of raw storm records to a partial aggregate.
+
+    Damage is parsed to millions of dollars and rows whose property or crop damage cannot be parsed are
+    dropped, as in the notebook.
+
+    Parameters:
+    - chunk (pd.DataFrame): Raw records with the key, 'EVENT_ID' and damage columns.
+    - keys (list): Group columns.
+    - top_k (int): Number of costliest events to keep per group.
+    - units (dict): Damage suffix to exponent mapping, passed to parse_damage.
+
+    Returns:
+    - tuple: (groups, top) as described in merge_partials.
+    """
+    damage_p = parse_damage(chunk['DAMAGE_PROPERTY'], units=units) / 1000000
+    damage_c = parse_damage(chunk['DAMAGE_CROPS'], units=units) / 1000000
+    valid = (damage_p.notna() & damage_c.notna()).to_numpy()
+    records = chunk.loc[valid, keys + ['EVENT_ID']]
+    records['DAMAGE_P'] = damage_p[valid]
+    records['DAMAGE_C'] = damage_c[valid]
+    records['DAMAGE'] = records['DAMAGE_P'] + records['DAMAGE_C']
+    records['FREQ'] = 1
+
+    grouped = records.groupby(keys, sort=False, dropna=False)
+    groups = grouped[_SUMS].sum()
+    groups['DAMAGE_MIN'] = grouped['DAMAGE'].min()
+    groups['DAMAGE_MAX'] = grouped['DAMAGE'].max()
+    top = _top_events(records[keys + ['EVENT_ID', 'DAMAGE']], keys, top_k)
+    return groups, top
+
+def _top_events(events, keys, top_k):
+    """
+    Keep the top_k costliest events of every group, ties broken by the smaller EVENT_ID.
+
+    Parameters:
+    - events (pd.DataFrame): Columns keys + ['EVENT_ID', 'DAMAGE'].
+    - keys (list): Group columns.
+    - top_k (int): Number of events to keep per group.
+
+    Returns:
+    - pd.DataFrame: The kept rows, sorted by decreasing damage.
+    """
+    events = events.sort_values(['DAMAGE', 'EVENT_ID'], ascending=[False, True], kind='stable')
+    return events[events.groupby(keys, sort=False, dropna=False).cumcount().to_numpy() < top_k]
+
+def merge_partials(partials, keys=AGG_KEYS, top_k=5):
+    """
+    Merge partial aggregates into one. Merging is associative, so partials can come from chunks, files or earlier runs.
+
+    A partial is a tuple (groups, top):
+    - groups (pd.DataFrame): Indexed by keys, with columns 'FREQ', 'DAMAGE_P', 'DAMAGE_C', 'DAMAGE' (sums, damage
+                             in millions of dollars), 'DAMAGE_MIN' and 'DAMAGE_MAX'.
+    - top (pd.DataFrame): Columns keys + ['EVENT_ID', 'DAMAGE'], at most top_k rows per group.
+
+    Parameters:
+    - partials (list): The partial aggregates to merge.
+    - keys (list, optional): Group columns. Default is AGG_KEYS.
+    - top_k (int, optional): Number of costliest events to keep per group. Default is 5.
+
+    Raises:
+    - AssertionError: If partials is not a non-empty list, or top_k is not a positive integer.
+
+    Returns:
+    - tuple: The merged (groups, top).
+    """
+    assert isinstance(partials, list) and len(partials) > 0 and isinstance(keys, list)
+    assert isinstance(top_k, int) and top_k > 0
+
+    if len(partials) == 1:
+        return partials[0]
+    groups = pd.concat([g for g, _ in partials])
+    grouped = groups.groupby(level=keys, sort=False, dropna=False)
+    merged = grouped[_SUMS].sum()
+    merged['DAMAGE_MIN'] = grouped['DAMAGE_MIN'].min()
+    merged['DAMAGE_MAX'] = grouped['DAMAGE_MAX'].max()
+    top = _top_events(pd.concat([t for _, t in partials], ignore_index=True), keys, top_k)
+    return merged, top
+
+def aggregate_file(file, keys=AGG_KEYS, top_k=5, chunksize=100000, units=DAMAGE_UNITS):
+    """
+    Stream one compressed StormEvents file in chunks and fold it into a partial aggregate.
+
+    Only the key, 'EVENT_ID' and damage columns are read, and each chunk is merged into the running
+    aggregate before the next one is read. Peak memory therefore depends on chunksize and the number
+    of groups, not on the number of rows in the file.
+
+    Parameters:
+    - file (str): Full path of a StormEvents_details .csv.gz file.
+    - keys (list, optional): Group columns. Default is AGG_KEYS.
+    - top_k (int, optional): Number of costliest events to keep per group. Default is 5.
+    - chunksize (int, optional): Rows per chunk. Default is 100000.
+    - units (dict, optional): Damage suffix to exponent mapping. Default is DAMAGE_UNITS.
+
+    Raises:
+    - AssertionError: If file is not a string or chunksize is not a positive integer.
+
+    Returns:
+    - tuple: The partial aggregate (groups, top) of the file, see merge_partials.
+    """
+    assert isinstance(file, str) and isinstance(chunksize, int) and chunksize > 0
+
+    usecols = list(dict.fromkeys(keys + ['EVENT_ID', 'DAMAGE_PROPERTY', 'DAMAGE_CROPS']))
+    dtype = {col: t for col, t in AGG_DTYPES.items() if col in usecols}
+    partial = None
+    with pd.read_csv(file, compression='gzip', usecols=usecols, dtype=dtype, chunksize=chunksize) as reader:
+        for chunk in reader:
+            current = _chunk_partial(chunk, keys, top_k, units)
+            partial = current if partial is None else merge_partials([partial, current], keys, top_k)
+    return partial
+
+def aggregate_storm_events(path="/dataset/*.csv.gz", keys=AGG_KEYS, top_k=5, chunksize=100000,
+                           units=DAMAGE_UNITS, max_workers=1, executor="process"):
+    """
+    Aggregate the StormEvents archive per group without loading every raw record at once.
+
+    This is the streaming alternative to read_all_zipped_csv followed by groupby: every file is read in
+    chunks (see aggregate_file) and the per-file partials are merged as they arrive. Files can be
+    processed in parallel; each worker holds one chunk and one file's groups at a time.
+
+    Parameters:
+    - path (str, optional): Glob of the compressed StormEvents files, relative to the working directory. Default is "/dataset/*.csv.gz".
+    - keys (list, optional): Group columns. Default is AGG_KEYS (state, county/zone, year and event type).
+    - top_k (int, optional): Number of costliest events to keep per group. Default is 5.
+    - chunksize (int, optional): Rows per chunk. Default is 100000.
+    - units (dict, optional): Damage suffix to exponent mapping. Default is DAMAGE_UNITS.
+    - max_workers (int, optional): Number of files processed in parallel. Default is 1.
+    - executor (str, optional): "process" or "thread" pool, used when max_workers > 1. Default is "process".
+
+    Raises:
+    - AssertionError: If the input path is not a string ending with '*.csv.gz', no file matches it,
+                      or max_workers/executor have unexpected values.
+
+    Returns:
+    - pd.DataFrame: One row per group with the key columns, 'FREQ', 'DAMAGE_P', 'DAMAGE_C', 'DAMAGE' (millions of dollars),
+                    'DAMAGE_MIN' and 'DAMAGE_MAX'.
+    - pd.DataFrame: The top_k costliest events of every group, with the key columns, 'EVENT_ID' and 'DAMAGE'.
+    """
+    assert isinstance(path, str) and len(path) > 8 and path[-8:] == "*.csv.gz"
+    assert isinstance(max_workers, int) and max_workers > 0 and executor in ("process", "thread")
+
+    files = sorted(glob.glob(os.getcwd()+path))
+    assert len(files) > 0
+
+    partial = None
+    if max_workers == 1:
+        results = (aggregate_file(file, keys, top_k, chunksize, units) for file in files)
+        for current in results:
+            partial = current if partial is None else merge_partials([partial, current], keys, top_k)
+    else:
+        pool = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        with pool(max_workers=min(max_workers, len(files))) as ex:
+            for current in ex.map(aggregate_file, files, repeat(keys), repeat(top_k), repeat(chunksize), repeat(units)):
+                partial = current if partial is None else merge_partials([partial, current], keys, top_k)
+
+    groups, top = partial
+    return groups.reset_index(), top.reset_index(drop=True)
+
+PARTITION_DIR = "/.cache/storm_partitions"
+
+_STORM_FILE_PATTERN = re.compile(r'_d(\d{4})_c(\d{8})\.csv\.gz$')
+
+def storm_file_revision(file):
+    """
+    Read the data year and NOAA revision date from a StormEvents file name.
+
+    Parameters:
+    - file (str): A file name or path such as 'StormEvents_details-ftp_v1.0_d1980_c20220425.csv.gz'.
+
+    Raises:
+    - AssertionError: If file is not a string or does not follow the NOAA naming scheme.
+
+    Returns:
+    - tuple: (year, revision), e.g. (1980, '20220425').
+    """
+    assert isinstance(file, str)
+    match = _STORM_FILE_PATTERN.search(file)
+    assert match is not None, "not a StormEvents file name: " + file
+    return int(match.group(1)), match.group(2)
+
+def _load_manifest(root):
+    """
+    Load the partition manifest of a partition directory, or an empty manifest if there is none.
+
+    Parameters:
+    - root (str): The absolute partition directory.
+
+    Returns:
+    - dict: The manifest with a 'params' and a 'partitions' mapping.
+    """
+    try:
+        with open(os.path.join(root, "manifest.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"params": None, "partitions": {}}
+
+def _save_manifest(root, manifest):
+    """
+    Atomically write the partition manifest of a partition directory.
+
+    Parameters:
+    - root (str): The absolute partition directory.
+    - manifest (dict): The manifest to write.
+
+    Returns:
+    None
+    """
+    tmp = os.path.join(root, "manifest.json.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(root, "manifest.json"))
+
+def _write_partition(root, name, frame):
+    """
+    Atomically write one partition table as Feather.
+
+    Parameters:
+    - root (str): The absolute partition directory.
+    - name (str): The file name of the partition table.
+    - frame (pd.DataFrame): The table to write.
+
+    Returns:
+    None
+    """
+    tmp = os.path.join(root, name + ".tmp")
+    feather.write_feather(frame.reset_index(drop=True), tmp)
+    os.replace(tmp, os.path.join(root, name))
+
+def _read_partition(root, name):
+    """
+    Read one partition table, restoring NaN where Feather returned None in object columns.
+
+    Parameters:
+    - root (str): The absolute partition directory.
+    - name (str): The file name of the partition table.
+
+    Returns:
+    - pd.DataFrame: The partition table.
+    """
+    frame = feather.read_feather(os.path.join(root, name))
+    for col in frame.columns[frame.dtypes == object]:
+        frame[col] = frame[col].where(frame[col].notna(), np.nan)
+    return frame
+
+def _remove_partition(root, entry):
+    """
+    Delete the files of one partition.
+
+    Parameters:
+    - root (str): The absolute partition directory.
+    - entry (dict): The manifest entry of the partition.
+
+    Returns:
+    None
+    """
+    for name in (entry["groups"], entry["top"]):
+        try:
+            os.remove(os.path.join(root, name))
+        except FileNotFoundError:
+            pass
+
+def refresh_storm_aggregates(path="/dataset/*.csv.gz", partition_dir=PARTITION_DIR, keys=AGG_KEYS, top_k=5,
+                             chunksize=100000, units=DAMAGE_UNITS, max_workers=1, executor="process"):
+    """
+    Bring the per-file partial aggregates up to date and merge them into the archive-wide aggregate.
+
+    Every data year is materialized once as a partition (see aggregate_file) and recorded in manifest.json
+    with the source file name, its '_cYYYYMMDD' revision and its size. A refresh only re-aggregates the
+    years whose file was added or re-published under a new revision, drops the partitions of years whose
+    file is gone, and re-merges everything from the stored partitions. If several revisions of one year
+    are present, the newest is used. Changing keys, top_k or units rebuilds every partition.
+
+    Parameters:
+    - path (str, optional): Glob of the compressed StormEvents files, relative to the working directory. Default is "/dataset/*.csv.gz".
+    - partition_dir (str, optional): Directory of the partitions, relative to the working directory. Default is PARTITION_DIR.
+    - keys (list, optional): Group columns. Default is AGG_KEYS.
+    - top_k (int, optional): Number of costliest events to keep per group. Default is 5.
+    - chunksize (int, optional): Rows per chunk. Default is 100000.
+    - units (dict, optional): Damage suffix to exponent mapping. Default is DAMAGE_UNITS.
+    - max_workers (int, optional): Number of files re-aggregated in parallel. Default is 1.
+    - executor (str, optional): "process" or "thread" pool, used when max_workers > 1. Default is "process".
+
+    Raises:
+    - AssertionError: If the input path is not a string ending with '*.csv.gz', no file matches it,
+                      a file name has no year and revision, or max_workers/executor have unexpected values.
+
+    Returns:
+    - pd.DataFrame: The merged group aggregates, as returned by aggregate_storm_events.
+    - pd.DataFrame: The merged top_k costliest events per group.
+    - dict: The refresh report with the 'built', 'removed' and 'unchanged' file names.
+    """
+    assert isinstance(path, str) and len(path) > 8 and path[-8:] == "*.csv.gz" and isinstance(partition_dir, str)
+    assert isinstance(max_workers, int) and max_workers > 0 and executor in ("process", "thread")
+
+    files = sorted(glob.glob(os.getcwd()+path))
+    assert len(files) > 0
+
+    latest = {}
+    for file in files:
+        year, revision = storm_file_revision(file)
+        if year not in latest or revision > latest[year][1]:
+            latest[year] = (file, revision)
+
+    root = os.getcwd() + partition_dir
+    os.makedirs(root, exist_ok=True)
+    manifest = _load_manifest(root)
+    params = {"keys": keys, "top_k": top_k, "units": units}
+    if manifest["params"] != params:
+        for entry in manifest["partitions"].values():
+            _remove_partition(root, entry)
+        manifest = {"params": params, "partitions": {}}
+        _save_manifest(root, manifest)
+
+    partitions = manifest["partitions"]
+    report = {"built": [], "removed": [], "unchanged": []}
+    for year in sorted(set(partitions) - {str(y) for y in latest}):
+        report["removed"].append(partitions[year]["source"])
+        _remove_partition(root, partitions.pop(year))
+    _save_manifest(root, manifest)
+
+    stale = []
+    for year, (file, revision) in sorted(latest.items()):
+        entry = partitions.get(str(year))
+        if entry is None or entry["revision"] != revision or entry["source"] != os.path.basename(file) \
+                or entry["bytes"] != os.path.getsize(file):
+            stale.append(year)
+        else:
+            report["unchanged"].append(entry["source"])
+
+    def store(year, partial):
+        file, revision = latest[year]
+        groups, top = partial
+        name = "d{}_c{}".format(year, revision)
+        old = partitions.get(str(year))
+        _write_partition(root, name + "_groups.feather", groups.reset_index())
+        _write_partition(root, name + "_top.feather", top)
+        if old is not None and old["groups"] != name + "_groups.feather":
+            _remove_partition(root, old)
+        partitions[str(year)] = {"source": os.path.basename(file), "revision": revision, "bytes": os.path.getsize(file),
+                                 "groups": name + "_groups.feather", "top": name + "_top.feather",
+                                 "n_groups": len(groups), "events": int(groups['FREQ'].sum()), "built": time.time()}
+        _save_manifest(root, manifest)
+        report["built"].append(os.path.basename(file))
+
+    stale_files = [latest[year][0] for year in stale]
+    if max_workers == 1 or len(stale) <= 1:
+        for year, file in zip(stale, stale_files):
+            store(year, aggregate_file(file, keys, top_k, chunksize, units))
+    else:
+        pool = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        with pool(max_workers=min(max_workers, len(stale))) as ex:
+            results = ex.map(aggregate_file, stale_files, repeat(keys), repeat(top_k), repeat(chunksize), repeat(units))
+            for year, partial in zip(stale, results):
+                store(year, partial)
+
+    merged = [(_read_partition(root, entry["groups"]).set_index(keys), _read_partition(root, entry["top"]))
+              for _, entry in sorted(partitions.items())]
+    groups, top = merge_partials(merged, keys, top_k)
+    return groups.reset_index(), top.reset_index(drop=True), report
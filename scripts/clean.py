@@ -2,6 +2,11 @@ import pandas as pd
 import numpy as np
 import matplotlib.colors as mcolors
 import matplotlib.pyplot as plt
+from scripts.instrument import instrumented
+
+DAMAGE_UNITS = {'H': 'e2', 'h': 'e2', 'K': 'e3', 'k': 'e3', 'M': 'e6', 'm': 'e6', 'B': 'e9', 'b': 'e9'}
+
+_DAMAGE_PATTERN = r'^\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)\s*([A-Za-z]?)\s*$'
 
 def convert_to_numeric(value):
     """
@@ -31,6 +36,164 @@ def convert_to_numeric(value):
         except:
             return value
         
+@instrumented
+def parse_damage(series, units=DAMAGE_UNITS, validate=False):
+    """
+    Convert a column of NOAA damage strings (e.g. '1.5K', '2M', '0') to float64 dollars in one vectorized pass.
+
+    Plain numbers are parsed directly; suffixed values are rewritten to scientific notation ('1.5K' -> '1.5e3')
+    and parsed together, which gives the same result as convert_to_numeric for the suffixes both understand.
+    Blank and malformed values become NaN.
+
+    Parameters:
+    - series (pd.Series): The damage column, holding numbers and/or strings.
+    - units (dict, optional): Suffix to exponent mapping. Default is DAMAGE_UNITS (H, K, M and B in either case).
+                              Pass {'K': 'e3', 'M': 'e6'} to reproduce convert_to_numeric exactly.
+    - validate (bool, optional): Whether to also return a report of the values that could not be parsed. Default is False.
+
+    Raises:
+    - AssertionError: If series is not a pandas Series, units is not a dict, or validate is not a bool.
+
+    Returns:
+    - pd.Series: The damage in dollars as float64, with the index of the input.
+    - dict (only if validate is True): Counts of 'total', 'blank', 'parsed' and 'unparsed' values, and
+                                       'unparsed_values', a pd.Series with the counts of each unparsed value.
+    """
+    assert isinstance(series, pd.Series) and isinstance(units, dict) and isinstance(validate, bool)
+
+    if isinstance(series.dtype, pd.CategoricalDtype) and not validate:
+        # parse each distinct label once and broadcast through the codes
+        parsed = parse_damage(pd.Series(series.cat.categories.astype(object)), units).to_numpy()
+        codes = series.cat.codes.to_numpy()
+        return pd.Series(np.where(codes >= 0, parsed[codes], np.nan), index=series.index, name=series.name)
+
+    values = pd.to_numeric(series, errors='coerce').astype('float64')
+    pending = values.isna() & series.notna()
+    if pending.any():
+        parts = series[pending].astype(str).str.extract(_DAMAGE_PATTERN)
+        exponent = parts[1].map(units).where(parts[1] != '', '')
+        values[pending] = pd.to_numeric(parts[0] + exponent, errors='coerce')
+
+    if not validate:
+        return values
+
+    blank = series.isna() | series.astype(str).str.strip().eq('')
+    unparsed = values.isna() & ~blank
+    report = {
+        'total': len(series),
+        'blank': int(blank.sum()),
+        'parsed': int(values.notna().sum()),
+        'unparsed': int(unparsed.sum()),
+        'unparsed_values': series[unparsed].astype(object).value_counts(),
+    }
+    return values, report
+
+NARRATIVE_COLUMNS = ['EPISODE_NARRATIVE', 'EVENT_NARRATIVE']
+
+@instrumented
+def compact_dtypes(df, float32=False, strings='category', max_unique_ratio=0.5, keep_narratives=False):
+    """
+    Apply the memory-compact dtype policy to a storm or panel table.
+
+    - Narrative free-text columns (NARRATIVE_COLUMNS) are dropped unless keep_narratives is True.
+    - Object columns whose share of distinct values is at most max_unique_ratio (states, event types, county
+      names, damage strings) become categoricals; the remaining text columns become Arrow strings with strings='arrow'.
+    - Integer columns are downcast to the smallest integer type holding their range.
+    - Float columns become float32 when float32 is True, or only the listed columns when it is a list.
+
+    Parameters:
+    - df (pd.DataFrame): The table.
+    - float32 (bool or list, optional): Float columns to store as float32, or True for all. Default is False.
+    - strings (str, optional): 'category' to only convert repeated labels, or 'arrow' to also store the other
+                               text columns as 'string[pyarrow]'. Default is 'category'.
+    - max_unique_ratio (float, optional): Largest share of distinct values for a categorical column, between 0 and 1.
+                                          Default is 0.5.
+    - keep_narratives (bool, optional): Whether to keep the narrative columns. Default is False.
+
+    Raises:
+    - AssertionError: If any input argument is not of the expected type or max_unique_ratio is outside [0, 1].
+
+    Returns:
+    - pd.DataFrame: A new table with compact dtypes; df is not modified.
+    """
+    assert isinstance(df, pd.DataFrame) and isinstance(float32, (bool, list)) and strings in ('category', 'arrow')
+    assert isinstance(max_unique_ratio, (int, float)) and 0 <= max_unique_ratio <= 1 and isinstance(keep_narratives, bool)
+
+    if not keep_narratives:
+        df = df.drop(columns=[col for col in NARRATIVE_COLUMNS if col in df.columns])
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        kind = values.dtype.kind
+        if kind == 'O':
+            if values.nunique(dropna=True) <= max_unique_ratio * max(len(values), 1):
+                values = values.astype('category')
+            elif strings == 'arrow' and pd.api.types.infer_dtype(values, skipna=True) == 'string':
+                values = values.astype('string[pyarrow]')
+        elif kind in 'iu':
+            values = pd.to_numeric(values, downcast='integer' if kind == 'i' else 'unsigned')
+        elif kind == 'f' and (float32 is True or (isinstance(float32, list) and col in float32)):
+            values = values.astype(np.float32)
+        columns[col] = values
+    return pd.DataFrame(columns, index=df.index)
+
+@instrumented
+def memory_report(frames, deep=True):
+    """
+    Report the memory held by one or several DataFrames, e.g. the intermediate tables of the notebook.
+
+    Parameters:
+    - frames (pd.DataFrame or dict): A table, or a dict of name to table.
+    - deep (bool, optional): Whether to count the contents of object columns. Default is True.
+
+    Raises:
+    - AssertionError: If frames is not a DataFrame or a dict of DataFrames.
+
+    Returns:
+    - pd.DataFrame: One row per table and column with 'frame', 'column', 'dtype' and 'mb', plus a
+                    '<total>' row per table, sorted by size within each table.
+    """
+    if isinstance(frames, pd.DataFrame):
+        frames = {'df': frames}
+    assert isinstance(frames, dict) and all(isinstance(f, pd.DataFrame) for f in frames.values())
+
+    rows = []
+    for name, frame in frames.items():
+        usage = frame.memory_usage(index=True, deep=deep) / 1024 ** 2
+        dtypes = frame.dtypes.astype(str)
+        table = pd.DataFrame({'frame': name, 'column': usage.index.astype(str),
+                              'dtype': [dtypes.get(col, 'index') for col in usage.index], 'mb': usage.to_numpy()})
+        table = table.sort_values('mb', ascending=False)
+        total = pd.DataFrame({'frame': [name], 'column': ['<total>'], 'dtype': [''], 'mb': [usage.sum()]})
+        rows.extend([total, table])
+    return pd.concat(rows, ignore_index=True)
+
+_HEX_DIGITS = np.array(['{:02x}'.format(i) for i in range(256)])
+
+@instrumented
+def map_colors(values, vmin, vmax, cmap=plt.cm.YlOrBr):
+    """
+    Map values to hex colors through a colormap in one vectorized call.
+
+    The colormap lookup is done on the whole array, and the RGB bytes are turned into hex strings through a
+    256-entry lookup table, giving the same strings as calling mcolors.to_hex on each value.
+
+    Parameters:
+    - values (array-like): The values to color.
+    - vmin (float or int): The minimum value for color normalization.
+    - vmax (float or int): The maximum value for color normalization.
+    - cmap (matplotlib.colors.Colormap, optional): The colormap. Default is plt.cm.YlOrBr.
+
+    Returns:
+    - np.ndarray: Hex color strings ('#rrggbb'), one per value.
+    """
+    norm = mcolors.Normalize(vmin=vmin, vmax=vmax, clip=True)
+    mapper = plt.cm.ScalarMappable(norm=norm, cmap=cmap)
+    rgb = np.round(mapper.to_rgba(np.asarray(values, dtype=float))[..., :3] * 255).astype(int)
+    return np.char.add(np.char.add(np.char.add('#', _HEX_DIGITS[rgb[..., 0]]), _HEX_DIGITS[rgb[..., 1]]),
+                       _HEX_DIGITS[rgb[..., 2]]).astype(object)
+
+@instrumented
 def makeColorColumn(gdf,variable,vmin,vmax):
     """
     Add a new column to a GeoDataFrame containing color values based on a specified variable.
@@ -49,7 +212,5 @@ def makeColorColumn(gdf,variable,vmin,vmax):
     """
     assert isinstance(gdf, pd.DataFrame) and isinstance(variable, str) and isinstance(vmin, (int, float, np.int64)) and isinstance(vmax, (int, float, np.int64))
     
-    norm = mcolors.Normalize(vmin=vmin, vmax=vmax, clip=True)
-    mapper = plt.cm.ScalarMappable(norm=norm, cmap=plt.cm.YlOrBr)
-    gdf['value_determined_color'] = gdf[variable].apply(lambda x: mcolors.to_hex(mapper.to_rgba(x)))
+    gdf['value_determined_color'] = map_colors(gdf[variable], vmin, vmax)
     return gdf
\ No newline at end of file
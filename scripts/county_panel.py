@@ -0,0 +1,268 @@
+import pandas as pd
+import numpy as np
+from scripts.clean import compact_dtypes
+
+COUNTY_SUFFIXES = [' CITY AND BOROUGH', ' CENSUS AREA', ' MUNICIPALITY', ' COUNTY', ' PARISH', ' BOROUGH']
+
+# county FIPS codes that were retired or renumbered, mapped to their current code
+FIPS_CHANGES = {
+    2270: 2158,     # Wade Hampton Census Area -> Kusilvak Census Area, AK
+    12025: 12086,   # Dade County -> Miami-Dade County, FL
+    46113: 46102,   # Shannon County -> Oglala Lakota County, SD
+    51515: 51019,   # Bedford city -> Bedford County, VA
+    51560: 51005,   # Clifton Forge city -> Alleghany County, VA
+    51780: 51083,   # South Boston city -> Halifax County, VA
+}
+
+def county_key(state_fips, county_fips):
+    """
+    Combine state and county FIPS codes into a single integer county key (e.g. 6 and 37 -> 6037).
+
+    Parameters:
+    - state_fips (array-like): State FIPS codes.
+    - county_fips (array-like): County FIPS codes within the state.
+
+    Returns:
+    - np.ndarray: int64 county keys, with retired codes mapped through FIPS_CHANGES.
+    """
+    keys = np.asarray(state_fips, dtype=np.int64) * 1000 + np.asarray(county_fips, dtype=np.int64)
+    return _apply_fips_changes(keys)
+
+def _apply_fips_changes(keys):
+    """
+    Map retired county keys to their current code.
+
+    Parameters:
+    - keys (np.ndarray): int64 county keys, -1 for missing.
+
+    Returns:
+    - np.ndarray: The county keys with FIPS_CHANGES applied.
+    """
+    keys = keys.copy()
+    for old, new in FIPS_CHANGES.items():
+        keys[keys == old] = new
+    return keys
+
+def normalize_county_name(names, drop_city=False):
+    """
+    Normalize county names so that spelling variants of the same county compare equal.
+
+    Removes accents, upper-cases, turns NOAA's '(C)' into ' CITY', removes suffixes such as ' COUNTY' and ' PARISH',
+    writes 'SAINT'/'SAINTE' as 'ST'/'STE' and drops punctuation and spaces ('St. Mary's' -> 'STMARYS',
+    'De Kalb' -> 'DEKALB').
+
+    Parameters:
+    - names (pd.Series): County names.
+    - drop_city (bool, optional): Whether to also remove one trailing ' CITY'. Default is False.
+
+    Raises:
+    - AssertionError: If names is not a pandas Series.
+
+    Returns:
+    - pd.Series: The normalized names.
+    """
+    assert isinstance(names, pd.Series) and isinstance(drop_city, bool)
+
+    names = names.astype(str).str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+    names = names.str.upper().str.strip().str.replace('(C)', ' CITY', regex=False)
+    names = names.str.replace(r'\s+', ' ', regex=True)
+    for suffix in COUNTY_SUFFIXES:
+        names = names.str.replace(suffix + '$', '', regex=True)
+    if drop_city:
+        names = names.str.replace(' CITY$', '', regex=True)
+    names = names.str.replace(r'\bSAINTE\b', 'STE', regex=True).str.replace(r'\bSAINT\b', 'ST', regex=True)
+    return names.str.replace('&', 'AND', regex=False).str.replace(r"[\s.'\-]", '', regex=True)
+
+def build_county_lookup(counties):
+    """
+    Build the lookup table from (state FIPS, normalized county name) to county key.
+
+    Every county is listed under its full name (NAMELSAD, e.g. 'Baltimore city') and under its short name
+    (NAME) when that is unambiguous; when a county and an independent city share a short name, the
+    short name refers to the county.
+
+    Parameters:
+    - counties (pd.DataFrame): County attributes of cb_2022_us_county_500k with 'STATEFP', 'COUNTYFP',
+                               'STUSPS', 'NAME', 'NAMELSAD' and 'LSAD' columns.
+
+    Raises:
+    - AssertionError: If counties is not a DataFrame.
+
+    Returns:
+    - pd.DataFrame: Columns 'state_fips', 'STUSPS', 'name_key' and 'county_key', unique on (state_fips, name_key).
+    """
+    assert isinstance(counties, pd.DataFrame)
+
+    base = pd.DataFrame({'state_fips': counties['STATEFP'].astype(np.int64).to_numpy(),
+                         'STUSPS': counties['STUSPS'].to_numpy(),
+                         'county_key': county_key(counties['STATEFP'].astype(np.int64), counties['COUNTYFP'].astype(np.int64)),
+                         'is_city': (counties['LSAD'] == '25').to_numpy()})
+    full = base.assign(name_key=normalize_county_name(counties['NAMELSAD']).to_numpy(), alias=False)
+    short = base.assign(name_key=normalize_county_name(counties['NAME']).to_numpy(), alias=True)
+    lookup = pd.concat([full, short], ignore_index=True)
+    lookup.sort_values(['alias', 'is_city'], inplace=True, kind='stable')
+    lookup.drop_duplicates(subset=['state_fips', 'name_key'], keep='first', inplace=True)
+    return lookup[['state_fips', 'STUSPS', 'name_key', 'county_key']].reset_index(drop=True)
+
+def _lookup_names(state_fips, names, lookup):
+    """
+    Look up county keys by state FIPS code and county name, retrying without a trailing 'CITY'.
+
+    Parameters:
+    - state_fips (np.ndarray): int64 state FIPS codes.
+    - names (pd.Series): County names.
+    - lookup (pd.DataFrame): The output of build_county_lookup.
+
+    Returns:
+    - np.ndarray: int64 county keys, -1 where no county matched.
+    """
+    keys = np.full(len(names), -1, dtype=np.int64)
+    index = pd.MultiIndex.from_frame(lookup[['state_fips', 'name_key']])
+    for drop_city in (False, True):
+        todo = np.flatnonzero(keys < 0)
+        if not len(todo):
+            break
+        probe = pd.MultiIndex.from_arrays([state_fips[todo], normalize_county_name(names.iloc[todo], drop_city).to_numpy()])
+        pos = index.get_indexer(probe)
+        keys[todo[pos >= 0]] = lookup['county_key'].to_numpy()[pos[pos >= 0]]
+    return keys
+
+def storm_county_keys(storm, lookup):
+    """
+    Assign a county key to every NOAA storm event.
+
+    County records (CZ_TYPE 'C') are keyed by STATE_FIPS and CZ_FIPS; other records are looked up by name.
+    Events that already carry a 'county_key' column (e.g. from a spatial join) keep it where it is set.
+
+    Parameters:
+    - storm (pd.DataFrame): Storm events with 'STATE_FIPS', 'CZ_TYPE', 'CZ_FIPS' and 'CZ_NAME' columns.
+    - lookup (pd.DataFrame): The output of build_county_lookup.
+
+    Raises:
+    - AssertionError: If storm or lookup is not a DataFrame.
+
+    Returns:
+    - pd.DataFrame: Columns 'county_key' (int64, -1 when unmatched) and 'key_source'
+                    ('given', 'fips', 'name' or 'unmatched'), with the index of storm.
+    """
+    assert isinstance(storm, pd.DataFrame) and isinstance(lookup, pd.DataFrame)
+
+    state = storm['STATE_FIPS'].to_numpy(dtype=np.int64)
+    keys = np.full(len(storm), -1, dtype=np.int64)
+    source = np.full(len(storm), 'unmatched', dtype=object)
+
+    if 'county_key' in storm.columns:
+        given = storm['county_key'].fillna(-1).to_numpy(dtype=np.int64)
+        keys[given >= 0] = given[given >= 0]
+        source[given >= 0] = 'given'
+
+    fips = (keys < 0) & (storm['CZ_TYPE'].astype(str) == 'C').to_numpy()
+    keys[fips] = county_key(state[fips], storm['CZ_FIPS'].to_numpy(dtype=np.int64)[fips])
+    source[fips] = 'fips'
+
+    todo = np.flatnonzero(keys < 0)
+    named = _lookup_names(state[todo], storm['CZ_NAME'].iloc[todo], lookup)
+    keys[todo] = named
+    source[todo[named >= 0]] = 'name'
+    return pd.DataFrame({'county_key': keys, 'key_source': source}, index=storm.index)
+
+def hpi_county_keys(hpi, lookup):
+    """
+    Assign a county key to every row of the FHFA county HPI table.
+
+    Rows are keyed by their 'FIPS code'; rows without a usable code are looked up by 'State' and 'County' name.
+
+    Parameters:
+    - hpi (pd.DataFrame): County HPI rows with 'State' (postal code), 'County' and, if available, 'FIPS code' columns.
+    - lookup (pd.DataFrame): The output of build_county_lookup.
+
+    Raises:
+    - AssertionError: If hpi or lookup is not a DataFrame.
+
+    Returns:
+    - pd.DataFrame: Columns 'county_key' (int64, -1 when unmatched) and 'key_source' ('fips', 'name' or 'unmatched'),
+                    with the index of hpi.
+    """
+    assert isinstance(hpi, pd.DataFrame) and isinstance(lookup, pd.DataFrame)
+
+    keys = np.full(len(hpi), -1, dtype=np.int64)
+    source = np.full(len(hpi), 'unmatched', dtype=object)
+    if 'FIPS code' in hpi.columns:
+        fips = pd.to_numeric(hpi['FIPS code'], errors='coerce').to_numpy()
+        valid = np.isfinite(fips) & (fips > 0)
+        keys[valid] = _apply_fips_changes(fips[valid].astype(np.int64))
+        source[valid] = 'fips'
+
+    todo = np.flatnonzero(keys < 0)
+    states = lookup.drop_duplicates('STUSPS').set_index('STUSPS')['state_fips']
+    state = hpi['State'].iloc[todo].map(states).fillna(-1).to_numpy(dtype=np.int64)
+    named = _lookup_names(state, hpi['County'].iloc[todo], lookup)
+    keys[todo] = named
+    source[todo[named >= 0]] = 'name'
+    return pd.DataFrame({'county_key': keys, 'key_source': source}, index=hpi.index)
+
+def build_county_year_panel(storm, hpi, lookup, storm_year='YEAR', hpi_year='Year', compact=False):
+    """
+    Build the county-year panel of storm frequency and damage joined to the county HPI on integer keys.
+
+    Storm events are aggregated per (county_key, year) before the join, so the join cannot fan out and
+    the panel has exactly one row per HPI county-year. County-years without events get FREQ and DAMAGE 0.
+    storm may also be pre-aggregated (e.g. by aggregate_storm_events): if it has a 'FREQ' column, its
+    counts are summed instead of counting rows.
+
+    Parameters:
+    - storm (pd.DataFrame): Storm events with 'EVENT_ID' (or 'FREQ'), 'DAMAGE' and the columns used by storm_county_keys.
+    - hpi (pd.DataFrame): County HPI rows with the columns used by hpi_county_keys and a year column.
+    - lookup (pd.DataFrame): The output of build_county_lookup.
+    - storm_year (str, optional): Name of the year column of storm. Default is 'YEAR'.
+    - hpi_year (str, optional): Name of the year column of hpi. Default is 'Year'.
+    - compact (bool, optional): Whether to apply clean.compact_dtypes to the panel. Default is False.
+
+    Raises:
+    - AssertionError: If any input argument is not of the expected type.
+
+    Returns:
+    - tuple: (panel, coverage). panel is the HPI table with 'county_key', 'FREQ' and 'DAMAGE' columns added;
+             coverage is a dict with the row counts matched at each step.
+    """
+    assert isinstance(storm, pd.DataFrame) and isinstance(hpi, pd.DataFrame) and isinstance(lookup, pd.DataFrame)
+    assert isinstance(storm_year, str) and isinstance(hpi_year, str) and isinstance(compact, bool)
+
+    storm_keys = storm_county_keys(storm, lookup)
+    hpi_keys = hpi_county_keys(hpi, lookup)
+
+    keyed = storm_keys['county_key'].to_numpy() >= 0
+    events = pd.DataFrame({'county_key': storm_keys['county_key'].to_numpy()[keyed],
+                           hpi_year: storm[storm_year].to_numpy(dtype=np.int64)[keyed],
+                           'FREQ': storm['FREQ'].to_numpy(dtype=np.int64)[keyed] if 'FREQ' in storm.columns
+                                   else storm['EVENT_ID'].notna().to_numpy(dtype=np.int64)[keyed],
+                           'DAMAGE': storm['DAMAGE'].to_numpy(dtype=float)[keyed]})
+    county_year = events.groupby(['county_key', hpi_year], sort=False)[['FREQ', 'DAMAGE']].sum()
+
+    panel = hpi.assign(county_key=hpi_keys['county_key'].to_numpy())
+    panel = panel[panel['county_key'] >= 0]
+    panel[hpi_year] = panel[hpi_year].astype(np.int64)
+    duplicates = int(panel.duplicated(subset=['county_key', hpi_year]).sum())
+    panel = panel.drop_duplicates(subset=['county_key', hpi_year], keep='first')
+    panel = panel.merge(county_year, left_on=['county_key', hpi_year], right_index=True, how='left')
+    matched_groups = panel['FREQ'].notna()
+    panel['FREQ'] = panel['FREQ'].fillna(0).astype(np.int64)
+    panel['DAMAGE'] = panel['DAMAGE'].fillna(0)
+
+    coverage = {
+        'storm_rows': len(storm),
+        'storm_keyed': int(keyed.sum()),
+        'storm_key_sources': storm_keys['key_source'].value_counts().to_dict(),
+        'storm_in_panel': int(panel['FREQ'].sum()),
+        'storm_county_years': len(county_year),
+        'storm_county_years_in_panel': int(matched_groups.sum()),
+        'hpi_rows': len(hpi),
+        'hpi_keyed': int((hpi_keys['county_key'] >= 0).sum()),
+        'hpi_key_sources': hpi_keys['key_source'].value_counts().to_dict(),
+        'hpi_duplicates_dropped': duplicates,
+        'panel_rows': len(panel),
+    }
+    panel = panel.reset_index(drop=True)
+    if compact:
+        panel = compact_dtypes(panel)
+    return panel, coverage
@@ -0,0 +1,177 @@
+import pandas as pd
+import numpy as np
+from scipy import stats
+from scripts.instrument import instrumented
+
+def event_period_bounds(events, freq='year'):
+    """
+    Convert event begin and end dates to integer period numbers of an annual or quarterly panel.
+
+    Parameters:
+    - events (pd.DataFrame): Events with 'begin' and 'end' Timestamp columns (e.g. event_study.read_billion_events).
+    - freq (str, optional): 'year' for Year numbers or 'quarter' for Year * 4 + Quarter - 1. Default is 'year'.
+
+    Raises:
+    - AssertionError: If events lacks the date columns or freq is unknown.
+
+    Returns:
+    - tuple: (start, stop) int64 arrays with the periods of the begin and end dates.
+    """
+    assert isinstance(events, pd.DataFrame) and 'begin' in events.columns and 'end' in events.columns
+    assert freq in ('year', 'quarter')
+
+    bounds = []
+    for col in ('begin', 'end'):
+        dates = pd.to_datetime(events[col])
+        period = dates.dt.year.to_numpy(dtype=np.int64)
+        if freq == 'quarter':
+            period = period * 4 + (dates.dt.month.to_numpy(dtype=np.int64) - 1) // 3
+        bounds.append(period)
+    return bounds[0], bounds[1]
+
+def _window_means(cum, count, lo, hi):
+    """
+    Mean of every unit over the period columns lo..hi-1 of each event, from cumulative sums.
+
+    Parameters:
+    - cum (np.ndarray): A (units, periods + 1) cumulative sum of the values with NaN as 0 and a leading 0 column.
+    - count (np.ndarray): The matching cumulative count of observed values.
+    - lo (np.ndarray): First column of every event window.
+    - hi (np.ndarray): One past the last column of every event window.
+
+    Returns:
+    - np.ndarray: A (units, events) array of window means, NaN unless every period of the window is observed
+                  and the window lies inside the panel.
+    """
+    inside = (lo >= 0) & (hi <= cum.shape[1] - 1) & (hi > lo)
+    lo, hi = np.clip(lo, 0, cum.shape[1] - 1), np.clip(hi, 0, cum.shape[1] - 1)
+    n = count[:, hi] - count[:, lo]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (cum[:, hi] - cum[:, lo]) / n
+    return np.where(inside & (n == hi - lo), mean, np.nan)
+
+@instrumented
+def did_effects(panel, events, unit, time, outcome='HPI', exposure='DAMAGE', treated=None, freq='year',
+                pre=2, post=2, min_exposure=0, log=True, weight=None):
+    """
+    Estimate difference-in-differences effects of every event at once on a county or state panel.
+
+    For each event the outcome change of a unit is the mean over the post periods after the event's end
+    minus the mean over the pre periods before its begin. Units whose exposure summed over the event
+    periods exceeds min_exposure are treated, and units with zero exposure are controls; alternatively the
+    treated unit-event pairs can be given. The per-event effect is the mean change of the treated minus
+    that of the controls, with a Welch standard error. The pooled effect averages the per-event effects
+    with equal weights or by an event column such as 'cost'.
+
+    With the default exposure treatment a unit counts as treated by any damage in the event's periods, not
+    damage from that event, so events with the same begin and end periods get the same treated and control
+    groups and identical effects; per-event effects are only meaningful with event-specific treated pairs.
+    The pooled standard error is clustered by unit, so events that reuse the same units, and in particular
+    such duplicated windows, are not counted as independent estimates.
+
+    All events are handled together: window means come from cumulative sums of the dense unit x period
+    matrix, gathered with one fancy-indexing step per bound, and treatment masks are (units, events) arrays.
+
+    Parameters:
+    - panel (pd.DataFrame): Long panel with the unit, time, outcome and (unless treated is given) exposure columns.
+    - events (pd.DataFrame): Events with 'begin' and 'end' dates, e.g. event_study.read_billion_events(['US']).
+    - unit (str or list): Column(s) identifying a unit, e.g. 'county_key' or ['State'].
+    - time (str): Integer period column of the panel, matching freq (e.g. 'Year').
+    - outcome (str, optional): Outcome column. Default is 'HPI'.
+    - exposure (str, optional): Column whose sum over the event periods defines treatment. Default is 'DAMAGE'.
+    - treated (pd.DataFrame, optional): Treated pairs with 'event' (row position in events) and the unit columns.
+                                        Default is None, which uses exposure; units not listed are then controls.
+    - freq (str, optional): 'year' or 'quarter', the period of time. Default is 'year'.
+    - pre (int, optional): Number of periods before the begin period in the pre window. Default is 2.
+    - post (int, optional): Number of periods after the end period in the post window. Default is 2.
+    - min_exposure (float, optional): Exposure above which a unit is treated. Default is 0.
+    - log (bool, optional): Whether to difference the log of the outcome, giving approximate growth rates. Default is True.
+    - weight (str, optional): Event column weighting the pooled effect, e.g. 'cost'. Default is None for equal weights.
+
+    Raises:
+    - AssertionError: If any input argument is not of the expected type.
+
+    Returns:
+    - tuple: (effects, pooled). effects has one row per event with the event columns and 'n_treated', 'n_control',
+             'change_treated', 'change_control', 'effect', 'se', 't' and 'p'; pooled is a one-row DataFrame with
+             'events', 'windows' (distinct begin-end periods), 'weight', 'effect', 'se', 't' and 'p' over the
+             events with an estimate.
+    """
+    unit = [unit] if isinstance(unit, str) else unit
+    assert isinstance(panel, pd.DataFrame) and isinstance(events, pd.DataFrame) and isinstance(unit, list)
+    assert isinstance(time, str) and all(c in panel.columns for c in unit + [time, outcome])
+    assert treated is None or (isinstance(treated, pd.DataFrame) and 'event' in treated.columns)
+    assert treated is not None or exposure in panel.columns
+    assert isinstance(pre, int) and pre > 0 and isinstance(post, int) and post > 0 and isinstance(log, bool)
+    assert weight is None or weight in events.columns
+
+    codes, units = pd.factorize(pd.MultiIndex.from_frame(panel[unit]) if len(unit) > 1 else panel[unit[0]])
+    periods = panel[time].to_numpy(dtype=np.int64)
+    first = int(periods.min())
+    cols = periods - first
+    shape = (len(units), int(cols.max()) + 1)
+
+    values = np.full(shape, np.nan)
+    values[codes, cols] = np.log(panel[outcome].to_numpy(dtype=float)) if log else panel[outcome].to_numpy(dtype=float)
+    observed = np.isfinite(values)
+    cum = np.zeros((shape[0], shape[1] + 1))
+    count = np.zeros((shape[0], shape[1] + 1), dtype=np.int64)
+    np.cumsum(np.where(observed, values, 0), axis=1, out=cum[:, 1:])
+    np.cumsum(observed, axis=1, out=count[:, 1:])
+
+    start, stop = event_period_bounds(events, freq)
+    start, stop = start - first, stop - first
+    change = _window_means(cum, count, stop + 1, stop + 1 + post) - _window_means(cum, count, start - pre, start)
+
+    if treated is None:
+        exposed = np.zeros(shape)
+        exposed[codes, cols] = panel[exposure].fillna(0).to_numpy(dtype=float)
+        cum_exposed = np.zeros((shape[0], shape[1] + 1))
+        np.cumsum(exposed, axis=1, out=cum_exposed[:, 1:])
+        lo, hi = np.clip(start, 0, shape[1]), np.clip(stop + 1, 0, shape[1])
+        total = cum_exposed[:, hi] - cum_exposed[:, lo]
+        is_treated = total > min_exposure
+        is_control = total == 0
+    else:
+        keys = pd.MultiIndex.from_frame(treated[unit]) if len(unit) > 1 else treated[unit[0]]
+        rows = pd.Index(units).get_indexer(keys)
+        known = rows >= 0
+        is_treated = np.zeros((shape[0], len(events)), dtype=bool)
+        is_treated[rows[known], treated['event'].to_numpy(dtype=np.int64)[known]] = True
+        is_control = ~is_treated
+
+    valid = np.isfinite(change)
+    t_mask, c_mask = is_treated & valid, is_control & valid
+    diff = np.where(valid, change, 0)
+    n_t, n_c = t_mask.sum(axis=0), c_mask.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_t = np.einsum('ue,ue->e', diff, t_mask) / n_t
+        mean_c = np.einsum('ue,ue->e', diff, c_mask) / n_c
+        var_t = np.einsum('ue,ue->e', (diff - mean_t) ** 2, t_mask) / (n_t - 1)
+        var_c = np.einsum('ue,ue->e', (diff - mean_c) ** 2, c_mask) / (n_c - 1)
+        effect = mean_t - mean_c
+        se = np.sqrt(var_t / n_t + var_c / n_c)
+        t = effect / se
+    p = 2 * stats.norm.sf(np.abs(t))
+
+    effects = events.reset_index(drop=True).copy()
+    effects['n_treated'], effects['n_control'] = n_t, n_c
+    effects['change_treated'], effects['change_control'] = mean_t, mean_c
+    effects['effect'], effects['se'], effects['t'], effects['p'] = effect, se, t, p
+
+    ok = np.isfinite(effect) & np.isfinite(se)
+    w = np.ones(len(events)) if weight is None else events[weight].to_numpy(dtype=float)
+    w = np.where(ok & np.isfinite(w), w, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pooled_effect = np.sum(w * np.where(ok, effect, 0)) / w.sum()
+        # influence of every unit on the pooled effect, summed over the events it takes part in
+        influence = np.where(t_mask, (diff - np.where(ok, mean_t, 0)) / np.where(ok, n_t, 1), 0) \
+            - np.where(c_mask, (diff - np.where(ok, mean_c, 0)) / np.where(ok, n_c, 1), 0)
+        influence = influence @ w / w.sum()
+        clusters = int(((t_mask | c_mask) & (w > 0)).any(axis=1).sum())
+        pooled_se = np.sqrt(clusters / (clusters - 1) * np.sum(influence ** 2))
+    windows = len(set(zip(start[w > 0].tolist(), stop[w > 0].tolist())))
+    pooled = pd.DataFrame({'events': [int((w > 0).sum())], 'windows': [windows], 'weight': [weight or 'equal'],
+                           'effect': [pooled_effect], 'se': [pooled_se], 't': [pooled_effect / pooled_se],
+                           'p': [2 * stats.norm.sf(abs(pooled_effect / pooled_se))]})
+    return effects, pooled
@@ -0,0 +1,306 @@
+import pandas as pd
+import numpy as np
+import os
+from scripts.instrument import instrumented
+
+MSA_PATH = "/dataset/datasets/dataMSA_full.csv"
+
+EVENT_PATHS = {
+    'US': "/dataset/datasets/events-US-1980-2023.csv",
+    'TX': "/dataset/datasets/events-TX-1980-2023.csv",
+    'CA': "/dataset/datasets/events-CA-1980-2023.csv",
+}
+
+TIERS = ['Overall', 'Low', 'Mid', 'High']
+
+# counties and towns named in the event 'City' lists that lie in each metro, besides the cities in the metro name
+METRO_ALIASES = {
+    'Austin-Round Rock': ['Georgetown', 'San Marcos', 'Travis', 'Williamson', 'Hays'],
+    'Houston-The Woodlands-Sugar Land': ['Galveston', 'Brazoria', 'Liberty', 'Montgomery', 'Fort Bend', 'Harris',
+                                         'Conroe', 'Baytown', 'Pasadena', 'League City'],
+    'Dallas-Fort Worth-Arlington': ['Tarrant', 'Collin', 'Denton', 'Plano', 'Irving', 'Celina', 'Pilot Point',
+                                    'Azle', 'Springtown', 'Granbury', 'Lipan', 'Bridgeport', 'Chico', 'Poolville',
+                                    'Millsap', 'Weatherford'],
+    'Dallas-Plano-Irving': ['Collin', 'Denton', 'Celina', 'Pilot Point'],
+    'Fort Worth-Arlington': ['Tarrant', 'Azle', 'Springtown', 'Granbury', 'Lipan', 'Bridgeport', 'Chico',
+                             'Poolville', 'Millsap', 'Weatherford'],
+    'San Antonio-New Braunfels': ['Bexar'],
+    'Killeen-Temple': ['Bell', 'Coryell', 'Belton'],
+    'College Station-Bryan': ['Brazos'],
+    'Amarillo': ['Potter', 'Randall', 'Canyon'],
+    'Sherman-Denison': ['Grayson', 'Whitesboro', 'Pottsboro', 'Van Alstyne'],
+}
+
+def _place(name):
+    """
+    Normalize a city or county name for matching, e.g. ' Dallas County' -> 'dallas'.
+
+    Parameters:
+    - name (str): The city or county name.
+
+    Returns:
+    - str: The name stripped, lower-cased and without a trailing ' county'.
+    """
+    name = name.strip().lower()
+    return name[:-7] if name.endswith(' county') else name
+
+@instrumented
+def read_msa_hpi(path=MSA_PATH):
+    """
+    Read the quarterly metro HPI table and add an integer quarter number.
+
+    Parameters:
+    - path (str, optional): The CSV file path, relative to the working directory. Default is MSA_PATH.
+
+    Raises:
+    - AssertionError: If path is not a string.
+    - FileNotFoundError: If the file does not exist.
+
+    Returns:
+    - pd.DataFrame: Columns 'Area', 'Year', 'Quarter', '<tier>_hpi' and '<tier>_YoY' for every tier, and 'period'
+                    (Year * 4 + Quarter - 1).
+    """
+    assert isinstance(path, str) and len(path) > 0
+
+    try:
+        msa = pd.read_csv(os.getcwd() + path)
+    except FileNotFoundError:
+        raise FileNotFoundError("File not found: {}".format(path))
+    msa['period'] = msa['Year'].to_numpy(dtype=np.int64) * 4 + msa['Quarter'].to_numpy(dtype=np.int64) - 1
+    return msa
+
+@instrumented
+def read_billion_events(scopes=['US', 'TX', 'CA'], paths=EVENT_PATHS):
+    """
+    Read the billion-dollar disaster lists into one table.
+
+    The files start with a title line; their 'Begin Date' and 'End Date' are yyyymmdd. The Texas list repeats
+    both dates as m/d/yyyy and has a comma-separated 'City' column naming the affected places.
+
+    Parameters:
+    - scopes (list, optional): Keys of paths to read. Default is ['US', 'TX', 'CA'].
+    - paths (dict, optional): Scope to CSV file path, relative to the working directory. Default is EVENT_PATHS.
+
+    Raises:
+    - AssertionError: If scopes is not a list of keys of paths.
+
+    Returns:
+    - pd.DataFrame: One row per event and scope with 'scope', 'Name', 'Disaster', 'begin' and 'end' (Timestamps), 'period'
+                    (quarter number of the begin date), 'cost' (CPI-adjusted millions of dollars), 'deaths' and
+                    'places' (list of normalized place names, empty when the list has no 'City' column).
+    """
+    assert isinstance(scopes, list) and isinstance(paths, dict) and all(s in paths for s in scopes)
+
+    frames = []
+    for scope in scopes:
+        raw = pd.read_csv(os.getcwd() + paths[scope], skiprows=1)
+        begin = pd.to_datetime(raw['Begin Date'].astype(str), format='%Y%m%d')
+        end_column = raw.columns[raw.columns.get_loc('Begin Date.1') + 1] if 'Begin Date.1' in raw.columns else 'End Date'
+        end = pd.to_datetime(raw[end_column].astype(str), format='%Y%m%d')
+        cities = raw['City'] if 'City' in raw.columns else pd.Series('', index=raw.index)
+        frames.append(pd.DataFrame({
+            'scope': scope,
+            'Name': raw['Name'],
+            'Disaster': raw['Disaster'],
+            'begin': begin,
+            'end': end,
+            'period': begin.dt.year.to_numpy(dtype=np.int64) * 4 + (begin.dt.month.to_numpy(dtype=np.int64) - 1) // 3,
+            'cost': raw['Total CPI-Adjusted Cost (Millions of Dollars)'].astype(float),
+            'deaths': raw['Deaths'],
+            'places': [[_place(c) for c in str(s).split(',') if c.strip()] for s in cities.fillna('')],
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+def metro_places(area, aliases=METRO_ALIASES):
+    """
+    List the normalized place names that identify a metro: the cities in its name and its aliases.
+
+    Parameters:
+    - area (str): The metro name, e.g. 'Austin-Round Rock'.
+    - aliases (dict, optional): Metro name to extra place names. Default is METRO_ALIASES.
+
+    Returns:
+    - set: The normalized place names.
+    """
+    return {_place(p) for p in area.split('-') + aliases.get(area, [])}
+
+@instrumented
+def event_metro_pairs(events, areas, broadcast=['US'], aliases=METRO_ALIASES):
+    """
+    Pair events with the metros they affect.
+
+    An event with a place list is paired with every metro one of its places belongs to. An event of a
+    broadcast scope is paired with every metro, unless another scope lists the same event with places,
+    in which case only the place matches are used (e.g. a US hurricane that the TX list places on the coast).
+
+    Parameters:
+    - events (pd.DataFrame): The output of read_billion_events.
+    - areas (list): The metro names.
+    - broadcast (list, optional): Scopes whose events without places affect every metro. Default is ['US'].
+    - aliases (dict, optional): Metro name to extra place names. Default is METRO_ALIASES.
+
+    Raises:
+    - AssertionError: If events is not a DataFrame or areas/broadcast are not lists.
+
+    Returns:
+    - pd.DataFrame: One row per event-metro pair with 'event' (row position in events), 'Area' and 'match'
+                    ('place' or 'broadcast').
+    """
+    assert isinstance(events, pd.DataFrame) and isinstance(areas, list) and isinstance(broadcast, list)
+
+    place_area = pd.DataFrame([(p, a) for a in areas for p in metro_places(a, aliases)], columns=['place', 'Area'])
+    exploded = pd.DataFrame({'event': np.arange(len(events))}).assign(place=events['places'].to_numpy()).explode('place')
+    matched = exploded.merge(place_area, on='place')[['event', 'Area']].assign(match='place')
+
+    placed = (events['places'].str.len() > 0).to_numpy()
+    wide = np.flatnonzero(events['scope'].isin(broadcast).to_numpy() & ~placed
+                          & ~events['Name'].isin(events['Name'][placed]).to_numpy())
+    broad = pd.DataFrame({'event': np.repeat(wide, len(areas)), 'Area': np.tile(np.array(areas, dtype=object), len(wide)),
+                          'match': 'broadcast'})
+
+    pairs = pd.concat([matched, broad], ignore_index=True).drop_duplicates(subset=['event', 'Area'])
+    return pairs.sort_values(['event', 'Area']).reset_index(drop=True)
+
+def tier_returns(msa, tiers=TIERS, benchmark='seasonal'):
+    """
+    Build the metro x quarter matrices of quarterly log HPI returns and abnormal returns for each tier.
+
+    Parameters:
+    - msa (pd.DataFrame): The output of read_msa_hpi.
+    - tiers (list, optional): Price tiers. Default is TIERS.
+    - benchmark (str, optional): 'seasonal' subtracts the metro's mean return in the same quarter of the year, which
+                                 removes the quarterly seasonality of house prices; 'mean' subtracts the metro's
+                                 overall mean return; 'market' subtracts the mean return of all metros in the same
+                                 quarter; None keeps raw returns. Default is 'seasonal'.
+
+    Raises:
+    - AssertionError: If msa is not a DataFrame, a tier column is missing, or benchmark is unknown.
+
+    Returns:
+    - tuple: (areas, first_period, returns) where areas is the list of metros (matrix rows), first_period is the
+             quarter number of column 0 and returns is a dict of tier to an (areas, quarters) float array of
+             abnormal returns, NaN where the metro has no data.
+    """
+    assert isinstance(msa, pd.DataFrame) and isinstance(tiers, list)
+    assert all(t + '_hpi' in msa.columns for t in tiers) and benchmark in ('seasonal', 'mean', 'market', None)
+
+    codes, areas = pd.factorize(msa['Area'], sort=True)
+    first = int(msa['period'].min())
+    cols = msa['period'].to_numpy(dtype=np.int64) - first
+    shape = (len(areas), int(cols.max()) + 1)
+
+    returns = {}
+    for tier in tiers:
+        level = np.full(shape, np.nan)
+        level[codes, cols] = np.log(msa[tier + '_hpi'].to_numpy(dtype=float))
+        r = np.full(shape, np.nan)
+        r[:, 1:] = np.diff(level, axis=1)
+        observed = np.isfinite(r)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if benchmark == 'seasonal':
+                season = (first + np.arange(shape[1])) % 4
+                sums = np.stack([np.nansum(r[:, season == q], axis=1) for q in range(4)], axis=1)
+                counts = np.stack([observed[:, season == q].sum(axis=1) for q in range(4)], axis=1)
+                r = r - (sums / counts)[:, season]
+            elif benchmark is not None:
+                axis = 0 if benchmark == 'market' else 1
+                r = r - np.nansum(r, axis=axis, keepdims=True) / observed.sum(axis=axis, keepdims=True)
+        returns[tier] = r
+    return list(areas), first, returns
+
+def event_window_matrix(values, rows, cols, window=(-8, 12)):
+    """
+    Gather an event-by-relative-period matrix from a unit x period matrix with one fancy-indexing step.
+
+    Parameters:
+    - values (np.ndarray): A (units, periods) float array.
+    - rows (np.ndarray): Unit row of every event.
+    - cols (np.ndarray): Period column of every event (event period 0).
+    - window (tuple, optional): First and last relative period, inclusive. Default is (-8, 12).
+
+    Returns:
+    - np.ndarray: An (events, window length) array, NaN where the window leaves the matrix.
+    """
+    rel = np.arange(window[0], window[1] + 1)
+    at = np.asarray(cols, dtype=np.int64)[:, None] + rel
+    inside = (at >= 0) & (at < values.shape[1])
+    out = values[np.asarray(rows, dtype=np.int64)[:, None], np.clip(at, 0, values.shape[1] - 1)]
+    return np.where(inside, out, np.nan)
+
+@instrumented
+def event_study(msa, events, pairs=None, tiers=TIERS, window=(-8, 12), benchmark='seasonal', min_coverage=0.5,
+                cluster='period'):
+    """
+    Compute average abnormal returns (AAR) of metro HPI by price tier around billion-dollar events.
+
+    Every event-metro pair is aligned on the quarter of the event's begin date; all pairs of a tier are
+    gathered at once with event_window_matrix. Pairs with less than min_coverage of the window observed are
+    dropped. CAAR accumulates the AAR from the first quarter of the window. The 'market' benchmark is only
+    informative for events that hit some metros and not others; a broadcast event moves every metro and is
+    removed by it.
+
+    Pairs are not independent: a broadcast event is paired with every metro, and events that begin in the
+    same quarter share the same calendar returns. Standard errors are therefore clustered, by default on the
+    calendar quarter of the event's begin date, which also groups all pairs of an event.
+
+    Parameters:
+    - msa (pd.DataFrame): The output of read_msa_hpi.
+    - events (pd.DataFrame): The output of read_billion_events.
+    - pairs (pd.DataFrame, optional): The output of event_metro_pairs. Default is None, which pairs events with the metros of msa.
+    - tiers (list, optional): Price tiers. Default is TIERS.
+    - window (tuple, optional): First and last relative quarter, inclusive. Default is (-8, 12).
+    - benchmark (str, optional): Abnormal return benchmark, see tier_returns. Default is 'seasonal'.
+    - min_coverage (float, optional): Minimum share of observed quarters for a pair to be used. Default is 0.5.
+    - cluster (str, optional): 'period' to cluster standard errors on the begin quarter, 'event' on the event, or
+                               None for independent pairs. Default is 'period'.
+
+    Raises:
+    - AssertionError: If any input argument is not of the expected type.
+
+    Returns:
+    - tuple: (aar, ar). aar has one row per tier and relative quarter with 'tier', 'rel_quarter', 'aar',
+             'caar', 'n', 'clusters', 'se' and 't'; ar has one row per used pair with 'event', 'Area', 'tier' and one
+             column per relative quarter holding its abnormal return.
+    """
+    assert isinstance(msa, pd.DataFrame) and isinstance(events, pd.DataFrame)
+    assert pairs is None or isinstance(pairs, pd.DataFrame)
+    assert isinstance(window, tuple) and len(window) == 2 and window[0] <= 0 <= window[1]
+    assert isinstance(min_coverage, (int, float)) and 0 <= min_coverage <= 1
+    assert cluster in ('period', 'event', None)
+
+    areas, first, returns = tier_returns(msa, tiers, benchmark)
+    pairs = event_metro_pairs(events, areas) if pairs is None else pairs
+    pairs = pairs[pairs['Area'].isin(areas)]
+    rows = pd.Index(areas).get_indexer(pairs['Area'])
+    cols = events['period'].to_numpy(dtype=np.int64)[pairs['event'].to_numpy()] - first
+    rel = np.arange(window[0], window[1] + 1)
+    if cluster is None:
+        groups = np.arange(len(pairs))
+    else:
+        groups = pd.factorize(cols if cluster == 'period' else pairs['event'].to_numpy())[0]
+
+    aar, ar = [], []
+    for tier in tiers:
+        m = event_window_matrix(returns[tier], rows, cols, window)
+        keep = np.isfinite(m).mean(axis=1) >= min_coverage
+        m = m[keep]
+        observed = np.isfinite(m)
+        n = observed.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(m, axis=0) / n
+            # cluster-robust variance of the mean: squared sums of deviations within each cluster
+            g = groups[keep]
+            deviations = np.zeros((g.max() + 1 if len(g) else 0, len(rel)))
+            np.add.at(deviations, g, np.where(observed, m - mean, 0))
+            present = np.zeros(deviations.shape, dtype=bool)
+            np.logical_or.at(present, g, observed)
+            n_clusters = present.sum(axis=0)
+            se = np.sqrt(n_clusters / (n_clusters - 1) * (deviations ** 2).sum(axis=0)) / n
+        aar.append(pd.DataFrame({'tier': tier, 'rel_quarter': rel, 'aar': mean, 'caar': np.nancumsum(mean),
+                                 'n': n, 'clusters': n_clusters, 'se': se, 't': mean / se}))
+        frame = pd.DataFrame(m, columns=rel)
+        frame.insert(0, 'tier', tier)
+        frame.insert(0, 'Area', pairs['Area'].to_numpy()[keep])
+        frame.insert(0, 'event', pairs['event'].to_numpy()[keep])
+        ar.append(frame)
+    return pd.concat(aar, ignore_index=True), pd.concat(ar, ignore_index=True)
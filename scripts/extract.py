@@ -1,8 +1,279 @@
 import pandas as pd
+import numpy as np
 import os
 import glob
 import geopandas as gpd
+import hashlib
+import json
+import pickle
+import time
+import pyarrow as pa
+import pyarrow.feather as feather
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from pandas.api.types import union_categoricals
+from scripts.instrument import instrumented
+from scripts.clean import compact_dtypes
 
+CACHE_DIR = "/.cache"
+CACHE_MAX_BYTES = 4 * 1024 ** 3
+
+def _file_sha256(file, chunk_size=1 << 20):
+    """
+    Compute the SHA-256 digest of a file's content.
+
+    Parameters:
+    - file (str): The file path.
+    - chunk_size (int, optional): Number of bytes read at a time. Default is 1 MiB.
+
+    Returns:
+    - str: The hexadecimal digest.
+    """
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _load_cache_index(root):
+    """
+    Load the cache index of a cache directory, or an empty index if there is none.
+
+    Parameters:
+    - root (str): The absolute cache directory.
+
+    Returns:
+    - dict: The index with an 'entries' and a 'hashes' mapping.
+    """
+    try:
+        with open(os.path.join(root, "index.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"entries": {}, "hashes": {}}
+
+def _save_cache_index(root, cache_index):
+    """
+    Atomically write the cache index of a cache directory.
+
+    Parameters:
+    - root (str): The absolute cache directory.
+    - cache_index (dict): The index to write.
+
+    Returns:
+    None
+    """
+    tmp = os.path.join(root, "index.json.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(cache_index, f)
+    os.replace(tmp, os.path.join(root, "index.json"))
+
+def _source_fingerprint(file, cache_index):
+    """
+    Describe a source file by its path, size, mtime and content hash.
+
+    The content hash is only recomputed when the size or mtime recorded in the index changed.
+
+    Parameters:
+    - file (str): The absolute source file path.
+    - cache_index (dict): The cache index holding previously computed hashes.
+
+    Returns:
+    - list: [path, size, mtime_ns, sha256].
+    """
+    st = os.stat(file)
+    known = cache_index["hashes"].get(file)
+    if known is None or known["size"] != st.st_size or known["mtime_ns"] != st.st_mtime_ns:
+        known = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": _file_sha256(file)}
+        cache_index["hashes"][file] = known
+    return [file, st.st_size, st.st_mtime_ns, known["sha256"]]
+
+def _evict_cache(root, cache_index, max_bytes, keep=None):
+    """
+    Delete least recently used cache entries until the cache fits in max_bytes.
+
+    Parameters:
+    - root (str): The absolute cache directory.
+    - cache_index (dict): The cache index, updated in place.
+    - max_bytes (int): The size budget of the cache directory.
+    - keep (str, optional): Key of an entry that must not be evicted. Default is None.
+
+    Returns:
+    None
+    """
+    entries = cache_index["entries"]
+    total = sum(entry["bytes"] for entry in entries.values())
+    for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        total -= entries[key]["bytes"]
+        _remove_cache_entry(root, cache_index, key)
+
+def _remove_cache_entry(root, cache_index, key):
+    """
+    Delete one cache entry and its file.
+
+    Parameters:
+    - root (str): The absolute cache directory.
+    - cache_index (dict): The cache index, updated in place.
+    - key (str): The key of the entry to delete.
+
+    Returns:
+    None
+    """
+    cache_index["entries"].pop(key, None)
+    try:
+        os.remove(os.path.join(root, key + ".feather"))
+    except FileNotFoundError:
+        pass
+
+def _arrow_safe(df):
+    """
+    Convert a DataFrame to an Arrow table for Feather, keeping columns Arrow cannot type exactly.
+
+    Mixed-type object columns are pickled value by value, and categoricals with mixed-type categories are
+    stored as their codes with the pickled categories. The schema metadata records both, so that _from_arrow
+    restores the original values and types and a cache hit returns the same frame as the build.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame to be written.
+
+    Returns:
+    - pa.Table: The table, with a default index.
+    """
+    df = df.reset_index(drop=True)
+    pickled, categories = [], {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            try:
+                pa.array(df[col].cat.categories, from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                dtype = df[col].dtype
+                categories[col] = pickle.dumps((list(dtype.categories), dtype.ordered)).hex()
+                df[col] = df[col].cat.codes
+        elif df[col].dtype == object:
+            try:
+                pa.array(df[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                df[col] = [pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL) for v in df[col].to_numpy()]
+                pickled.append(col)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'pickled_columns'] = json.dumps({'values': pickled, 'categories': categories}).encode()
+    return table.replace_schema_metadata(metadata)
+
+def _from_arrow(table):
+    """
+    Convert a table written by _arrow_safe back to the DataFrame it was built from.
+
+    Parameters:
+    - table (pa.Table): The table read from the cache.
+
+    Returns:
+    - pd.DataFrame: The DataFrame.
+    """
+    pickled = json.loads((table.schema.metadata or {}).get(b'pickled_columns', b'{}'))
+    df = table.to_pandas(split_blocks=True)
+    for col, encoded in pickled.get('categories', {}).items():
+        categories, ordered = pickle.loads(bytes.fromhex(encoded))
+        df[col] = pd.Categorical.from_codes(df[col].to_numpy(), categories=categories, ordered=ordered)
+    for col in df.columns[df.dtypes == object]:
+        if col in pickled.get('values', []):
+            df[col] = pd.Series([pickle.loads(v) for v in df[col].to_numpy()], index=df.index, dtype=object)
+        else:
+            df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+@instrumented
+def cached_frame(sources, build, params=None, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """
+    Return the DataFrame produced by build(), cached on disk as an uncompressed Feather file.
+
+    Entries are keyed on the path, size, mtime and content hash of every source file plus params,
+    so changed inputs rebuild automatically and replace their stale entry. Hits are memory-mapped.
+    The cache is kept under max_bytes by evicting least recently used entries.
+
+    Parameters:
+    - sources (list): Absolute paths of the files build() reads.
+    - build (callable): Zero-argument function returning the pd.DataFrame to cache.
+    - params (dict, optional): JSON-serializable parameters that also determine the result. Default is None.
+    - cache_dir (str, optional): Cache directory relative to the working directory. Default is CACHE_DIR.
+    - max_bytes (int, optional): Size budget of the cache directory. Default is CACHE_MAX_BYTES.
+
+    Raises:
+    - AssertionError: If sources is not a list, build is not callable, or params is not a dict.
+
+    Returns:
+    - pd.DataFrame: The cached or freshly built DataFrame.
+    """
+    assert isinstance(sources, list) and callable(build) and (params is None or isinstance(params, dict))
+    assert isinstance(cache_dir, str) and isinstance(max_bytes, int) and max_bytes > 0
+
+    root = os.getcwd() + cache_dir
+    os.makedirs(root, exist_ok=True)
+    cache_index = _load_cache_index(root)
+
+    sources = sorted(sources)
+    params = json.dumps(params or {}, sort_keys=True, default=str)
+    slot = hashlib.sha256(json.dumps([sources, params]).encode()).hexdigest()
+    fingerprint = [_source_fingerprint(file, cache_index) for file in sources]
+    key = hashlib.sha256(json.dumps([fingerprint, params]).encode()).hexdigest()
+    file = os.path.join(root, key + ".feather")
+
+    if key in cache_index["entries"] and os.path.exists(file):
+        cache_index["entries"][key]["last_used"] = time.time()
+        _save_cache_index(root, cache_index)
+        return _from_arrow(feather.read_table(file, memory_map=True))
+
+    for stale in [k for k, entry in cache_index["entries"].items() if entry["slot"] == slot]:
+        _remove_cache_entry(root, cache_index, stale)
+
+    df = build()
+    tmp = file + ".tmp"
+    feather.write_feather(_arrow_safe(df), tmp, compression="uncompressed")
+    df = df.reset_index(drop=True)
+    os.replace(tmp, file)
+
+    cache_index["entries"][key] = {"slot": slot, "sources": sources, "bytes": os.path.getsize(file), "last_used": time.time()}
+    _evict_cache(root, cache_index, max_bytes, keep=key)
+    _save_cache_index(root, cache_index)
+    return df
+
+@instrumented
+def invalidate_cache(path=None, cache_dir=CACHE_DIR):
+    """
+    Delete cache entries built from a source file, or every cache entry.
+
+    Parameters:
+    - path (str, optional): Source file path relative to the working directory, as passed to the readers.
+                            Default is None, which clears the whole cache.
+    - cache_dir (str, optional): Cache directory relative to the working directory. Default is CACHE_DIR.
+
+    Raises:
+    - AssertionError: If path or cache_dir is not a string.
+
+    Returns:
+    - int: The number of deleted entries.
+    """
+    assert path is None or isinstance(path, str)
+    assert isinstance(cache_dir, str)
+
+    root = os.getcwd() + cache_dir
+    if not os.path.isdir(root):
+        return 0
+    cache_index = _load_cache_index(root)
+    source = None if path is None else os.path.normpath(os.getcwd() + path)
+    stale = [key for key, entry in cache_index["entries"].items()
+             if source is None or any(os.path.normpath(s) == source for s in entry["sources"])]
+    for key in stale:
+        _remove_cache_entry(root, cache_index, key)
+    if source is None:
+        cache_index["hashes"] = {}
+    _save_cache_index(root, cache_index)
+    return len(stale)
+
+@instrumented
 def read_csv_data(path):
     """
     Read data from a CSV file and return it as a pandas DataFrame.
@@ -26,31 +297,129 @@ def read_csv_data(path):
 
     return df
 
-def read_all_zipped_csv(path):
+STORM_USECOLS = ['EVENT_ID', 'STATE', 'STATE_FIPS', 'YEAR', 'EVENT_TYPE', 'CZ_TYPE', 'CZ_FIPS', 'CZ_NAME',
+                 'BEGIN_DATE_TIME', 'DAMAGE_PROPERTY', 'DAMAGE_CROPS', 'BEGIN_LAT', 'BEGIN_LON']
+
+STORM_DTYPES = {
+    'EVENT_ID': 'int64',
+    'YEAR': 'int64',
+    'STATE_FIPS': 'int64',
+    'CZ_FIPS': 'int64',
+    'STATE': 'category',
+    'EVENT_TYPE': 'category',
+    'CZ_NAME': 'category',
+    'CZ_TYPE': 'category',
+    'DAMAGE_PROPERTY': 'object',
+    'DAMAGE_CROPS': 'object',
+    'BEGIN_LAT': 'float64',
+    'BEGIN_LON': 'float64',
+}
+
+def _read_zipped_csv(file, usecols=None, dtype=None):
+    """
+    Read a single compressed CSV file, used as the worker of read_all_zipped_csv.
+
+    Parameters:
+    - file (str): The file path of the compressed CSV file.
+    - usecols (list, optional): Columns to load. Default is None, which loads every column.
+    - dtype (dict, optional): Column dtypes; entries for columns outside usecols are ignored.
+
+    Returns:
+    - pd.DataFrame: The DataFrame containing the data from the compressed CSV file.
+    """
+    if dtype is not None and usecols is not None:
+        dtype = {col: t for col, t in dtype.items() if col in usecols}
+    return pd.read_csv(file, compression='gzip', usecols=usecols, dtype=dtype, low_memory=False)
+
+def _concat_presized(dfs):
+    """
+    Concatenate DataFrames with identical columns into a single DataFrame, writing each column once.
+
+    Every output column is allocated at its final length and filled slice by slice, so the data is
+    copied exactly once. Categorical columns are combined with the union of their categories.
+
+    Parameters:
+    - dfs (list): List of pd.DataFrame with the same columns.
+
+    Returns:
+    - pd.DataFrame: The concatenated DataFrame with a fresh RangeIndex.
+    """
+    if not dfs or any(not df.columns.equals(dfs[0].columns) for df in dfs[1:]):
+        return pd.concat(dfs, ignore_index=True)
+
+    columns = dfs[0].columns
+
+    offsets = np.cumsum([0] + [len(df) for df in dfs])
+    data = {}
+    for col in columns:
+        parts = [df[col] for df in dfs]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            data[col] = union_categoricals(parts)
+            continue
+        if not all(isinstance(part.dtype, np.dtype) for part in parts):
+            data[col] = pd.concat(parts, ignore_index=True)
+            continue
+        dtype = object if any(part.dtype == object for part in parts) else np.result_type(*[part.dtype for part in parts])
+        out = np.empty(offsets[-1], dtype=dtype)
+        for part, start, stop in zip(parts, offsets[:-1], offsets[1:]):
+            out[start:stop] = part.to_numpy()
+        data[col] = out
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+@instrumented
+def read_all_zipped_csv(path, usecols=None, dtype=None, max_workers=None, executor="process", cache=False, compact=False):
     """
     Read all compressed CSV files (*.csv.gz) in the specified directory and concatenate them into a single DataFrame.
 
+    The files are decompressed and parsed concurrently, one file per task, and the results are
+    concatenated into pre-sized columns. Pass STORM_USECOLS and STORM_DTYPES to load only the
+    columns the analysis uses with a declared schema instead of per-file type inference.
+
     Parameters:
     - path (str): The directory path containing compressed CSV files.
+    - usecols (list, optional): Columns to load. Default is None, which loads every column.
+    - dtype (dict, optional): Column dtypes, e.g. STORM_DTYPES. Default is None, which infers types.
+    - max_workers (int, optional): Number of parallel workers. Default is None, which uses os.cpu_count().
+    - executor (str, optional): "process" or "thread" pool. Default is "process".
+    - cache (bool, optional): Whether to load and store the result through cached_frame. Default is False.
+    - compact (bool, optional): Whether to apply clean.compact_dtypes (categorical labels, downcast integers,
+                                no narrative columns) to the result. Default is False.
 
     Raises:
     - AssertionError: If the input path is not a string, or if its length is less than 8, or if it does not end with '*.csv.gz'.
+                      Also, raises an AssertionError if usecols, dtype, max_workers, executor or cache have unexpected values.
 
     Returns:
     - pd.DataFrame: A DataFrame containing the concatenated data from all compressed CSV files in the specified directory.
     """
     assert isinstance(path, str) and len(path) > 8 and path[-8:] == "*.csv.gz"
+    assert usecols is None or isinstance(usecols, list)
+    assert dtype is None or isinstance(dtype, dict)
+    assert max_workers is None or (isinstance(max_workers, int) and max_workers > 0)
+    assert executor in ("process", "thread") and isinstance(cache, bool) and isinstance(compact, bool)
 
-    dfs = []
-    for file in glob.glob(os.getcwd()+path):
-        df = pd.read_csv(file, compression='gzip')
-        dfs.append(df)
+    files = sorted(glob.glob(os.getcwd()+path))
+    if cache:
+        return cached_frame(files, lambda: read_all_zipped_csv(path, usecols, dtype, max_workers, executor, compact=compact),
+                            params={"reader": "read_all_zipped_csv", "usecols": usecols, "dtype": dtype, "compact": compact})
 
-    final_df = pd.concat(dfs, ignore_index=True)
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(files), 1))
+
+    if max_workers == 1:
+        dfs = [_read_zipped_csv(file, usecols, dtype) for file in files]
+    else:
+        pool = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        with pool(max_workers=max_workers) as ex:
+            dfs = list(ex.map(_read_zipped_csv, files, repeat(usecols), repeat(dtype)))
+
+    final_df = _concat_presized(dfs)
     del dfs
+    if compact:
+        final_df = compact_dtypes(final_df)
 
     return final_df
 
+@instrumented
 def read_gpd_file(path):
     """
     Read a GeoPandas DataFrame from a GeoJSON or Shapefile.
@@ -72,17 +441,19 @@ def read_gpd_file(path):
     except FileNotFoundError:
         raise FileNotFoundError("File not found: {}".format(path))
     
-def read_excel_file(path, skiprows):
+@instrumented
+def read_excel_file(path, skiprows, cache=False):
     """
     Read data from an Excel file and return it as a pandas DataFrame.
 
     Parameters:
     - path (str): The file path of the Excel file to be read.
     - skiprows (int): Number of rows to skip from the beginning of the Excel file.
+    - cache (bool, optional): Whether to load and store the result through cached_frame. Default is False.
 
     Raises:
     - AssertionError: If the input path is not a string, or if its length is less than 5, or if it does not end with '.xlsx'.
-                      Also, raises an AssertionError if skiprows is not a non-negative integer.
+                      Also, raises an AssertionError if skiprows is not a non-negative integer or cache is not a bool.
     - FileNotFoundError: If the specified file path does not exist.
 
     Returns:
@@ -90,6 +461,13 @@ def read_excel_file(path, skiprows):
     """
     assert isinstance(path, str) and len(path) > 5 and path[-5:] == ".xlsx"
     assert isinstance(skiprows, int) and skiprows >= 0
+    assert isinstance(cache, bool)
+
+    if cache:
+        if not os.path.exists(os.getcwd() + path):
+            raise FileNotFoundError("File not found: {}".format(path))
+        return cached_frame([os.getcwd() + path], lambda: read_excel_file(path, skiprows),
+                            params={"reader": "read_excel_file", "skiprows": skiprows})
 
     try:
         return pd.read_excel(os.getcwd() + path, skiprows=skiprows)
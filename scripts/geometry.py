@@ -0,0 +1,233 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+import os
+import glob
+import json
+from shapely.geometry import Polygon
+from scripts.extract import read_gpd_file
+
+GEOMETRY_DIR = "/.cache/geometry"
+
+GEOMETRY_SOURCES = {
+    'state': "/dataset/cb_2022_us_state_500k",
+    'county': "/dataset/cb_2022_us_county_500k",
+}
+
+MAP_CRS = "EPSG:2163"
+
+INSET_CRS = "EPSG:4269"
+
+# simplification tolerances in metres of MAP_CRS; 0 keeps the full 500k resolution
+SIMPLIFY_TOLERANCES = [0, 250, 1000, 4000]
+
+# polygons used to clip the western islands off the Alaska and Hawaii insets
+AK_CLIP = Polygon([(-170, 50), (-170, 72), (-140, 72), (-140, 50)])
+HI_CLIP = Polygon([(-160, 0), (-160, 90), (-120, 90), (-120, 0)])
+
+_LOADED = {}
+
+def level_for_dpi(dpi, tolerances=SIMPLIFY_TOLERANCES, width_in=20, extent_m=4.7e6):
+    """
+    Pick the coarsest simplification level whose tolerance is still below one output pixel.
+
+    Parameters:
+    - dpi (int or float): Output resolution of the figure.
+    - tolerances (list, optional): Tolerances of the stored levels in metres. Default is SIMPLIFY_TOLERANCES.
+    - width_in (int or float, optional): Width of the map axes in inches. Default is 20, as in plot_disasters_map.
+    - extent_m (float, optional): East-west extent of the mapped area in metres. Default is 4.7e6, the CONUS.
+
+    Raises:
+    - AssertionError: If dpi or width_in is not positive.
+
+    Returns:
+    - int: The index of the chosen level in tolerances.
+    """
+    assert isinstance(dpi, (int, float)) and dpi > 0 and isinstance(width_in, (int, float)) and width_in > 0
+
+    metres_per_pixel = extent_m / (width_in * dpi)
+    fitting = [i for i, tol in enumerate(tolerances) if tol <= metres_per_pixel]
+    return max(fitting, key=lambda i: tolerances[i]) if fitting else int(np.argmin(tolerances))
+
+def source_state(path):
+    """
+    Describe the files of a shapefile directory by name, size and mtime.
+
+    Parameters:
+    - path (str): Directory of the shapefile, relative to the working directory.
+
+    Returns:
+    - list: [name, size, mtime_ns] of every file in the directory.
+    """
+    files = sorted(glob.glob(os.path.join(os.getcwd()+path, '*')))
+    return [[os.path.basename(f), os.path.getsize(f), os.stat(f).st_mtime_ns] for f in files]
+
+def _store_index(root):
+    """
+    Load the index of a geometry store, or an empty index if there is none.
+
+    Parameters:
+    - root (str): The absolute store directory.
+
+    Returns:
+    - dict: Layer name to the source state and tolerances it was built from.
+    """
+    try:
+        with open(os.path.join(root, "index.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _level_file(root, layer, level):
+    return os.path.join(root, "{}_{}.parquet".format(layer, level))
+
+def _simplify_shared(geoms, tolerances):
+    """
+    Simplify polygons along their shared arcs, so neighbours keep a common border without gaps or slivers.
+
+    The boundaries of all polygons are noded once into arcs that run between junctions; for every tolerance
+    each arc is simplified once and the faces of the simplified arcs are polygonized again. Each face goes
+    to the input polygon it overlaps most; faces over no polygon (e.g. lakes cut out of the layer) are
+    dropped. A polygon left without faces, because all its arcs collapsed, falls back to its own simplification.
+
+    Parameters:
+    - geoms (np.ndarray): Polygon and MultiPolygon geometries, None for missing ones.
+    - tolerances (list): The simplification tolerances in the units of the geometries.
+
+    Returns:
+    - list: One array of simplified geometries per tolerance, None where the input is None.
+    """
+    present = np.flatnonzero(~shapely.is_missing(geoms))
+    polygons = geoms[present]
+    arcs = None
+    if len(present) and any(tol > 0 for tol in tolerances):
+        arcs = shapely.get_parts(shapely.line_merge(shapely.union_all(shapely.boundary(polygons))))
+        tree = shapely.STRtree(polygons)
+
+    levels = []
+    for tol in tolerances:
+        result = np.full(len(geoms), None, dtype=object)
+        if tol == 0 or arcs is None:
+            result[present] = polygons
+            levels.append(result)
+            continue
+        simplified_arcs = shapely.simplify(arcs, tol, preserve_topology=True)
+        faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(shapely.union_all(simplified_arcs))))
+
+        face_idx, poly_idx = tree.query(faces, predicate='intersects')
+        overlap = shapely.area(shapely.intersection(faces[face_idx], polygons[poly_idx]))
+        # the largest overlap of every face comes first among its pairs
+        order = np.lexsort((-overlap, face_idx))
+        first = order[np.r_[True, face_idx[order][1:] != face_idx[order][:-1]]] if len(order) else order
+        owner = np.full(len(faces), -1)
+        best = np.zeros(len(faces))
+        owner[face_idx[first]], best[face_idx[first]] = poly_idx[first], overlap[first]
+        owner[best <= 0.5 * shapely.area(faces)] = -1
+
+        order = np.argsort(owner, kind='stable')
+        owners, starts = np.unique(owner[order], return_index=True)
+        simplified = np.full(len(polygons), None, dtype=object)
+        for p, group in zip(owners, np.split(order, starts[1:])):
+            if p >= 0:
+                simplified[p] = faces[group[0]] if len(group) == 1 else shapely.union_all(faces[group])
+        lost = shapely.is_missing(simplified)
+        simplified[lost] = shapely.simplify(polygons[lost], tol, preserve_topology=True)
+        result[present] = simplified
+        levels.append(result)
+    return levels
+
+def build_geometry_store(layer, path=None, store_dir=GEOMETRY_DIR, tolerances=SIMPLIFY_TOLERANCES):
+    """
+    Reproject, clip and simplify a boundary layer once and store every simplification level as GeoParquet.
+
+    Each level holds the source attributes with two geometry columns:
+    - 'geometry': every polygon in MAP_CRS (EPSG:2163), ready for the CONUS map.
+    - 'inset': Alaska and Hawaii in INSET_CRS, clipped with AK_CLIP and HI_CLIP for the inset axes (None elsewhere).
+    Shared borders are simplified once for all polygons (see _simplify_shared), so neighbours still meet
+    without gaps or overlaps at every level.
+
+    Parameters:
+    - layer (str): Name of the layer, e.g. 'state' or 'county'.
+    - path (str, optional): Directory of the shapefile, as for read_gpd_file. Default is None, which uses GEOMETRY_SOURCES[layer].
+    - store_dir (str, optional): Directory of the store, relative to the working directory. Default is GEOMETRY_DIR.
+    - tolerances (list, optional): Tolerances in metres of the levels to build. Default is SIMPLIFY_TOLERANCES.
+
+    Raises:
+    - AssertionError: If layer is not a string, path is missing for an unknown layer, or tolerances is not a list of non-negative numbers.
+
+    Returns:
+    None
+    """
+    assert isinstance(layer, str) and (path is not None or layer in GEOMETRY_SOURCES)
+    assert isinstance(tolerances, list) and all(isinstance(t, (int, float)) and t >= 0 for t in tolerances)
+    path = GEOMETRY_SOURCES[layer] if path is None else path
+
+    root = os.getcwd() + store_dir
+    os.makedirs(root, exist_ok=True)
+
+    gdf = read_gpd_file(path)
+    if gdf.crs is None:
+        gdf = gdf.set_crs(INSET_CRS)
+    projected = gdf.geometry.to_crs(MAP_CRS).to_numpy()
+    lonlat = gdf.geometry.to_crs(INSET_CRS).to_numpy()
+
+    inset = np.full(len(gdf), None, dtype=object)
+    for state, clip in (('AK', AK_CLIP), ('HI', HI_CLIP)):
+        rows = (gdf['STUSPS'] == state).to_numpy()
+        inset[rows] = shapely.intersection(lonlat[rows], clip)
+
+    # one degree of latitude is about 111 km, which converts the metre tolerance for the inset geometries
+    simplified = _simplify_shared(projected, tolerances)
+    simplified_inset = _simplify_shared(inset, [tol / 111000 for tol in tolerances])
+    for level in range(len(tolerances)):
+        frame = gdf.drop(columns=gdf.geometry.name)
+        frame = gpd.GeoDataFrame(frame, geometry=gpd.GeoSeries(simplified[level], index=gdf.index, crs=MAP_CRS))
+        frame['inset'] = gpd.GeoSeries(simplified_inset[level], index=gdf.index, crs=INSET_CRS)
+        tmp = _level_file(root, layer, level) + ".tmp"
+        frame.to_parquet(tmp)
+        os.replace(tmp, _level_file(root, layer, level))
+
+    index = _store_index(root)
+    index[layer] = {"path": path, "source": source_state(path), "tolerances": tolerances}
+    tmp = os.path.join(root, "index.json.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, os.path.join(root, "index.json"))
+    for key in [key for key in _LOADED if key[0] == root and key[1] == layer]:
+        del _LOADED[key]
+
+def load_geometry(layer='state', dpi=400, path=None, store_dir=GEOMETRY_DIR, tolerances=SIMPLIFY_TOLERANCES):
+    """
+    Load a boundary layer from the geometry store at the simplification level suited to an output DPI.
+
+    The store is (re)built when it is missing or its source files changed, and loaded levels are kept in
+    memory with the source state they were read under, so repeated maps neither re-read the shapefile nor
+    reproject it while a replaced shapefile is still picked up. The result can be merged with data and
+    passed straight to plot_disasters_map or plot_disasters_map1.
+
+    Parameters:
+    - layer (str, optional): Name of the layer, 'state' or 'county'. Default is 'state'.
+    - dpi (int or float, optional): Output resolution of the map. Default is 400, as in plot_disasters_map.
+    - path (str, optional): Directory of the shapefile. Default is None, which uses GEOMETRY_SOURCES[layer].
+    - store_dir (str, optional): Directory of the store, relative to the working directory. Default is GEOMETRY_DIR.
+    - tolerances (list, optional): Tolerances in metres of the stored levels. Default is SIMPLIFY_TOLERANCES.
+
+    Raises:
+    - AssertionError: If layer is not a string or path is missing for an unknown layer.
+
+    Returns:
+    - gpd.GeoDataFrame: The layer in EPSG:2163 with the clipped Alaska/Hawaii inset geometries in the 'inset' column.
+    """
+    assert isinstance(layer, str) and (path is not None or layer in GEOMETRY_SOURCES)
+    path = GEOMETRY_SOURCES[layer] if path is None else path
+
+    root = os.getcwd() + store_dir
+    level = level_for_dpi(dpi, tolerances)
+    key = (root, layer, path, tuple(tolerances), level)
+    state = source_state(path)
+    if key not in _LOADED or _LOADED[key][0] != state:
+        entry = _store_index(root).get(layer)
+        if entry is None or entry["path"] != path or entry["tolerances"] != tolerances or entry["source"] != state:
+            build_geometry_store(layer, path, store_dir, tolerances)
+        _LOADED[key] = (state, gpd.read_parquet(_level_file(root, layer, level)))
+    return _LOADED[key][1].copy()
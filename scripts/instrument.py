@@ -0,0 +1,229 @@
+import pandas as pd
+import numpy as np
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+ENABLED = False
+
+TRACE_MEMORY = False
+
+RECORDS = []
+
+_local = threading.local()
+
+_ORIGIN = time.perf_counter()
+
+def enable(memory=False):
+    """
+    Turn on the recording of instrumented calls.
+
+    Parameters:
+    - memory (bool, optional): Whether to also record the peak memory of every call with tracemalloc,
+                               which slows allocation-heavy code down noticeably. Default is False.
+
+    Raises:
+    - AssertionError: If memory is not a bool.
+
+    Returns:
+    None
+    """
+    global ENABLED, TRACE_MEMORY
+    assert isinstance(memory, bool)
+
+    TRACE_MEMORY = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    ENABLED = True
+
+def disable():
+    """
+    Turn off the recording of instrumented calls and stop memory tracing if enable started it.
+
+    Returns:
+    None
+    """
+    global ENABLED, TRACE_MEMORY
+    ENABLED = False
+    if TRACE_MEMORY and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    TRACE_MEMORY = False
+
+def reset():
+    """
+    Discard every recorded call.
+
+    Returns:
+    None
+    """
+    del RECORDS[:]
+
+def _rows(value):
+    """
+    Count the rows of a table-like value.
+
+    Parameters:
+    - value: Any argument or return value.
+
+    Returns:
+    - int or None: len() of a DataFrame, Series or array (the first element of a tuple result), else None.
+    """
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)) and np.ndim(value) > 0:
+        return len(value)
+    return None
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+@contextmanager
+def span(name, rows_in=None):
+    """
+    Record one block of code as a call named name, nested under any enclosing instrumented call.
+
+    Parameters:
+    - name (str): The name of the span, e.g. 'extract.read_all_zipped_csv'.
+    - rows_in (int, optional): Number of input rows. Default is None.
+
+    Returns:
+    - dict: The record, yielded so the block can set 'rows_out'; it is appended to RECORDS on exit.
+    """
+    stack = _stack()
+    record = {'name': name, 'depth': len(stack), 'thread': threading.get_ident(),
+              'rows_in': rows_in, 'rows_out': None}
+    memory = TRACE_MEMORY and tracemalloc.is_tracing()
+    if memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+        tracemalloc.reset_peak()
+        record['_base'], record['_peak'] = current, current
+    stack.append(record)
+    start, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = time.perf_counter() - start
+        record['cpu_s'] = time.process_time() - cpu
+        record['start_s'] = start - _ORIGIN
+        stack.pop()
+        if memory:
+            peak = max(record.pop('_peak'), tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = (peak - record.pop('_base')) / 1024 ** 2
+            if stack:
+                stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+        else:
+            record['peak_mb'] = None
+        RECORDS.append(record)
+
+def instrumented(function):
+    """
+    Decorate a function so that its calls are recorded while instrumentation is enabled.
+
+    When disabled the wrapper only checks one global flag before calling the function.
+
+    Parameters:
+    - function (callable): The function to instrument.
+
+    Returns:
+    - callable: The wrapped function.
+    """
+    name = "{}.{}".format(function.__module__.rsplit('.', 1)[-1], function.__qualname__)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return function(*args, **kwargs)
+        rows = [r for r in map(_rows, list(args) + list(kwargs.values())) if r is not None]
+        with span(name, max(rows) if rows else None) as record:
+            result = function(*args, **kwargs)
+            record['rows_out'] = _rows(result)
+        return result
+    return wrapper
+
+@contextmanager
+def profile(name="profile", memory=False):
+    """
+    Enable instrumentation for a block, e.g. one notebook cell, and collect the calls made inside it.
+
+        with profile('load storm') as calls:
+            storm = read_all_zipped_csv("/dataset/*.csv.gz")
+        summary(calls)
+
+    Parameters:
+    - name (str, optional): Name of the span recorded for the whole block. Default is "profile".
+    - memory (bool, optional): Whether to record peak memory, see enable. Default is False.
+
+    Returns:
+    - list: The records of the block, filled in when the block exits.
+    """
+    was_enabled = ENABLED
+    first = len(RECORDS)
+    calls = []
+    enable(memory or TRACE_MEMORY)
+    try:
+        with span(name):
+            yield calls
+    finally:
+        calls.extend(RECORDS[first:])
+        if not was_enabled:
+            disable()
+
+def summary(records=None):
+    """
+    Summarize recorded calls per function.
+
+    Parameters:
+    - records (list, optional): The records to summarize. Default is None, which uses RECORDS.
+
+    Returns:
+    - pd.DataFrame: One row per function with 'calls', 'wall_s' (total), 'wall_mean_s', 'wall_max_s',
+                    'cpu_s' (total), 'peak_mb' (largest), 'rows_in' and 'rows_out' (totals), sorted by total wall time.
+    """
+    records = RECORDS if records is None else records
+    frame = pd.DataFrame(records, columns=['name', 'wall_s', 'cpu_s', 'peak_mb', 'rows_in', 'rows_out'])
+    frame[['peak_mb', 'rows_in', 'rows_out']] = frame[['peak_mb', 'rows_in', 'rows_out']].astype(float)
+    table = frame.groupby('name').agg(calls=('wall_s', 'size'), wall_s=('wall_s', 'sum'), wall_mean_s=('wall_s', 'mean'),
+                                      wall_max_s=('wall_s', 'max'), cpu_s=('cpu_s', 'sum'), peak_mb=('peak_mb', 'max'),
+                                      rows_in=('rows_in', 'sum'), rows_out=('rows_out', 'sum'))
+    return table.sort_values('wall_s', ascending=False).reset_index()
+
+def export_json(path, records=None):
+    """
+    Write recorded calls as a JSON list.
+
+    Parameters:
+    - path (str): The output file path.
+    - records (list, optional): The records to write. Default is None, which uses RECORDS.
+
+    Returns:
+    None
+    """
+    with open(path, 'w') as f:
+        json.dump(RECORDS if records is None else records, f, indent=1)
+
+def export_chrome_trace(path, records=None):
+    """
+    Write recorded calls in the Chrome trace event format, readable by chrome://tracing, Perfetto and speedscope as a flame graph.
+
+    Parameters:
+    - path (str): The output file path.
+    - records (list, optional): The records to write. Default is None, which uses RECORDS.
+
+    Returns:
+    None
+    """
+    records = RECORDS if records is None else records
+    events = [{'name': r['name'], 'cat': r['name'].split('.', 1)[0], 'ph': 'X', 'pid': os.getpid(), 'tid': r['thread'],
+               'ts': r['start_s'] * 1e6, 'dur': r['wall_s'] * 1e6,
+               'args': {k: r[k] for k in ('cpu_s', 'peak_mb', 'rows_in', 'rows_out')}}
+              for r in sorted(records, key=lambda r: (r['start_s'], r['depth']))]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -2,10 +2,43 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from scripts.clean import makeColorColumn
 from matplotlib.ticker import FuncFormatter
-from shapely.geometry import Polygon
+from scripts.geometry import AK_CLIP, HI_CLIP
 import os
+from scripts.instrument import instrumented
 
-def plot_time_series(x_values, y_values, x_label="", y_label="", title="", path=""):
+def _map_frame(gdf):
+    """
+    Return gdf in EPSG:2163, reprojecting only if it is not already stored that way (see load_geometry).
+
+    Parameters:
+    - gdf (gpd.GeoDataFrame): The map GeoDataFrame.
+
+    Returns:
+    - gpd.GeoDataFrame: gdf in EPSG:2163.
+    """
+    if gdf.crs is not None and gdf.crs.to_epsg() == 2163:
+        return gdf
+    return gdf.to_crs({'init': 'epsg:2163'})
+
+def _inset_frame(gdf, state, clip):
+    """
+    Return the rows of one inset state with their clipped longitude/latitude geometry.
+
+    Parameters:
+    - gdf (gpd.GeoDataFrame): The map GeoDataFrame.
+    - state (str): 'AK' or 'HI'.
+    - clip (Polygon): The polygon clipping the western islands.
+
+    Returns:
+    - gpd.GeoDataFrame: The clipped rows, taken from the precomputed 'inset' column when it exists.
+    """
+    part = gdf[gdf.STUSPS == state]
+    if 'inset' in part.columns:
+        return part.set_geometry('inset')
+    return part.clip(clip)
+
+@instrumented
+def plot_time_series(x_values, y_values, x_label="", y_label="", title="", path="", show=True):
     """
     Plot a time series graph for given values of x and y.
 
@@ -15,6 +48,7 @@ def plot_time_series(x_values, y_values, x_label="", y_label="", title="", path=
     - x_label (str, optional): Label for the x-axis. Default is an empty string.
     - y_label (str, optional): Label for the y-axis. Default is an empty string.
     - title (str, optional): Title for the plot. Default is an empty string.
+    - show (bool, optional): Whether to display the figure after saving it. Default is True.
 
     Raises:
     - AssertionError: If the input x_values and y_values are not instances of pd.Series,
@@ -27,6 +61,7 @@ def plot_time_series(x_values, y_values, x_label="", y_label="", title="", path=
     assert x_values.shape == y_values.shape
     assert isinstance(x_label, str) and isinstance(y_label, str) and isinstance(title, str)
     assert isinstance(path, str)
+    assert isinstance(show, bool)
 
     _, ax = plt.subplots(figsize=(8, 5))
     ax.plot(x_values.to_numpy(), y_values.to_numpy())
@@ -38,9 +73,11 @@ def plot_time_series(x_values, y_values, x_label="", y_label="", title="", path=
     if path:
         plt.savefig("./plots/"+path)
 
-    plt.show()
+    if show:
+        plt.show()
 
-def plot_two_time_series(x_values1, x_values2, y_values1, y_values2, x_label="", y_label="", title="", path=""):
+@instrumented
+def plot_two_time_series(x_values1, x_values2, y_values1, y_values2, x_label="", y_label="", title="", path="", show=True):
     """
     Plot two time series graphs for given values of x1, x2, and y.
 
@@ -52,6 +89,7 @@ def plot_two_time_series(x_values1, x_values2, y_values1, y_values2, x_label="",
     - x_label (str, optional): Label for the x-axis. Default is an empty string.
     - y_label (str, optional): Label for the y-axis. Default is an empty string.
     - title (str, optional): Title for the plot. Default is an empty string.
+    - show (bool, optional): Whether to display the figure after saving it. Default is True.
 
     Raises:
     - AssertionError: If the input x_values1, x_values2, y_values1, or y_values2 are not instances of pd.Series,
@@ -64,6 +102,7 @@ def plot_two_time_series(x_values1, x_values2, y_values1, y_values2, x_label="",
     assert x_values1.shape == y_values1.shape and x_values2.shape == y_values2.shape
     assert isinstance(x_label, str) and isinstance(y_label, str) and isinstance(title, str)
     assert isinstance(path, str)
+    assert isinstance(show, bool)
 
     _, ax = plt.subplots(figsize=(8, 5))
     ax.plot(x_values1.to_numpy(), y_values1.to_numpy())
@@ -77,9 +116,11 @@ def plot_two_time_series(x_values1, x_values2, y_values1, y_values2, x_label="",
     if path:
         plt.savefig("./plots/"+path)
 
-    plt.show()
+    if show:
+        plt.show()
 
-def plot_scatter(x_values, y_values, x_label="", y_label="", title="", path=""):
+@instrumented
+def plot_scatter(x_values, y_values, x_label="", y_label="", title="", path="", show=True):
     """
     Plot a scatter plot for given x and y values.
 
@@ -90,6 +131,7 @@ def plot_scatter(x_values, y_values, x_label="", y_label="", title="", path=""):
     - y_label (str, optional): Label for the y-axis. Default is an empty string.
     - title (str, optional): Title for the plot. Default is an empty string.
     - path (str, optional): File path to save the plot as an image. Default is an empty string.
+    - show (bool, optional): Whether to display the figure after saving it. Default is True.
 
     Raises:
     - AssertionError: If x_values and y_values are not instances of pd.Series,
@@ -102,6 +144,7 @@ def plot_scatter(x_values, y_values, x_label="", y_label="", title="", path=""):
     assert x_values.shape == y_values.shape
     assert isinstance(x_label, str) and isinstance(y_label, str) and isinstance(title, str)
     assert isinstance(path, str)
+    assert isinstance(show, bool)
 
     _, ax = plt.subplots(figsize=(6, 6))
     ax.set_title(title, fontsize=20)
@@ -112,8 +155,10 @@ def plot_scatter(x_values, y_values, x_label="", y_label="", title="", path=""):
     if path:
         plt.savefig("./plots/"+path)
         
-    plt.show()
+    if show:
+        plt.show()
 
+@instrumented
 def plot_disasters_map(gdf, variable, label, save_name="plot_dis_map.png", title1="", anno=""):
     """
     Create and save a choropleth map of a GeoDataFrame based on a specified variable.
@@ -143,7 +188,7 @@ def plot_disasters_map(gdf, variable, label, save_name="plot_dis_map.png", title
     gdf = makeColorColumn(gdf, variable, vmin, vmax)
 
     # create "visframe" as a re-projected gdf using EPSG 2163
-    visframe = gdf.to_crs({'init': 'epsg:2163'})
+    visframe = _map_frame(gdf)
 
     # create figure and axes for Matplotlib
     fig, ax = plt.subplots(1, figsize=(20, 14))
@@ -178,33 +223,28 @@ def plot_disasters_map(gdf, variable, label, save_name="plot_dis_map.png", title
 
     ax.annotate(anno, xy=(0.22, .085), xycoords='figure fraction', fontsize=16, color='#555555')
 
-    # create map
-    for row in visframe.itertuples():
-        if row.STUSPS not in ['AK', 'HI']:
-            vf = visframe[visframe.STUSPS == row.STUSPS]
-            c = gdf[gdf.STUSPS == row.STUSPS][0:1].value_determined_color.item()
-            vf.plot(color=c, linewidth=0.8, ax=ax, edgecolor='0.8')
+    # create map, coloring every polygon of a state with the color of its first row
+    conus = visframe[~visframe.STUSPS.isin(['AK', 'HI'])]
+    conus_colors = conus.groupby('STUSPS')['value_determined_color'].transform('first')
+    conus.plot(color=conus_colors.to_numpy(), linewidth=0.8, ax=ax, edgecolor='0.8')
 
     # add Alaska
     akax = fig.add_axes([0.1, 0.17, 0.17, 0.16])
     akax.axis('off')
-    # polygon to clip western islands
-    polygon = Polygon([(-170, 50), (-170, 72), (-140, 72), (-140, 50)])
-    alaska_gdf = gdf[gdf.STUSPS == 'AK']
-    alaska_gdf.clip(polygon).plot(
-        color=gdf[gdf.STUSPS == 'AK'].value_determined_color, linewidth=0.8, ax=akax, edgecolor='0.8')
+    alaska_gdf = _inset_frame(gdf, 'AK', AK_CLIP)
+    alaska_gdf.plot(
+        color=alaska_gdf['value_determined_color'].to_numpy(), linewidth=0.8, ax=akax, edgecolor='0.8')
 
     # add Hawaii
     hiax = fig.add_axes([.28, 0.20, 0.1, 0.1])
     hiax.axis('off')
-    # polygon to clip western islands
-    hipolygon = Polygon([(-160, 0), (-160, 90), (-120, 90), (-120, 0)])
-    hawaii_gdf = gdf[gdf.STUSPS == 'HI']
-    hawaii_gdf.clip(hipolygon).plot(
-        column=variable, color=hawaii_gdf['value_determined_color'], linewidth=0.8, ax=hiax, edgecolor='0.8')
+    hawaii_gdf = _inset_frame(gdf, 'HI', HI_CLIP)
+    hawaii_gdf.plot(
+        color=hawaii_gdf['value_determined_color'].to_numpy(), linewidth=0.8, ax=hiax, edgecolor='0.8')
 
-    fig.savefig(os.getcwd()+"./plots/"+save_name, dpi=400, bbox_inches="tight")
+    fig.savefig(os.path.join(os.getcwd(), "plots", save_name), dpi=400, bbox_inches="tight")
 
+@instrumented
 def plot_disasters_map1(gdf, save_name="plot_dis_map1.png", title="", label1="", label2=""):
     """
     Create and save a choropleth map of disaster levels using Matplotlib and GeoPandas.
@@ -226,7 +266,7 @@ def plot_disasters_map1(gdf, save_name="plot_dis_map1.png", title="", label1="",
     assert isinstance(save_name, str) and len(save_name) > 4 and save_name[-4:] == ".png"
     assert isinstance(title, str)
 
-    visframe = gdf.to_crs({'init': 'epsg:2163'})
+    visframe = _map_frame(gdf)
     visframe = visframe[~visframe.STUSPS.isin(['HI','AK'])]
 
     # create figure and axes for Matplotlib
@@ -244,19 +284,9 @@ def plot_disasters_map1(gdf, save_name="plot_dis_map1.png", title="", label1="",
     fig = ax.get_figure()
 
     # create map
-    for row in visframe.itertuples():
-        if row.STUSPS not in ['AK', 'HI']:
-            vf = visframe[(visframe.STUSPS == row.STUSPS) & (visframe.NAME == row.NAME)]
-            affected_level = gdf[(gdf.STUSPS == row.STUSPS) & (gdf.NAME == row.NAME)]['affected_level'].item()
-            if affected_level == 'high':
-                color = 'red'
-            elif affected_level == 'low':
-                color = 'orange'
-            else:
-                color = 'skyblue'
-            
-            vf.plot(color=color, linewidth=0.8, ax=ax, edgecolor='0.8',legend=True)
-    
+    colors = visframe['affected_level'].map({'high': 'red', 'low': 'orange'}).fillna('skyblue')
+    visframe.plot(color=colors.to_numpy(), linewidth=0.8, ax=ax, edgecolor='0.8')
+
     red_patch = plt.Line2D([0], [0], marker='s', color='w', markerfacecolor='red', markersize=18, label=label1)
     blue_patch = plt.Line2D([0], [0], marker='s', color='w', markerfacecolor='orange', markersize=18, label=label2)
 
@@ -264,4 +294,4 @@ def plot_disasters_map1(gdf, save_name="plot_dis_map1.png", title="", label1="",
     for label in legend.get_texts():
         label.set_fontsize(20) 
 
-    fig.savefig(os.getcwd()+"./plots/"+save_name, dpi=400, bbox_inches="tight")
\ No newline at end of file
+    fig.savefig(os.path.join(os.getcwd(), "plots", save_name), dpi=400, bbox_inches="tight")
\ No newline at end of file
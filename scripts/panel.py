@@ -0,0 +1,206 @@
+import pandas as pd
+import numpy as np
+
+def period_ordinal(df, year='Year', quarter=None):
+    """
+    Build an integer period number from year (and optionally quarter) columns, so consecutive periods differ by 1.
+
+    Parameters:
+    - df (pd.DataFrame): The panel DataFrame.
+    - year (str, optional): Name of the year column. Default is 'Year'.
+    - quarter (str, optional): Name of the quarter column (1-4). Default is None, for annual data.
+
+    Raises:
+    - AssertionError: If df is not a DataFrame or year/quarter are not column names.
+
+    Returns:
+    - np.ndarray: The int64 period number of every row.
+    """
+    assert isinstance(df, pd.DataFrame) and isinstance(year, str) and year in df.columns
+    assert quarter is None or (isinstance(quarter, str) and quarter in df.columns)
+
+    periods = df[year].to_numpy().astype(np.int64)
+    if quarter is not None:
+        periods = periods * 4 + df[quarter].to_numpy().astype(np.int64) - 1
+    return periods
+
+def _panel_order(df, keys, time):
+    """
+    Sort a panel once by group and time.
+
+    Parameters:
+    - df (pd.DataFrame): The panel DataFrame.
+    - keys (list): Column names identifying a unit (e.g. ['State', 'County']).
+    - time (str or np.ndarray): Name of an integer time column, or the time values themselves.
+
+    Returns:
+    - tuple: (order, codes, times) where order sorts the rows and codes/times are the integer
+             group codes and time values in that sorted order.
+    """
+    codes = df.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+    times = np.asarray(df[time] if isinstance(time, str) else time).astype(np.int64)
+    order = np.lexsort((times, codes))
+    return order, codes[order], times[order]
+
+def panel_shift(df, keys, time, columns, periods, step=1, strict=True):
+    """
+    Shift several columns of a panel by several periods within each unit, in one sort.
+
+    Positive periods look back (like groupby(keys)[col].shift(p)) and negative periods look forward.
+    With strict=True a shifted value is taken from the row of the same unit exactly p*step time units away,
+    found by its time rather than its position, so a missing year only leaves NaN where that year is the
+    source. With strict=False the shift counts rows, like groupby().shift(), and jumps across gaps.
+
+    Parameters:
+    - df (pd.DataFrame): The panel DataFrame.
+    - keys (list): Column names identifying a unit (e.g. ['State', 'County']).
+    - time (str or np.ndarray): Name of an integer time column, or the time values (see period_ordinal).
+    - columns (list): Names of the numeric columns to shift.
+    - periods (list): Shifts to compute, e.g. [1, -1, -3].
+    - step (int, optional): Time units between consecutive periods. Default is 1.
+    - strict (bool, optional): Whether to look up the source row by time instead of by position. Default is True.
+
+    Raises:
+    - AssertionError: If any input argument is not of the expected type.
+
+    Returns:
+    - pd.DataFrame: Float columns named '<col>_lag<p>' for p > 0 and '<col>_lead<-p>' for p < 0, with the index of df.
+    """
+    assert isinstance(df, pd.DataFrame) and isinstance(keys, list) and isinstance(columns, list) and isinstance(periods, list)
+    assert isinstance(time, (str, np.ndarray)) and isinstance(step, int) and step > 0 and isinstance(strict, bool)
+    assert all(isinstance(p, int) for p in periods)
+
+    order, codes, times = _panel_order(df, keys, time)
+    n = len(df)
+    pos = np.arange(n)
+    values = {col: df[col].to_numpy(dtype=float)[order] for col in columns}
+    if strict and n:
+        # one sorted int64 key per row, so the row of (unit, time - p*step) is found by binary search
+        low = times.min()
+        width = int(times.max() - low) + 1
+        sorted_keys = codes * width + (times - low)
+
+    shifted = {}
+    for p in periods:
+        if strict and n:
+            target = times - p * step
+            inside = (target >= low) & (target < low + width)
+            wanted = codes * width + (target - low)
+            src = np.minimum(np.searchsorted(sorted_keys, wanted), n - 1)
+            valid = inside & (sorted_keys[src] == wanted)
+        else:
+            src = np.clip(pos - p, 0, max(n - 1, 0))
+            valid = (pos - p >= 0) & (pos - p < n) & (codes[src] == codes)
+        name = '{}_lag{}' if p > 0 else '{}_lead{}'
+        for col in columns:
+            out = np.empty(n)
+            out[order] = np.where(valid, values[col][src], np.nan)
+            shifted[name.format(col, abs(p))] = out
+    return pd.DataFrame(shifted, index=df.index)
+
+def lag_hpi_changes(df, horizons=[1, 3, 5, 10], keys=['State', 'County'], time='Year', value='HPI', step=1):
+    """
+    Compute the percentage change of a price index from the period before an event to h periods after it.
+
+    lag<h>_hpi_change = (value[t + h] / value[t - 1] - 1) * 100, computed within each unit for all horizons at once.
+    Use time=period_ordinal(df, 'Year', 'Quarter') and keys=['Area'] for the quarterly MSA data.
+
+    Parameters:
+    - df (pd.DataFrame): The panel DataFrame.
+    - horizons (list, optional): Forward horizons in periods. Default is [1, 3, 5, 10].
+    - keys (list, optional): Column names identifying a unit. Default is ['State', 'County'].
+    - time (str or np.ndarray, optional): Name of an integer time column, or the time values. Default is 'Year'.
+    - value (str, optional): Name of the index column. Default is 'HPI'.
+    - step (int, optional): Time units between consecutive periods. Default is 1.
+
+    Raises:
+    - AssertionError: If horizons is not a list of positive integers.
+
+    Returns:
+    - pd.DataFrame: Columns 'lag<h>_hpi_change' for every horizon, with the index of df.
+    """
+    assert isinstance(horizons, list) and all(isinstance(h, int) and h > 0 for h in horizons)
+
+    shifted = panel_shift(df, keys, time, [value], [1] + [-h for h in horizons], step=step)
+    base = shifted['{}_lag1'.format(value)].to_numpy()
+    return pd.DataFrame({'lag{}_hpi_change'.format(h): (shifted['{}_lead{}'.format(value, h)].to_numpy() / base - 1) * 100
+                         for h in horizons}, index=df.index)
+
+def dense_shift(values, periods, axis=1):
+    """
+    Shift a dense unit x period matrix (e.g. a panel_store view) along its period axis.
+
+    Positive periods look back and negative periods look forward, as in panel_shift; the periods shifted in are NaN.
+
+    Parameters:
+    - values (np.ndarray): Array with periods along axis, e.g. the (units, years) view of one metric.
+    - periods (int): The shift.
+    - axis (int, optional): The period axis. Default is 1.
+
+    Raises:
+    - AssertionError: If periods is not an integer.
+
+    Returns:
+    - np.ndarray: A new float array of the shape of values.
+    """
+    assert isinstance(periods, int)
+
+    out = np.full(values.shape, np.nan)
+    n = values.shape[axis]
+    src = [slice(None)] * values.ndim
+    dst = [slice(None)] * values.ndim
+    if periods >= 0:
+        src[axis], dst[axis] = slice(0, max(n - periods, 0)), slice(min(periods, n), n)
+    else:
+        src[axis], dst[axis] = slice(min(-periods, n), n), slice(0, max(n + periods, 0))
+    out[tuple(dst)] = values[tuple(src)]
+    return out
+
+def dense_lag_changes(values, horizons=[1, 3, 5, 10], axis=1):
+    """
+    Compute lag_hpi_changes on a dense unit x period matrix of the index, e.g. store_view(store, 'HPI').
+
+    Parameters:
+    - values (np.ndarray): Array of index values with periods along axis, NaN for missing periods.
+    - horizons (list, optional): Forward horizons in periods. Default is [1, 3, 5, 10].
+    - axis (int, optional): The period axis. Default is 1.
+
+    Raises:
+    - AssertionError: If horizons is not a list of positive integers.
+
+    Returns:
+    - dict: 'lag<h>_hpi_change' to an array of the shape of values, for every horizon.
+    """
+    assert isinstance(horizons, list) and all(isinstance(h, int) and h > 0 for h in horizons)
+
+    base = dense_shift(values, 1, axis)
+    return {'lag{}_hpi_change'.format(h): (dense_shift(values, -h, axis) / base - 1) * 100 for h in horizons}
+
+def panel_gaps(df, keys, time, step=1):
+    """
+    List the places where a unit skips one or more periods.
+
+    Parameters:
+    - df (pd.DataFrame): The panel DataFrame.
+    - keys (list): Column names identifying a unit.
+    - time (str): Name of an integer time column.
+    - step (int, optional): Time units between consecutive periods. Default is 1.
+
+    Raises:
+    - AssertionError: If any input argument is not of the expected type.
+
+    Returns:
+    - pd.DataFrame: One row per gap with the key columns, the last period before the gap ('time_before'),
+                    the next observed period ('time_after') and the number of missing periods ('missing').
+    """
+    assert isinstance(df, pd.DataFrame) and isinstance(keys, list) and isinstance(time, str)
+    assert isinstance(step, int) and step > 0
+
+    order, codes, times = _panel_order(df, keys, time)
+    jump = (codes[1:] == codes[:-1]) & (times[1:] - times[:-1] > step)
+    before = order[:-1][jump]
+    gaps = df.iloc[before][keys].reset_index(drop=True)
+    gaps['time_before'] = times[:-1][jump]
+    gaps['time_after'] = times[1:][jump]
+    gaps['missing'] = (gaps['time_after'] - gaps['time_before']) // step - 1
+    return gaps
@@ -0,0 +1,170 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+from scripts.instrument import instrumented
+
+STORE_DIR = "/.cache/panel_store"
+
+STORE_METRICS = ['HPI', 'Annual Change (%)', 'lag1_hpi_change', 'lag3_hpi_change', 'lag5_hpi_change',
+                 'lag10_hpi_change', 'FREQ', 'DAMAGE']
+
+def _store_files(root, name):
+    return os.path.join(root, name + ".npy"), os.path.join(root, name + ".json")
+
+@instrumented
+def build_panel_store(panel, name='county', metrics=STORE_METRICS, keys=['State', 'County'], time='Year',
+                      store_dir=STORE_DIR):
+    """
+    Save a long panel as a dense unit x year x metric float64 array on disk with an index of its units and years.
+
+    Units are sorted by their keys and years run without gaps from the first to the last year, so rows and
+    columns line up with pivot_table(index=keys, columns=time). Unit-years missing from the panel are NaN.
+    The store is left as is when it was built from the same panel content and parameters.
+
+    Parameters:
+    - panel (pd.DataFrame): Long panel with the key, time and metric columns, e.g. the county HPI with its lag
+                            changes or the output of build_county_year_panel.
+    - name (str, optional): Name of the store. Default is 'county'.
+    - metrics (list, optional): Numeric columns to store; columns absent from panel are skipped. Default is STORE_METRICS.
+    - keys (list, optional): Columns identifying a unit. Default is ['State', 'County'].
+    - time (str, optional): Integer year column. Default is 'Year'.
+    - store_dir (str, optional): Directory of the store, relative to the working directory. Default is STORE_DIR.
+
+    Raises:
+    - AssertionError: If panel is not a DataFrame, a key or time column is missing, or no metric is present.
+
+    Returns:
+    - dict: The loaded store, see load_panel_store.
+    """
+    assert isinstance(panel, pd.DataFrame) and isinstance(name, str) and isinstance(keys, list)
+    assert all(c in panel.columns for c in keys + [time])
+    metrics = [m for m in metrics if m in panel.columns]
+    assert metrics, "none of the metrics are columns of panel"
+
+    root = os.getcwd() + store_dir
+    array_file, index_file = _store_files(root, name)
+    digest = hashlib.sha256(json.dumps([keys, time, metrics]).encode())
+    digest.update(pd.util.hash_pandas_object(panel[keys + [time] + metrics], index=False).to_numpy().tobytes())
+    try:
+        with open(index_file) as f:
+            if json.load(f)['source'] == digest.hexdigest() and os.path.exists(array_file):
+                return load_panel_store(name, store_dir)
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    units = pd.MultiIndex.from_frame(panel[keys]) if len(keys) > 1 else pd.Index(panel[keys[0]])
+    codes, uniques = pd.factorize(units, sort=True)
+    years = panel[time].to_numpy(dtype=np.int64)
+    first = int(years.min())
+    n_years = int(years.max()) - first + 1
+
+    os.makedirs(root, exist_ok=True)
+    tmp = array_file + ".tmp.npy"
+    values = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float64, shape=(len(uniques), n_years, len(metrics)))
+    values[:] = np.nan
+    for m, metric in enumerate(metrics):
+        values[codes, years - first, m] = panel[metric].to_numpy(dtype=float)
+    values.flush()
+    del values
+    os.replace(tmp, array_file)
+
+    index = {'source': digest.hexdigest(), 'keys': keys, 'time': time, 'metrics': metrics, 'first_year': first,
+             'n_years': n_years, 'units': [list(u) if isinstance(u, tuple) else [u] for u in uniques.tolist()]}
+    with open(index_file + ".tmp", 'w') as f:
+        json.dump(index, f, default=lambda v: v.item())
+    os.replace(index_file + ".tmp", index_file)
+    return load_panel_store(name, store_dir)
+
+@instrumented
+def load_panel_store(name='county', store_dir=STORE_DIR, mode='r'):
+    """
+    Open a panel store as a memory map with its index maps.
+
+    Parameters:
+    - name (str, optional): Name of the store. Default is 'county'.
+    - store_dir (str, optional): Directory of the store, relative to the working directory. Default is STORE_DIR.
+    - mode (str, optional): Memory map mode, 'r' for read-only or 'r+' to update values in place. Default is 'r'.
+
+    Raises:
+    - AssertionError: If mode is not 'r' or 'r+'.
+    - FileNotFoundError: If the store does not exist.
+
+    Returns:
+    - dict: 'values' (the (units, years, metrics) np.memmap), 'units' (pd.Index or pd.MultiIndex of the unit keys,
+            position = row), 'years' (pd.Index of the years, position = column), 'metrics' (pd.Index of the
+            metric names, position = last axis) and 'keys' (the unit key column names).
+    """
+    assert mode in ('r', 'r+')
+
+    array_file, index_file = _store_files(os.getcwd() + store_dir, name)
+    try:
+        with open(index_file) as f:
+            index = json.load(f)
+        values = np.load(array_file, mmap_mode=mode)
+    except FileNotFoundError:
+        raise FileNotFoundError("Panel store not found: {}".format(name))
+
+    keys = index['keys']
+    units = pd.MultiIndex.from_tuples([tuple(u) for u in index['units']], names=keys) if len(keys) > 1 \
+        else pd.Index([u[0] for u in index['units']], name=keys[0])
+    years = pd.RangeIndex(index['first_year'], index['first_year'] + index['n_years'], name=index['time'])
+    return {'values': values, 'units': units, 'years': years, 'metrics': pd.Index(index['metrics']), 'keys': keys}
+
+def store_view(store, metric=None, unit=None, year=None):
+    """
+    Select from a panel store by metric, unit and year without copying.
+
+    Each selection is an integer index lookup followed by basic slicing of the memory map, so the result is
+    a view into the file whatever the size of the store.
+
+    Parameters:
+    - store (dict): The output of load_panel_store.
+    - metric (str, optional): Metric name. Default is None for all metrics.
+    - unit (object, optional): Unit key, e.g. ('TX', 'Harris'). Default is None for all units.
+    - year (int, optional): Year. Default is None for all years.
+
+    Raises:
+    - KeyError: If the metric, unit or year is not in the store.
+
+    Returns:
+    - np.ndarray: A view with the axes (units, years, metrics) that were not selected, e.g. a (units, years)
+                  matrix for a metric or a (years, metrics) matrix for a unit.
+    """
+    index = (slice(None) if unit is None else store['units'].get_loc(unit),
+             slice(None) if year is None else store['years'].get_loc(year),
+             slice(None) if metric is None else store['metrics'].get_loc(metric))
+    return store['values'][index]
+
+def heatmap_frame(store, metric='HPI'):
+    """
+    Wrap the unit x year matrix of one metric in a DataFrame without copying, for plotly_plots.plot_heatmap.
+
+    It has the layout of pivot_table(values=metric, index=keys, columns='Year') on the long panel.
+
+    Parameters:
+    - store (dict): The output of load_panel_store.
+    - metric (str, optional): Metric name. Default is 'HPI'.
+
+    Raises:
+    - KeyError: If the metric is not in the store.
+
+    Returns:
+    - pd.DataFrame: Units as rows and years as columns, backed by the memory map.
+    """
+    return pd.DataFrame(store_view(store, metric), index=store['units'], columns=store['years'], copy=False)
+
+def store_columns(store, metrics=None):
+    """
+    Map metric names to their unit x year views, for column-wise code such as stats.corr_matrix.
+
+    Parameters:
+    - store (dict): The output of load_panel_store.
+    - metrics (list, optional): Metric names. Default is None for every metric.
+
+    Returns:
+    - dict: Metric name to its (units, years) view.
+    """
+    metrics = list(store['metrics']) if metrics is None else metrics
+    return {metric: store_view(store, metric) for metric in metrics}
@@ -0,0 +1,324 @@
+"""
+The notebook analysis as a memoized DAG of named stages.
+
+Every stage output is pickled under PIPELINE_DIR, keyed by a hash of the stage code (including the scripts
+modules it calls), its parameters, the content digests of its input stages and the files it reads. A rerun
+only recomputes stages whose key changed, and a stage whose recomputed output is identical does not
+invalidate the stages after it.
+
+Usage (from the repository root):
+    python -m scripts.pipeline                          # run every stage
+    python -m scripts.pipeline --target ttests --set groups.q_high=0.8
+    python -m scripts.pipeline --list
+"""
+import pandas as pd
+import argparse
+import glob
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import time
+
+from scripts.extract import read_all_zipped_csv, read_gpd_file, read_excel_file, STORM_USECOLS, STORM_DTYPES
+from scripts.clean import parse_damage
+from scripts.panel import lag_hpi_changes, panel_shift
+from scripts.county_panel import build_county_lookup, build_county_year_panel, county_key
+from scripts.stats import get_nearest_county, paired_ttests, corr_matrix, corr_table
+from scripts.render import render_plots, scripts_modules, module_files
+
+PIPELINE_DIR = "/.cache/pipeline"
+
+STAGES = {}
+
+LAG_COLUMNS = ['Annual Change (%)', 'lag1_hpi_change', 'lag3_hpi_change', 'lag5_hpi_change', 'lag10_hpi_change']
+
+def stage(name, deps=[], sources=[]):
+    """
+    Register a function as a pipeline stage.
+
+    The function receives the outputs of deps as positional arguments, in order, and its keyword
+    parameters (with their defaults) are the stage parameters.
+
+    Parameters:
+    - name (str): The stage name.
+    - deps (list, optional): Names of the stages whose outputs the stage takes. Default is [].
+    - sources (list, optional): Names of parameters holding input file paths or globs, relative to the
+                                working directory; their size and mtime are part of the stage key. Default is [].
+
+    Returns:
+    - callable: The decorator.
+    """
+    def register(function):
+        assert name not in STAGES and all(dep in STAGES for dep in deps)
+        defaults = {k: p.default for k, p in inspect.signature(function).parameters.items()
+                    if p.default is not inspect.Parameter.empty}
+        STAGES[name] = {'function': function, 'deps': list(deps), 'params': defaults, 'sources': list(sources)}
+        return function
+    return register
+
+@stage('storm', sources=['path'])
+def storm_stage(path="/dataset/*.csv.gz"):
+    storm = read_all_zipped_csv(path, usecols=STORM_USECOLS, dtype=STORM_DTYPES, compact=True)
+    storm['DAMAGE'] = (parse_damage(storm['DAMAGE_PROPERTY']) + parse_damage(storm['DAMAGE_CROPS'])) / 1000000
+    return storm.dropna(subset=['DAMAGE']).reset_index(drop=True)
+
+@stage('counties', sources=['path'])
+def counties_stage(path="/dataset/cb_2022_us_county_500k"):
+    return read_gpd_file(path)
+
+@stage('lookup', deps=['counties'])
+def lookup_stage(counties):
+    return build_county_lookup(counties)
+
+@stage('hpi', sources=['path'])
+def hpi_stage(path="/dataset/HPI_AT_BDL_county.xlsx", skiprows=6):
+    hpi = read_excel_file(path, skiprows)
+    hpi['Year'] = hpi['Year'].astype(int)
+    hpi['Annual Change (%)'] = pd.to_numeric(hpi['Annual Change (%)'], errors='coerce')
+    hpi['HPI'] = pd.to_numeric(hpi['HPI'], errors='coerce')
+    return pd.concat([hpi, lag_hpi_changes(hpi)], axis=1)
+
+@stage('panel', deps=['storm', 'hpi', 'lookup'])
+def panel_stage(storm, hpi, lookup, first_year=1980):
+    panel, _ = build_county_year_panel(storm, hpi, lookup)
+    panel = panel[panel['Year'] >= first_year].reset_index(drop=True)
+    lagged = panel_shift(panel, ['county_key'], 'Year', ['DAMAGE', 'FREQ'], [1])
+    panel['lag_damage'] = lagged['DAMAGE_lag1']
+    panel['lag_freq'] = lagged['FREQ_lag1']
+    panel['damage_change'] = panel['DAMAGE'] - panel['lag_damage']
+    panel['freq_change'] = panel['FREQ'] - panel['lag_freq']
+    return panel
+
+@stage('groups', deps=['panel', 'counties'])
+def groups_stage(panel, counties, q_low=0.25, q_high=0.75):
+    freq = panel.groupby('county_key', as_index=False).agg(State=('State', 'first'), County=('County', 'first'),
+                                                           FREQ=('FREQ', 'sum'))
+    shapes = counties[['geometry']].assign(county_key=county_key(counties['STATEFP'], counties['COUNTYFP']))
+    freq = freq.merge(shapes.drop_duplicates('county_key'), on='county_key')
+    low = freq[freq['FREQ'] < freq['FREQ'].quantile(q_low)].reset_index(drop=True)
+    high = freq[freq['FREQ'] > freq['FREQ'].quantile(q_high)].reset_index(drop=True)
+    return {'high': high, 'low': low}
+
+@stage('matched', deps=['panel', 'groups'])
+def matched_stage(panel, groups, caliper=None):
+    pairs = get_nearest_county(groups['high'].copy(), groups['low'], caliper=caliper)
+    pairs = pairs.dropna(subset=['neighbor_county_key'])[['county_key', 'neighbor_county_key', 'neighbor_state',
+                                                          'neighbor_county', 'neighbor_distance']]
+    columns = ['county_key', 'State', 'County', 'Year', 'FREQ', 'DAMAGE', 'HPI', 'lag_damage', 'lag_freq',
+               'damage_change', 'freq_change'] + LAG_COLUMNS
+    matched = panel[columns].merge(pairs, on='county_key')
+    return matched.merge(panel[columns], left_on=['neighbor_county_key', 'Year'], right_on=['county_key', 'Year'],
+                         suffixes=('_h', '_l'))
+
+@stage('ttests', deps=['matched'])
+def ttests_stage(matched, confidence=0.95):
+    return paired_ttests(matched, [(col + '_h', col + '_l') for col in LAG_COLUMNS], confidence=confidence)
+
+@stage('correlations', deps=['panel'])
+def correlations_stage(panel, methods=['pearson', 'spearman']):
+    return corr_matrix(panel, ['DAMAGE', 'FREQ', 'damage_change', 'freq_change'], LAG_COLUMNS, methods=methods)
+
+@stage('figures', deps=['matched', 'correlations'])
+def figures_stage(matched, correlations, compact=True):
+    h_year = matched.groupby('Year')['Annual Change (%)_h'].mean()
+    l_year = matched.groupby('Year')['Annual Change (%)_l'].mean()
+    r = corr_table(correlations, 'r')
+    p = corr_table(correlations, 'p').round(3)
+    specs = [
+        {'function': 'plot_two_lines',
+         'args': [list(h_year.index), list(l_year.index), h_year.to_numpy(), l_year.to_numpy(),
+                  'Heavily-affected Counties', 'Neighboring Less-affected Counties',
+                  "Average House Price Change (%) <br>of Disasters' Happened Year", 'Year', 'Percentage'],
+         'kwargs': {'filename': "Average House Price Change for Disasters Happened Year.html", 'compact': compact}},
+        {'function': 'plot_correlation',
+         'args': [r, p.values.tolist(), list(r.columns), list(r.index)],
+         'kwargs': {'title': 'Correlation Coefficient of Disasters & House Price Change',
+                    'filename': 'Correlation Coefficient of Disasters & House Price Change.html', 'compact': compact}},
+    ]
+    return render_plots(specs)
+
+def _code_hash(function):
+    """
+    Hash the source of a stage function and of every scripts module it depends on.
+
+    The modules named by the function are followed through their own scripts imports, so a stage is also
+    invalidated by changes to helpers it reaches indirectly, e.g. the plot modules called by render_plots
+    and the geometry and clean modules they use.
+
+    Parameters:
+    - function (callable): The stage function.
+
+    Returns:
+    - str: The hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256(inspect.getsource(function).encode())
+    modules = [m for name in function.__code__.co_names for m in scripts_modules(function.__globals__.get(name))]
+    for file in module_files(modules):
+        with open(file, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _source_state(params, sources):
+    """
+    Describe the input files of a stage by name, size and mtime.
+
+    Parameters:
+    - params (dict): The stage parameters.
+    - sources (list): Names of the parameters holding paths or globs.
+
+    Returns:
+    - list: [path, size, mtime_ns] of every matching file.
+    """
+    state = []
+    for param in sources:
+        for match in sorted(glob.glob(os.getcwd() + params[param])):
+            files = sorted(glob.glob(os.path.join(match, '*'))) if os.path.isdir(match) else [match]
+            state.extend([os.path.relpath(f), os.path.getsize(f), os.stat(f).st_mtime_ns] for f in files)
+    return state
+
+def _required(targets):
+    """
+    List the stages needed for targets in dependency order.
+
+    Parameters:
+    - targets (list): Stage names.
+
+    Raises:
+    - AssertionError: If a target is not a registered stage.
+
+    Returns:
+    - list: The stage names, every stage after its dependencies.
+    """
+    assert all(t in STAGES for t in targets), "unknown stages: {}".format(sorted(set(targets) - set(STAGES)))
+    order, seen = [], set()
+
+    def visit(name):
+        if name not in seen:
+            seen.add(name)
+            for dep in STAGES[name]['deps']:
+                visit(dep)
+            order.append(name)
+
+    for target in targets:
+        visit(target)
+    return order
+
+def run_pipeline(targets=None, overrides=None, force=[], cache_dir=PIPELINE_DIR, verbose=False):
+    """
+    Run the stages needed for targets, reusing every cached stage whose key is unchanged.
+
+    Parameters:
+    - targets (list, optional): Names of the stages to produce. Default is None, which runs every stage.
+    - overrides (dict, optional): Stage name to a dict of parameter values, e.g. {'groups': {'q_high': 0.8}}. Default is None.
+    - force (list, optional): Names of stages to recompute even if cached. Default is [].
+    - cache_dir (str, optional): Directory of the stage cache, relative to the working directory. Default is PIPELINE_DIR.
+    - verbose (bool, optional): Whether to print one line per stage. Default is False.
+
+    Raises:
+    - AssertionError: If targets, overrides or force name unknown stages or parameters.
+
+    Returns:
+    - dict: The output of every target stage.
+    - pd.DataFrame: One row per stage run with 'stage', 'status' ('cached' or 'computed'), 'seconds' and 'key'.
+    """
+    targets = list(STAGES) if targets is None else targets
+    overrides = {} if overrides is None else overrides
+    assert isinstance(targets, list) and isinstance(overrides, dict) and isinstance(force, list)
+    assert all(s in STAGES and set(p) <= set(STAGES[s]['params']) for s, p in overrides.items())
+
+    root = os.getcwd() + cache_dir
+    os.makedirs(root, exist_ok=True)
+    try:
+        with open(os.path.join(root, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+
+    order = _required(targets)
+    keys, files, outputs, report = {}, {}, {}, []
+
+    def load(name):
+        if name not in outputs:
+            with open(files[name], 'rb') as f:
+                outputs[name] = pickle.load(f)
+        return outputs[name]
+
+    for name in order:
+        spec = STAGES[name]
+        params = dict(spec['params'], **overrides.get(name, {}))
+        key = hashlib.sha256(json.dumps([name, _code_hash(spec['function']), repr(sorted(params.items())),
+                                         [manifest[keys[dep]] for dep in spec['deps']],
+                                         _source_state(params, spec['sources'])]).encode()).hexdigest()
+        keys[name] = key
+        files[name] = os.path.join(root, "{}-{}.pkl".format(name, key[:24]))
+
+        start = time.perf_counter()
+        if name in force or key not in manifest or not os.path.exists(files[name]):
+            output = spec['function'](*[load(dep) for dep in spec['deps']], **params)
+            payload = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp = files[name] + ".tmp"
+            with open(tmp, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp, files[name])
+            manifest[key] = hashlib.sha256(payload).hexdigest()
+            outputs[name] = output
+            status = 'computed'
+        else:
+            status = 'cached'
+        report.append({'stage': name, 'status': status, 'seconds': time.perf_counter() - start, 'key': key[:12]})
+        if verbose:
+            print("{stage:<14} {status:<9} {seconds:8.2f} s  {key}".format(**report[-1]))
+
+    tmp = os.path.join(root, "manifest.json.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(root, "manifest.json"))
+    return {name: load(name) for name in targets}, pd.DataFrame(report)
+
+def _parse_assignment(text):
+    """
+    Parse a '--set stage.param=value' argument, reading the value as JSON when possible.
+
+    Parameters:
+    - text (str): The argument.
+
+    Returns:
+    - tuple: (stage, param, value).
+    """
+    target, value = text.split('=', 1)
+    name, param = target.split('.', 1)
+    try:
+        value = json.loads(value)
+    except json.JSONDecodeError:
+        pass
+    return name, param, value
+
+def main(argv=None):
+    # the command line runs headless; notebooks importing run_pipeline keep their own backend
+    import matplotlib
+    matplotlib.use('Agg')
+
+    parser = argparse.ArgumentParser(description="Run the analysis pipeline with cached stages.")
+    parser.add_argument('--target', action='append', default=None, help="stage to produce (repeatable); default all")
+    parser.add_argument('--set', action='append', default=[], metavar='STAGE.PARAM=VALUE', help="override a stage parameter")
+    parser.add_argument('--force', action='append', default=[], help="stage to recompute even if cached (repeatable)")
+    parser.add_argument('--list', action='store_true', help="list the stages and their parameters")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, spec in STAGES.items():
+            print("{:<14} deps={} params={}".format(name, spec['deps'], spec['params']))
+        return 0
+
+    overrides = {}
+    for text in args.set:
+        name, param, value = _parse_assignment(text)
+        overrides.setdefault(name, {})[param] = value
+    run_pipeline(args.target, overrides, args.force, verbose=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,8 +2,154 @@ import plotly.graph_objects as go
 import plotly.express as px
 import numpy as np
 import pandas as pd
+from scripts.instrument import instrumented
 
-def plot_bar_and_line(x, y_bar, y_line, name_bar="", name_line="", title="", x_title="", y_bar_title="", y_line_title="", filename="plot_bar_line.html"):
+COMPACT_MAX_POINTS = 5000
+
+COMPACT_DIGITS = 4
+
+@instrumented
+def lttb_indices(x, y, n_out):
+    """
+    Pick the points of a line to keep with Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last points are always kept; every bucket in between contributes the point forming the
+    largest triangle with the previously kept point and the mean of the next bucket, which preserves peaks.
+
+    Parameters:
+    - x (np.ndarray): Non-decreasing x values.
+    - y (np.ndarray): The y values.
+    - n_out (int): Number of points to keep, at least 3.
+
+    Raises:
+    - AssertionError: If x and y differ in length, x decreases anywhere or n_out is less than 3.
+
+    Returns:
+    - np.ndarray: The sorted int64 positions of the kept points.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    assert x.shape == y.shape and isinstance(n_out, int) and n_out >= 3
+    assert not (np.diff(x) < 0).any(), "x must be sorted"
+
+    n = len(x)
+    if n <= n_out:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nxt = slice(hi, edges[b + 2]) if b + 2 < len(edges) else slice(n - 1, n)
+        ax, ay = x[keep[b]], y[keep[b]]
+        cx, cy = np.nanmean(x[nxt]), np.nanmean(y[nxt])
+        area = np.abs((ax - cx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (cy - ay))
+        keep[b + 1] = lo + (int(np.nanargmax(area)) if np.isfinite(area).any() else 0)
+    return keep
+
+def _round_significant(values, digits=COMPACT_DIGITS):
+    """
+    Round every number of an array to a number of significant digits of its own magnitude.
+
+    Parameters:
+    - values (array-like): The numbers.
+    - digits (int, optional): Significant digits kept. Default is COMPACT_DIGITS.
+
+    Returns:
+    - np.ndarray: The rounded float64 array, whose JSON encoding is short. Zeros and non-finite values are kept.
+    """
+    values = np.asarray(values, dtype=float)
+    magnitude = np.abs(values)
+    use = np.isfinite(values) & (magnitude > 0)
+    if not use.any():
+        return values
+    decimals = np.zeros(values.shape, dtype=np.int64)
+    decimals[use] = digits - 1 - np.floor(np.log10(magnitude[use])).astype(np.int64)
+    # scale by an exact power of ten in the direction of the rounding to avoid 0.1-style representation error
+    with np.errstate(over='ignore', invalid='ignore'):
+        scale = 10.0 ** np.abs(decimals)
+        rounded = np.where(decimals >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale)
+    return np.where(use & np.isfinite(rounded), rounded, values)
+
+def _round_spacing(values, fraction=100):
+    """
+    Round axis positions to a fraction of their smallest spacing, so distinct positions stay distinct.
+
+    Parameters:
+    - values (array-like): The positions, e.g. the x values of a trace.
+    - fraction (int, optional): Number of rounding steps per smallest gap between distinct positions. Default is 100.
+
+    Returns:
+    - np.ndarray: The rounded float64 array; unchanged when there are fewer than two distinct finite positions.
+    """
+    values = np.asarray(values, dtype=float)
+    distinct = np.unique(values[np.isfinite(values)])
+    if len(distinct) < 2:
+        return values
+    decimals = -int(np.floor(np.log10(np.diff(distinct).min() / fraction)))
+    return np.round(values, decimals)
+
+def _is_numeric(values):
+    return values is not None and not isinstance(values, str) and np.asarray(values).dtype.kind in 'iuf'
+
+def _compact_figure(fig, max_points=COMPACT_MAX_POINTS, digits=COMPACT_DIGITS):
+    """
+    Make a lighter copy of a figure: long lines become LTTB-downsampled Scattergl traces and numeric data is rounded.
+
+    Only traces whose x is sorted (or not numeric, in which case the point order is used) are downsampled, since
+    LTTB buckets consecutive x values; other long traces are drawn with WebGL in full.
+
+    Parameters:
+    - fig (go.Figure): The figure.
+    - max_points (int, optional): Points above which a scatter trace is downsampled and drawn with WebGL. Default is COMPACT_MAX_POINTS.
+    - digits (int, optional): Significant digits kept in y and z; x is rounded by _round_spacing. Default is COMPACT_DIGITS.
+
+    Returns:
+    - go.Figure: The compacted figure.
+    """
+    traces = []
+    for trace in fig.data:
+        spec = trace.to_plotly_json()
+        kind = spec.pop('type')
+        n = len(spec['y']) if spec.get('y') is not None else 0
+        if kind == 'scatter' and n > max_points and _is_numeric(spec['y']):
+            x = spec['x'] if _is_numeric(spec.get('x')) else np.arange(n)
+            if not (np.diff(np.asarray(x, dtype=float)) < 0).any():
+                keep = lttb_indices(x, spec['y'], max_points)
+                for key, value in spec.items():
+                    if not isinstance(value, (str, dict)) and np.ndim(value) == 1 and len(value) == n:
+                        spec[key] = np.asarray(value)[keep]
+            kind = 'scattergl'
+        if _is_numeric(spec.get('x')):
+            spec['x'] = _round_spacing(spec['x'])
+        for key in ('y', 'z'):
+            if _is_numeric(spec.get(key)):
+                spec[key] = _round_significant(spec[key], digits)
+        traces.append(dict(spec, type=kind))
+    return go.Figure(data=traces, layout=fig.layout)
+
+def _write_html(fig, filename, compact=False):
+    """
+    Write a figure to ./plots/, optionally in the compact form.
+
+    The compact form references one shared plotly.min.js in the plots directory instead of inlining the
+    ~3.5 MB bundle, and stores the data as produced by _compact_figure.
+
+    Parameters:
+    - fig (go.Figure): The figure.
+    - filename (str): File name of the HTML file.
+    - compact (bool, optional): Whether to write the compact form. Default is False.
+
+    Returns:
+    None
+    """
+    if compact:
+        _compact_figure(fig).write_html("./plots/"+filename, include_plotlyjs='directory')
+    else:
+        fig.write_html("./plots/"+filename)
+
+@instrumented
+def plot_bar_and_line(x, y_bar, y_line, name_bar="", name_line="", title="", x_title="", y_bar_title="", y_line_title="", filename="plot_bar_line.html", compact=False, show=True):
     """
     Create and display a combined bar and line plot using Plotly.
 
@@ -18,6 +164,8 @@ def plot_bar_and_line(x, y_bar, y_line, name_bar="", name_line="", title="", x_t
     - y_bar_title (str, optional): Label for the y-axis (bar plot). Default is an empty string.
     - y_line_title (str, optional): Label for the y-axis (line plot). Default is an empty string.
     - filename (str, optional): File name to save the plot as an HTML file. Default is an empty string.
+    - compact (bool, optional): Whether to write the compact HTML form (shared plotly.js, rounded and downsampled data). Default is False.
+    - show (bool, optional): Whether to display the figure after saving it. Default is True.
 
     Raises:
     - AssertionError: If any input argument is not of the expected type or if the filename format is invalid.
@@ -29,6 +177,7 @@ def plot_bar_and_line(x, y_bar, y_line, name_bar="", name_line="", title="", x_t
     assert isinstance(name_bar, str) and isinstance(name_line, str) and isinstance(title, str)
     assert isinstance(x_title, str) and isinstance(y_bar_title, str) and isinstance(y_line_title, str)
     assert isinstance(filename, str) and len(filename) > 5 and filename[-5:] == ".html"
+    assert isinstance(compact, bool) and isinstance(show, bool)
 
     fig = go.Figure()
 
@@ -47,10 +196,12 @@ def plot_bar_and_line(x, y_bar, y_line, name_bar="", name_line="", title="", x_t
         legend=dict(x=0.02, y=1.0, font=dict(size=16))
     )
 
-    fig.write_html("./plots/"+filename)
-    fig.show()
+    _write_html(fig, filename, compact)
+    if show:
+        fig.show()
 
-def plot_bar_chart(name, val,title="", title_yaxis="",filename="plot_bar.html"):
+@instrumented
+def plot_bar_chart(name, val,title="", title_yaxis="",filename="plot_bar.html", compact=False, show=True):
     """
     Create and display a bar chart using Plotly Express.
 
@@ -60,6 +211,8 @@ def plot_bar_chart(name, val,title="", title_yaxis="",filename="plot_bar.html"):
     - title (str): Title for the plot.
     - title_yaxis (str): Label for the y-axis.
     - filename (str): File name to save the plot as an HTML file.
+    - compact (bool, optional): Whether to write the compact HTML form (shared plotly.js, rounded and downsampled data). Default is False.
+    - show (bool, optional): Whether to display the figure after saving it. Default is True.
 
     Raises:
     - AssertionError: If any input argument is not of the expected type or if the filename format is invalid.
@@ -69,6 +222,7 @@ def plot_bar_chart(name, val,title="", title_yaxis="",filename="plot_bar.html"):
     """
     assert isinstance(name, (list, np.ndarray)) and isinstance(val, (list, np.ndarray)) and isinstance(title, str) and isinstance(title_yaxis, str)
     assert isinstance(filename, str) and len(filename) > 5 and filename[-5:] == ".html"
+    assert isinstance(compact, bool) and isinstance(show, bool)
 
     x_labels=[]
     for label in name:
@@ -88,10 +242,12 @@ def plot_bar_chart(name, val,title="", title_yaxis="",filename="plot_bar.html"):
         bargap=0.5,
         bargroupgap=0.1,
     )
-    fig.write_html("./plots/"+filename)
-    fig.show()
+    _write_html(fig, filename, compact)
+    if show:
+        fig.show()
 
-def plot_scatter_line(x, y, name="", title="", x_title="", y_title="", filename="plot_scatter.html"):
+@instrumented
+def plot_scatter_line(x, y, name="", title="", x_title="", y_title="", filename="plot_scatter.html", compact=False, show=True):
     """
     Create and display a scatter plot with a line using Plotly.
 
@@ -103,6 +259,8 @@ def plot_scatter_line(x, y, name="", title="", x_title="", y_title="", filename=
     - x_title (str): Label for the x-axis.
     - y_title (str): Label for the y-axis.
     - filename (str): File name to save the plot as an HTML file.
+    - compact (bool, optional): Whether to write the compact HTML form (shared plotly.js, rounded and downsampled data). Default is False.
+    - show (bool, optional): Whether to display the figure after saving it. Default is True.
 
     Raises:
     - AssertionError: If any input argument is not of the expected type or if the filename format is invalid.
@@ -113,6 +271,7 @@ def plot_scatter_line(x, y, name="", title="", x_title="", y_title="", filename=
     assert isinstance(x, (list, np.ndarray)) and isinstance(y, (list, np.ndarray)) and isinstance(name, str)
     assert isinstance(title, str) and isinstance(x_title, str) and isinstance(y_title, str)
     assert isinstance(filename, str) and len(filename) > 5 and filename[-5:] == ".html"
+    assert isinstance(compact, bool) and isinstance(show, bool)
     
     fig = go.Figure()
 
@@ -130,19 +289,26 @@ def plot_scatter_line(x, y, name="", title="", x_title="", y_title="", filename=
         legend=dict(x=0.02, y=1.0, font=dict(size=16))
     )
 
-    fig.write_html("./plots/"+filename)
-    fig.show()
+    _write_html(fig, filename, compact)
+    if show:
+        fig.show()
 
-def plot_heatmap(heatmap, title="", x_title="", y_title="", filename="plot_heatmap.html"):
+@instrumented
+def plot_heatmap(heatmap, title="", x_title="", y_title="", filename="plot_heatmap.html", aggregate_level=None, compact=False, show=True):
     """
     Create and display a heatmap using Plotly based on a pandas DataFrame.
 
     Parameters:
-    - heatmap (pd.DataFrame): The DataFrame containing the heatmap data.
+    - heatmap (pd.DataFrame): The DataFrame containing the heatmap data, e.g. a pivot_table of the long panel or the
+                              memory-mapped view from panel_store.heatmap_frame.
     - title (str): Title for the heatmap.
     - x_title (str): Label for the x-axis.
     - y_title (str): Label for the y-axis.
     - filename (str): File name to save the plot as an HTML file.
+    - aggregate_level (str or int, optional): Index level to average the rows over before plotting, e.g. 'State' to
+                                              draw one row per state instead of one per county. Default is None.
+    - compact (bool, optional): Whether to write the compact HTML form (shared plotly.js, rounded and downsampled data). Default is False.
+    - show (bool, optional): Whether to display the figure after saving it. Default is True.
 
     Raises:
     - AssertionError: If the input heatmap is not a pandas DataFrame or if any other input argument is not of the expected type.
@@ -154,6 +320,11 @@ def plot_heatmap(heatmap, title="", x_title="", y_title="", filename="plot_heatm
     assert isinstance(heatmap, pd.DataFrame)
     assert isinstance(title, str) and isinstance(x_title, str) and isinstance(y_title, str)
     assert isinstance(filename, str) and len(filename) > 5 and filename[-5:] == ".html"
+    assert aggregate_level is None or isinstance(aggregate_level, (str, int))
+    assert isinstance(compact, bool) and isinstance(show, bool)
+
+    if aggregate_level is not None:
+        heatmap = heatmap.groupby(level=aggregate_level).mean()
 
     fig = go.Figure(data=go.Heatmap(
                    z=heatmap.values,
@@ -174,10 +345,12 @@ def plot_heatmap(heatmap, title="", x_title="", y_title="", filename="plot_heatm
         xaxis_range=[heatmap.columns[0], heatmap.columns[-1]],
     )
 
-    fig.write_html("./plots/"+filename)
-    fig.show()
+    _write_html(fig, filename, compact)
+    if show:
+        fig.show()
 
-def plot_two_scatter_lines(x, y1, y2, name1="", name2="", title="", x_title="", y_title1="", y_title2="", filename="plot_two_scatter.html"):
+@instrumented
+def plot_two_scatter_lines(x, y1, y2, name1="", name2="", title="", x_title="", y_title1="", y_title2="", filename="plot_two_scatter.html", compact=False, show=True):
     """
     Create and display a plot with two scatter lines using Plotly.
 
@@ -192,6 +365,8 @@ def plot_two_scatter_lines(x, y1, y2, name1="", name2="", title="", x_title="",
     - y_title1 (str): Label for the first y-axis.
     - y_title2 (str): Label for the second y-axis.
     - filename (str): File name to save the plot as an HTML file.
+    - compact (bool, optional): Whether to write the compact HTML form (shared plotly.js, rounded and downsampled data). Default is False.
+    - show (bool, optional): Whether to display the figure after saving it. Default is True.
 
     Raises:
     - AssertionError: If any input argument is not of the expected type or if the filename format is invalid.
@@ -202,6 +377,7 @@ def plot_two_scatter_lines(x, y1, y2, name1="", name2="", title="", x_title="",
     assert isinstance(x, (list, np.ndarray)) and isinstance(y1, (list, np.ndarray)) and isinstance(y2, (list, np.ndarray)) and isinstance(name1, str) and isinstance(name2, str)
     assert isinstance(title, str) and isinstance(x_title, str) and isinstance(y_title1, str) and isinstance(y_title2, str)
     assert isinstance(filename, str) and len(filename) > 5 and filename[-5:] == ".html"
+    assert isinstance(compact, bool) and isinstance(show, bool)
 
     fig = go.Figure()
 
@@ -222,20 +398,24 @@ def plot_two_scatter_lines(x, y1, y2, name1="", name2="", title="", x_title="",
         legend=dict(x=0.02, y=1.0, font=dict(size=16))
     )
 
-    fig.write_html("./plots/"+filename)
-    fig.show()
+    _write_html(fig, filename, compact)
+    if show:
+        fig.show()
 
-def plot_correlation(corr_data, corr_p, x, y, title="", filename="plot_corr.html"):
+@instrumented
+def plot_correlation(corr_data, corr_p, x, y, title="", filename="plot_corr.html", compact=False, show=True):
     """
     Create and display a heatmap of correlation coefficients with significance indicators using Plotly Express.
 
     Parameters:
-    - corr_data (list): List of correlation coefficients.
+    - corr_data (list or pd.DataFrame): List of correlation coefficients, or a driver x target table from stats.corr_table.
     - corr_p (list): List of p-values corresponding to the correlation coefficients.
     - x (list): Labels for the x-axis.
     - y (list): Labels for the y-axis.
     - title (str): Title for the plot.
     - filename (str): File name to save the plot as an HTML file.
+    - compact (bool, optional): Whether to write the compact HTML form (shared plotly.js, rounded and downsampled data). Default is False.
+    - show (bool, optional): Whether to display the figure after saving it. Default is True.
 
     Raises:
     - AssertionError: If any input argument is not of the expected type or if the filename format is invalid.
@@ -243,8 +423,12 @@ def plot_correlation(corr_data, corr_p, x, y, title="", filename="plot_corr.html
     Returns:
     None
     """
-    assert isinstance(corr_data, list) and isinstance(corr_p, list) and isinstance(x, list) and isinstance(y, list)
+    assert isinstance(corr_data, (list, pd.DataFrame)) and isinstance(corr_p, list) and isinstance(x, list) and isinstance(y, list)
     assert isinstance(title, str) and isinstance(filename, str) and len(filename) > 5 and filename[-5:] == ".html"
+    assert isinstance(compact, bool) and isinstance(show, bool)
+
+    if isinstance(corr_data, pd.DataFrame):
+        corr_data = corr_data.values.tolist()
 
     fig = px.imshow(corr_data, x=x, y=y, color_continuous_scale='Viridis', aspect="auto")
     fig.update_traces(text=corr_p, texttemplate="%{text}", textfont_size = 16)
@@ -264,10 +448,12 @@ def plot_correlation(corr_data, corr_p, x, y, title="", filename="plot_corr.html
         bargroupgap=0.1,
     )
     
-    fig.write_html("./plots/"+filename)
-    fig.show()
+    _write_html(fig, filename, compact)
+    if show:
+        fig.show()
 
-def plot_two_lines(x1,x2, y1, y2, name1="", name2="", title="", x_title="", y_title="",legend={},filename="plot_two_lines.html"):
+@instrumented
+def plot_two_lines(x1,x2, y1, y2, name1="", name2="", title="", x_title="", y_title="",legend={},filename="plot_two_lines.html", compact=False, show=True):
     """
     Create and display a plot with two lines using Plotly.
 
@@ -283,6 +469,8 @@ def plot_two_lines(x1,x2, y1, y2, name1="", name2="", title="", x_title="", y_ti
     - y_title (str): Label for the y-axis.
     - legend (dict): Dictionary of legend settings.
     - filename (str): File name to save the plot as an HTML file.
+    - compact (bool, optional): Whether to write the compact HTML form (shared plotly.js, rounded and downsampled data). Default is False.
+    - show (bool, optional): Whether to display the figure after saving it. Default is True.
 
     Raises:
     - AssertionError: If any input argument is not of the expected type or if the filename format is invalid.
@@ -295,6 +483,7 @@ def plot_two_lines(x1,x2, y1, y2, name1="", name2="", title="", x_title="", y_ti
     assert isinstance(name1, str) and isinstance(name2, str) and isinstance(title, str)
     assert isinstance(legend, dict) and isinstance(x_title, str) and isinstance(y_title, str)
     assert isinstance(filename, str) and len(filename) > 5 and filename[-5:] == ".html"
+    assert isinstance(compact, bool) and isinstance(show, bool)
 
     fig = go.Figure()
 
@@ -316,10 +505,12 @@ def plot_two_lines(x1,x2, y1, y2, name1="", name2="", title="", x_title="", y_ti
         legend=legend
     )
 
-    fig.write_html("./plots/"+filename)
-    fig.show()
+    _write_html(fig, filename, compact)
+    if show:
+        fig.show()
 
-def plot_reverse_bars(x, y, text, name="", title="", x_title="", y_title="", filename="plot_reverse_bars.html"):
+@instrumented
+def plot_reverse_bars(x, y, text, name="", title="", x_title="", y_title="", filename="plot_reverse_bars.html", compact=False, show=True):
     """
     Create and display a bar plot with reversed y-axis values using Plotly.
 
@@ -331,6 +522,8 @@ def plot_reverse_bars(x, y, text, name="", title="", x_title="", y_title="", fil
     - x_title (str): Label for the x-axis.
     - y_title (str): Label for the y-axis.
     - filename (str): File name to save the plot as an HTML file.
+    - compact (bool, optional): Whether to write the compact HTML form (shared plotly.js, rounded and downsampled data). Default is False.
+    - show (bool, optional): Whether to display the figure after saving it. Default is True.
 
     Raises:
     - AssertionError: If any input argument is not of the expected type or if the filename format is invalid.
@@ -341,6 +534,7 @@ def plot_reverse_bars(x, y, text, name="", title="", x_title="", y_title="", fil
     assert isinstance(x, (list, np.ndarray)) and isinstance(y, (list, np.ndarray)) and isinstance(text, list)
     assert isinstance(name, str) and isinstance(title, str) and isinstance(x_title, str) and isinstance(y_title, str)
     assert isinstance(filename, str) and len(filename) > 5 and filename[-5:] == ".html"
+    assert isinstance(compact, bool) and isinstance(show, bool)
 
     fig = go.Figure()
 
@@ -360,5 +554,6 @@ def plot_reverse_bars(x, y, text, name="", title="", x_title="", y_title="", fil
         bargroupgap=0.1
     )
 
-    fig.write_html("./plots/"+filename)
-    fig.show()
\ No newline at end of file
+    _write_html(fig, filename, compact)
+    if show:
+        fig.show()
\ No newline at end of file
@@ -0,0 +1,280 @@
+import pandas as pd
+import numpy as np
+import shapely
+import os
+import ast
+import hashlib
+import importlib
+import inspect
+import json
+import sys
+import shutil
+import tempfile
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+RENDER_DIR = "/.cache/render"
+
+PLOT_MODULES = ['scripts.plotly_plots', 'scripts.mpl_plots']
+
+def _plot_function(name):
+    """
+    Look up a plot function by name in PLOT_MODULES.
+
+    Parameters:
+    - name (str): The function name, e.g. 'plot_heatmap'.
+
+    Raises:
+    - AssertionError: If no plot module defines the function.
+
+    Returns:
+    - function: The plot function.
+    """
+    for module in PLOT_MODULES:
+        function = getattr(importlib.import_module(module), name, None)
+        if callable(function):
+            return function
+    raise AssertionError("unknown plot function: " + name)
+
+def scripts_modules(value):
+    """
+    Find the scripts modules a global refers to: the module itself, the module defining a function or class,
+    or the modules named in a list of module names such as render.PLOT_MODULES, which are imported lazily.
+
+    Parameters:
+    - value (object): A global of a stage function or module.
+
+    Returns:
+    - list: The scripts modules, empty for anything defined elsewhere.
+    """
+    if isinstance(value, (list, tuple)) and value and all(isinstance(v, str) and v.startswith('scripts.') for v in value):
+        return [importlib.import_module(name) for name in value]
+    module = value if isinstance(value, types.ModuleType) else sys.modules.get(getattr(value, '__module__', None) or '')
+    if module is not None and module.__name__.startswith('scripts.') and getattr(module, '__file__', None):
+        return [module]
+    return []
+
+def _module_imports(module):
+    """
+    List the scripts modules a module imports, including those it only takes constants from.
+
+    Parameters:
+    - module (module): A scripts module.
+
+    Returns:
+    - list: The imported scripts modules and those named in its module-name lists.
+    """
+    with open(module.__file__) as f:
+        tree = ast.parse(f.read())
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module == 'scripts':
+            names.extend('scripts.' + alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and (node.module or '').startswith('scripts.'):
+            names.append(node.module)
+        elif isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names if alias.name.startswith('scripts.'))
+    modules = [importlib.import_module(name) for name in names]
+    return modules + [m for value in list(vars(module).values()) if isinstance(value, (list, tuple))
+                      for m in scripts_modules(value)]
+
+def module_files(modules):
+    """
+    Collect the source files of scripts modules and of every scripts module they import, transitively.
+
+    Parameters:
+    - modules (list): Scripts modules.
+
+    Returns:
+    - list: The sorted absolute file paths.
+    """
+    pending, files = list(modules), set()
+    while pending:
+        module = pending.pop()
+        if module.__file__ not in files:
+            files.add(module.__file__)
+            pending.extend(_module_imports(module))
+    return sorted(files)
+
+def _hash_value(value, digest):
+    """
+    Feed a stable description of a plot argument into a hash.
+
+    DataFrames and Series are hashed by content (geometry columns as WKB), arrays by dtype, shape and
+    bytes, and containers recursively, so equal inputs give equal hashes across processes and sessions.
+
+    Parameters:
+    - value: The argument.
+    - digest (hashlib object): The hash to update.
+
+    Returns:
+    None
+    """
+    if isinstance(value, pd.DataFrame):
+        digest.update(b'frame' + repr((list(value.columns), value.shape)).encode())
+        _hash_value(value.index, digest)
+        for col in value.columns:
+            _hash_value(value[col], digest)
+    elif isinstance(value, (pd.Series, pd.Index)):
+        digest.update(repr((type(value).__name__, str(value.dtype), len(value))).encode())
+        if str(value.dtype) == 'geometry':
+            digest.update(b''.join(w or b'' for w in shapely.to_wkb(np.asarray(value, dtype=object))))
+        else:
+            digest.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((str(value.dtype), value.shape)).encode())
+        digest.update(value.tobytes() if value.dtype != object else repr(value.tolist()).encode())
+    elif isinstance(value, dict):
+        digest.update(b'dict')
+        for key in sorted(value, key=repr):
+            digest.update(repr(key).encode())
+            _hash_value(value[key], digest)
+    elif isinstance(value, (list, tuple)):
+        digest.update(repr((type(value).__name__, len(value))).encode())
+        for item in value:
+            _hash_value(item, digest)
+    else:
+        digest.update(repr(value).encode())
+
+def spec_hash(spec):
+    """
+    Hash a plot specification by function name, arguments and the source of the plot module and of the
+    scripts modules it imports, so edits to shared helpers (e.g. clean or geometry) also re-render.
+
+    Parameters:
+    - spec (dict): A plot specification, see render_plots.
+
+    Returns:
+    - str: The hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256(spec['function'].encode())
+    for file in module_files(scripts_modules(_plot_function(spec['function']))):
+        with open(file, 'rb') as f:
+            digest.update(f.read())
+    _hash_value(list(spec.get('args', [])), digest)
+    _hash_value(dict(spec.get('kwargs', {})), digest)
+    return digest.hexdigest()
+
+def _init_worker():
+    """
+    Switch a render worker to the non-interactive Agg backend before any figure is created.
+
+    Returns:
+    None
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+
+def _render_spec(spec, root, out_dir):
+    """
+    Render one plot specification in a render worker and move its outputs into place atomically.
+
+    The plot function runs with a private temporary working directory, so its './plots/' writes land in
+    a scratch folder on the same filesystem; finished files are then moved into out_dir with os.replace.
+
+    Parameters:
+    - spec (dict): A plot specification, see render_plots.
+    - root (str): The absolute render cache directory, which holds the scratch folders.
+    - out_dir (str): The absolute output directory.
+
+    Returns:
+    - dict: 'outputs' (list of file names), 'seconds' and 'error' (None on success).
+    """
+    import matplotlib.pyplot as plt
+
+    start = time.perf_counter()
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(dir=root)
+    outputs, error = [], None
+    try:
+        os.makedirs(os.path.join(scratch, 'plots'))
+        os.chdir(scratch)
+        function = _plot_function(spec['function'])
+        kwargs = dict(spec.get('kwargs', {}))
+        if 'show' in inspect.signature(function).parameters:
+            kwargs['show'] = False
+        function(*spec.get('args', []), **kwargs)
+        os.chdir(cwd)
+        os.makedirs(out_dir, exist_ok=True)
+        for name in sorted(os.listdir(os.path.join(scratch, 'plots'))):
+            os.replace(os.path.join(scratch, 'plots', name), os.path.join(out_dir, name))
+            outputs.append(name)
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    finally:
+        os.chdir(cwd)
+        plt.close('all')
+        shutil.rmtree(scratch, ignore_errors=True)
+    return {'outputs': outputs, 'seconds': time.perf_counter() - start, 'error': error}
+
+def render_plots(specs, max_workers=None, force=False, out_dir="/plots", render_dir=RENDER_DIR):
+    """
+    Render a batch of figures headlessly in a process pool, skipping figures whose inputs are unchanged.
+
+    Each specification names a function of plotly_plots or mpl_plots and its arguments, e.g.
+    {'function': 'plot_heatmap', 'args': [heatmap], 'kwargs': {'title': 'HPI', 'filename': 'heatmap.html'}}.
+    Workers use the Agg backend and call the functions with show=False. A manifest in render_dir records the
+    hash of every rendered specification (function source, data and parameters) and the files it wrote; a
+    specification whose hash is recorded and whose files still exist is skipped.
+
+    Parameters:
+    - specs (list): The plot specifications, dicts with 'function' and optional 'args' and 'kwargs'.
+    - max_workers (int, optional): Number of render processes. Default is None, which uses os.cpu_count().
+    - force (bool, optional): Whether to render every specification even if unchanged. Default is False.
+    - out_dir (str, optional): Directory the plot functions write to, relative to the working directory. Default is "/plots".
+    - render_dir (str, optional): Directory of the manifest and scratch folders, relative to the working directory. Default is RENDER_DIR.
+
+    Raises:
+    - AssertionError: If specs is not a list of dicts with a 'function' name, or any other argument has an unexpected value.
+
+    Returns:
+    - pd.DataFrame: One row per specification with 'function', 'status' ('rendered', 'skipped' or 'failed'),
+                    'outputs', 'seconds' and 'error'.
+    """
+    assert isinstance(specs, list) and all(isinstance(s, dict) and isinstance(s.get('function'), str) for s in specs)
+    assert max_workers is None or (isinstance(max_workers, int) and max_workers > 0)
+    assert isinstance(force, bool) and isinstance(out_dir, str) and isinstance(render_dir, str)
+
+    root = os.getcwd() + render_dir
+    target = os.getcwd() + out_dir
+    os.makedirs(root, exist_ok=True)
+    try:
+        with open(os.path.join(root, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+
+    hashes = [spec_hash(spec) for spec in specs]
+    results = [None] * len(specs)
+    todo = []
+    for i, key in enumerate(hashes):
+        entry = manifest.get(key)
+        if not force and entry is not None and entry['outputs'] \
+                and all(os.path.exists(os.path.join(target, name)) for name in entry['outputs']):
+            results[i] = {'outputs': entry['outputs'], 'seconds': 0.0, 'error': None, 'status': 'skipped'}
+        else:
+            todo.append(i)
+
+    if todo:
+        max_workers = min(max_workers or os.cpu_count() or 1, len(todo))
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as ex:
+            futures = {i: ex.submit(_render_spec, specs[i], root, target) for i in todo}
+            for i, future in futures.items():
+                result = future.result()
+                result['status'] = 'failed' if result['error'] else 'rendered'
+                results[i] = result
+                if result['error'] is None:
+                    manifest[hashes[i]] = {'function': specs[i]['function'], 'outputs': result['outputs'],
+                                           'rendered': time.time()}
+
+    tmp = os.path.join(root, "manifest.json.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(root, "manifest.json"))
+
+    return pd.DataFrame({'function': [spec['function'] for spec in specs],
+                         'status': [r['status'] for r in results],
+                         'outputs': [r['outputs'] for r in results],
+                         'seconds': [r['seconds'] for r in results],
+                         'error': [r['error'] for r in results]})
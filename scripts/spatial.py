@@ -0,0 +1,334 @@
+import pandas as pd
+import numpy as np
+import shapely
+import glob
+import hashlib
+import json
+import os
+from scipy import sparse
+from scripts.extract import read_all_zipped_csv, read_gpd_file, cached_frame
+from scripts.county_panel import county_key, storm_county_keys, build_county_lookup
+from scripts.geometry import MAP_CRS, source_state
+
+WEIGHTS_DIR = "/.cache/weights"
+
+def _county_tree(counties):
+    """
+    Build an STRtree over county polygons in longitude/latitude.
+
+    Parameters:
+    - counties (gpd.GeoDataFrame): County polygons with 'STATEFP' and 'COUNTYFP' columns.
+
+    Returns:
+    - tuple: (tree, keys) with the shapely STRtree and the int64 county key of every tree geometry.
+    """
+    if counties.crs is not None and not counties.crs.is_geographic:
+        counties = counties.to_crs(4269)
+    geometries = np.asarray(counties.geometry, dtype=object)
+    keys = county_key(counties['STATEFP'].astype(np.int64), counties['COUNTYFP'].astype(np.int64))
+    return shapely.STRtree(geometries), keys
+
+def assign_event_counties(storm, counties, lookup=None):
+    """
+    Assign every storm event to the county polygon containing its BEGIN_LAT/BEGIN_LON point.
+
+    All points are tested in one bulk STRtree query. Events without coordinates, or whose point falls outside
+    every county (e.g. offshore), fall back to storm_county_keys (FIPS for county records, then name lookup).
+    A point on a shared border goes to the first county in the shapefile.
+
+    Parameters:
+    - storm (pd.DataFrame): Storm events with 'BEGIN_LAT', 'BEGIN_LON' and the columns used by storm_county_keys.
+    - counties (gpd.GeoDataFrame): County polygons of cb_2022_us_county_500k.
+    - lookup (pd.DataFrame, optional): The output of build_county_lookup. Default is None, which builds it from counties.
+
+    Raises:
+    - AssertionError: If storm is not a DataFrame or counties has no geometry.
+
+    Returns:
+    - pd.DataFrame: Columns 'county_key' (int64, -1 when unmatched) and 'key_source'
+                    ('point', 'fips', 'name' or 'unmatched'), with the index of storm.
+    """
+    assert isinstance(storm, pd.DataFrame) and hasattr(counties, 'geometry')
+
+    tree, tree_keys = _county_tree(counties)
+    lat = storm['BEGIN_LAT'].to_numpy(dtype=float)
+    lon = storm['BEGIN_LON'].to_numpy(dtype=float)
+    located = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+
+    keys = np.full(len(storm), -1, dtype=np.int64)
+    events, hits = tree.query(shapely.points(lon[located], lat[located]), predicate='intersects')
+    first = np.unique(events, return_index=True)[1]
+    keys[located[events[first]]] = tree_keys[hits[first]]
+
+    source = np.where(keys >= 0, 'point', 'unmatched').astype(object)
+    todo = keys < 0
+    if todo.any():
+        fallback = storm_county_keys(storm[todo], build_county_lookup(counties) if lookup is None else lookup)
+        keys[todo] = fallback['county_key'].to_numpy()
+        source[todo] = fallback['key_source'].to_numpy()
+    return pd.DataFrame({'county_key': keys, 'key_source': source}, index=storm.index)
+
+def event_counties(storm_path="/dataset/*.csv.gz", county_path="/dataset/cb_2022_us_county_500k", cache=True):
+    """
+    Load the storm events and assign each to a county with assign_event_counties, cached next to the parsed storm table.
+
+    The cache entry is keyed on every storm file and every file of the county shapefile, so it is rebuilt
+    when NOAA re-publishes a year or the boundaries change.
+
+    Parameters:
+    - storm_path (str, optional): Glob of the compressed StormEvents files, as for read_all_zipped_csv. Default is "/dataset/*.csv.gz".
+    - county_path (str, optional): Directory of the county shapefile, as for read_gpd_file. Default is "/dataset/cb_2022_us_county_500k".
+    - cache (bool, optional): Whether to load and store the result through cached_frame. Default is True.
+
+    Raises:
+    - AssertionError: If storm_path or county_path is not a string, or cache is not a bool.
+
+    Returns:
+    - pd.DataFrame: Columns 'EVENT_ID', 'county_key' and 'key_source', one row per event.
+    """
+    assert isinstance(storm_path, str) and isinstance(county_path, str) and isinstance(cache, bool)
+
+    usecols = ['EVENT_ID', 'STATE_FIPS', 'CZ_TYPE', 'CZ_FIPS', 'CZ_NAME', 'BEGIN_LAT', 'BEGIN_LON']
+
+    def build():
+        storm = read_all_zipped_csv(storm_path, usecols=usecols, cache=cache)
+        assigned = assign_event_counties(storm, read_gpd_file(county_path))
+        return pd.concat([storm[['EVENT_ID']], assigned], axis=1)
+
+    if not cache:
+        return build()
+    sources = sorted(glob.glob(os.getcwd() + storm_path)) + sorted(glob.glob(os.path.join(os.getcwd() + county_path, '*')))
+    return cached_frame(sources, build, params={'builder': 'event_counties', 'usecols': usecols})
+
+def _transform_weights(W, transform):
+    """
+    Row-standardize a weights matrix or leave it binary.
+
+    Parameters:
+    - W (sparse.csr_matrix): The weights.
+    - transform (str): 'r' for row-standardized weights (rows sum to 1) or 'b' for the weights as built.
+
+    Returns:
+    - sparse.csr_matrix: The transformed weights; rows of units without neighbours stay empty.
+    """
+    if transform == 'b':
+        return W
+    sums = np.asarray(W.sum(axis=1)).ravel()
+    return sparse.diags(np.divide(1.0, sums, out=np.zeros_like(sums), where=sums > 0)) @ W
+
+def spatial_weights(counties, kind='queen', band_km=None, transform='r'):
+    """
+    Build a sparse spatial weights matrix over county polygons.
+
+    Candidate pairs come from one bulk STRtree query. 'queen' neighbours share at least a boundary point,
+    'rook' neighbours share a boundary segment, and 'distance' neighbours have centroids (in MAP_CRS)
+    within band_km of each other, weighted 1 or, with kind='inverse', by 1 / distance in km.
+
+    Parameters:
+    - counties (gpd.GeoDataFrame): County polygons with 'STATEFP' and 'COUNTYFP' columns.
+    - kind (str, optional): 'queen', 'rook', 'distance' or 'inverse'. Default is 'queen'.
+    - band_km (float, optional): Distance band in kilometers, required for 'distance' and 'inverse'. Default is None.
+    - transform (str, optional): 'r' for row-standardized or 'b' for binary (or inverse-distance) weights. Default is 'r'.
+
+    Raises:
+    - AssertionError: If counties has no geometry, kind or transform is unknown, or band_km is missing.
+
+    Returns:
+    - tuple: (W, keys) where W is an (n, n) scipy.sparse CSR matrix with a zero diagonal and keys is the int64
+             county key of every row, in the order of counties.
+    """
+    assert hasattr(counties, 'geometry') and kind in ('queen', 'rook', 'distance', 'inverse') and transform in ('r', 'b')
+    assert kind in ('queen', 'rook') or (isinstance(band_km, (int, float)) and band_km > 0)
+
+    keys = county_key(counties['STATEFP'].astype(np.int64), counties['COUNTYFP'].astype(np.int64))
+    n = len(counties)
+    if kind in ('queen', 'rook'):
+        tree, _ = _county_tree(counties)
+        geometries = tree.geometries
+        i, j = tree.query(geometries, predicate='intersects')
+        keep = i != j
+        i, j = i[keep], j[keep]
+        if kind == 'rook':
+            shared = shapely.intersection(shapely.boundary(geometries[i]), shapely.boundary(geometries[j]))
+            # ignore slivers from floating point noise at corners, about 0.1 mm in degrees
+            keep = shapely.length(shared) > 1e-9
+            i, j = i[keep], j[keep]
+        values = np.ones(len(i))
+    else:
+        centroids = np.asarray(counties.to_crs(MAP_CRS).geometry.centroid, dtype=object)
+        i, j = shapely.STRtree(centroids).query(centroids, predicate='dwithin', distance=band_km * 1000)
+        keep = i != j
+        i, j = i[keep], j[keep]
+        values = np.ones(len(i)) if kind == 'distance' else 1000 / shapely.distance(centroids[i], centroids[j])
+
+    W = sparse.csr_matrix((values, (i, j)), shape=(n, n))
+    return _transform_weights(W, transform), keys
+
+def load_spatial_weights(path="/dataset/cb_2022_us_county_500k", kind='queen', band_km=None, transform='r',
+                         weights_dir=WEIGHTS_DIR):
+    """
+    Load the spatial weights of a county shapefile from the disk cache, building them if needed.
+
+    The matrix is stored with scipy.sparse.save_npz under a name hashing the parameters and the size and
+    mtime of the shapefile's files, so it is rebuilt when the boundaries change.
+
+    Parameters:
+    - path (str, optional): Directory of the county shapefile, as for read_gpd_file. Default is "/dataset/cb_2022_us_county_500k".
+    - kind (str, optional): See spatial_weights. Default is 'queen'.
+    - band_km (float, optional): See spatial_weights. Default is None.
+    - transform (str, optional): See spatial_weights. Default is 'r'.
+    - weights_dir (str, optional): Directory of the cache, relative to the working directory. Default is WEIGHTS_DIR.
+
+    Raises:
+    - AssertionError: If path or weights_dir is not a string.
+
+    Returns:
+    - tuple: (W, keys) as returned by spatial_weights.
+    """
+    assert isinstance(path, str) and isinstance(weights_dir, str)
+
+    root = os.getcwd() + weights_dir
+    params = [path, kind, band_km, transform, source_state(path)]
+    name = hashlib.sha256(json.dumps(params).encode()).hexdigest()[:24]
+    matrix_file = os.path.join(root, name + ".npz")
+    keys_file = os.path.join(root, name + "_keys.npy")
+    if os.path.exists(matrix_file) and os.path.exists(keys_file):
+        return sparse.load_npz(matrix_file).tocsr(), np.load(keys_file)
+
+    W, keys = spatial_weights(read_gpd_file(path), kind, band_km, transform)
+    os.makedirs(root, exist_ok=True)
+    np.save(keys_file, keys)
+    sparse.save_npz(matrix_file + ".tmp.npz", W)
+    os.replace(matrix_file + ".tmp.npz", matrix_file)
+    return W, keys
+
+def spatial_lag(W, keys, panel, columns, unit='county_key', time='Year'):
+    """
+    Compute neighbour-weighted averages (or sums, for binary weights) of panel columns for every unit-period.
+
+    Each column is laid out as a dense county x period matrix and lagged for all periods with one sparse
+    matrix product. Units or periods missing from the panel count as 0, as for counties without storm events.
+
+    Parameters:
+    - W (sparse matrix): Weights from spatial_weights or load_spatial_weights.
+    - keys (np.ndarray): The county key of every row of W.
+    - panel (pd.DataFrame): Long panel with the unit, time and value columns, e.g. from build_county_year_panel.
+    - columns (list): Names of the numeric columns to lag, e.g. ['DAMAGE', 'FREQ'].
+    - unit (str, optional): Unit column of panel holding the keys. Default is 'county_key'.
+    - time (str, optional): Integer period column of panel. Default is 'Year'.
+
+    Raises:
+    - AssertionError: If panel is not a DataFrame or a column is missing.
+
+    Returns:
+    - pd.DataFrame: Columns 'W_<col>' with the index of panel, NaN for units not in keys.
+    """
+    assert isinstance(panel, pd.DataFrame) and isinstance(columns, list)
+    assert all(c in panel.columns for c in columns + [unit, time]) and W.shape == (len(keys), len(keys))
+
+    rows = pd.Index(keys).get_indexer(panel[unit])
+    known = rows >= 0
+    periods, cols = np.unique(panel[time].to_numpy(dtype=np.int64), return_inverse=True)
+    W = sparse.csr_matrix(W)
+
+    lagged = {}
+    for col in columns:
+        values = np.zeros((len(keys), len(periods)))
+        values[rows[known], cols[known]] = panel[col].fillna(0).to_numpy(dtype=float)[known]
+        out = np.full(len(panel), np.nan)
+        out[known] = (W @ values)[rows[known], cols[known]]
+        lagged['W_' + col] = out
+    return pd.DataFrame(lagged, index=panel.index)
+
+def morans_i(W, values, permutations=999, seed=0):
+    """
+    Compute global Moran's I with permutation inference.
+
+    All permutations are evaluated with one sparse product of W and the (n, permutations) matrix of
+    permuted deviations.
+
+    Parameters:
+    - W (sparse matrix): Spatial weights, e.g. from spatial_weights.
+    - values (np.ndarray or pd.Series): One value per row of W.
+    - permutations (int, optional): Number of random permutations. Default is 999.
+    - seed (int, optional): Seed of the random generator. Default is 0.
+
+    Raises:
+    - AssertionError: If values does not have one finite value per row of W or permutations is not positive.
+
+    Returns:
+    - dict: 'I', 'EI' (expected I under no autocorrelation), 'z_sim' and 'p_sim' (one-sided pseudo p-value in
+            the direction of the observed I).
+    """
+    z = np.asarray(values, dtype=float)
+    assert z.ndim == 1 and len(z) == W.shape[0] and np.isfinite(z).all()
+    assert isinstance(permutations, int) and permutations > 0
+
+    n = len(z)
+    z = z - z.mean()
+    W = sparse.csr_matrix(W)
+    scale = n / W.sum() / (z @ z)
+    I = scale * (z @ (W @ z))
+
+    rng = np.random.default_rng(seed)
+    Z = z[rng.random((n, permutations)).argsort(axis=0)]
+    I_sim = scale * np.einsum('ip,ip->p', Z, W @ Z)
+    larger = int((I_sim >= I).sum())
+    larger = min(larger, permutations - larger)
+    return {'I': I, 'EI': -1 / (n - 1), 'z_sim': (I - I_sim.mean()) / I_sim.std(),
+            'p_sim': (larger + 1) / (permutations + 1)}
+
+def lisa(W, values, permutations=999, seed=0, block=256):
+    """
+    Compute local Moran's I (LISA) with conditional permutation inference.
+
+    For each unit, its neighbours' values are replaced by random draws from the other units. One set of
+    draws per permutation is shared by all units, and units are evaluated in blocks with fancy indexing.
+
+    Parameters:
+    - W (sparse matrix): Spatial weights, e.g. from spatial_weights.
+    - values (np.ndarray or pd.Series): One value per row of W.
+    - permutations (int, optional): Number of random permutations. Default is 999.
+    - seed (int, optional): Seed of the random generator. Default is 0.
+    - block (int, optional): Number of units evaluated together, bounding memory. Default is 256.
+
+    Raises:
+    - AssertionError: If values does not have one finite value per row of W or permutations is not positive.
+
+    Returns:
+    - pd.DataFrame: One row per row of W with 'Is' (local I), 'q' (quadrant: 1 high-high, 2 low-high, 3 low-low,
+                    4 high-low) and 'p_sim' (one-sided pseudo p-value).
+    """
+    z = np.asarray(values, dtype=float)
+    assert z.ndim == 1 and len(z) == W.shape[0] and np.isfinite(z).all()
+    assert isinstance(permutations, int) and permutations > 0 and isinstance(block, int) and block > 0
+
+    n = len(z)
+    z = z - z.mean()
+    m2 = (z @ z) / n
+    W = sparse.csr_matrix(W)
+    lag = W @ z
+    Is = z * lag / m2
+    q = np.where(z > 0, np.where(lag > 0, 1, 4), np.where(lag > 0, 2, 3))
+
+    counts = np.diff(W.indptr)
+    k_max = int(counts.max()) if n else 0
+    rng = np.random.default_rng(seed)
+    # the first k_max of a random ordering of n - 1 positions, one row per permutation
+    draws = np.argpartition(rng.random((permutations, n - 1)), k_max - 1, axis=1)[:, :k_max] if k_max else \
+        np.zeros((permutations, 0), dtype=np.int64)
+
+    larger = np.zeros(n, dtype=np.int64)
+    for start in range(0, n, block):
+        units = np.arange(start, min(start + block, n))
+        slots = W.indptr[units][:, None] + np.arange(k_max)
+        in_row = slots < W.indptr[units + 1][:, None]
+        weights = np.where(in_row, W.data[np.minimum(slots, len(W.data) - 1)], 0) if len(W.data) else \
+            np.zeros((len(units), k_max))
+        # skip the unit itself by shifting draws at or past its position
+        others = draws[None, :, :] + (draws[None, :, :] >= units[:, None, None])
+        lag_sim = np.einsum('upk,uk->up', z[others], weights)
+        larger[units] = (z[units, None] * lag_sim / m2 >= Is[units, None]).sum(axis=1)
+
+    larger = np.minimum(larger, permutations - larger)
+    return pd.DataFrame({'Is': Is, 'q': q, 'p_sim': (larger + 1) / (permutations + 1)})
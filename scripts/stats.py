@@ -1,8 +1,22 @@
 from scipy.stats import pearsonr
 import pandas as pd
-from rtree import index
+import numpy as np
+import shapely
 from scipy import stats
+from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor
+import os
+from scripts.instrument import instrumented
+from scripts.panel import panel_shift
+from scripts.county_panel import county_key
+from scripts.geometry import MAP_CRS
 
+EARTH_RADIUS_KM = 6371.0088
+
+# bytes of permuted driver series a correlation permutation batch gathers at once
+PERMUTATION_CHUNK_BYTES = 32 * 2 ** 20
+
+@instrumented
 def cal_pearsonr(data1, data2):
     """
     Calculate the Pearson correlation coefficient and its associated p-value between two pandas Series.
@@ -22,20 +36,161 @@ def cal_pearsonr(data1, data2):
     corr, p_value = pearsonr(data1, data2)
     return corr, p_value
 
-def cal_corr_p(data, p_data):
+def _pairwise_pearson(X, Y):
+    """
+    Pearson correlations between every column of X and every column of Y over pairwise-complete rows.
+
+    Parameters:
+    - X (np.ndarray): An (n, d) float array, NaN for missing values.
+    - Y (np.ndarray): An (n, t) float array, NaN for missing values.
+
+    Returns:
+    - tuple: (r, p, n) arrays of shape (d, t) with the coefficients, two-sided p-values and pair counts.
+    """
+    mx, my = np.isfinite(X), np.isfinite(Y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # centering by the column means does not change r but keeps the sums well conditioned
+        x0 = np.where(mx, X - np.where(mx, X, 0).sum(axis=0) / mx.sum(axis=0), 0)
+        y0 = np.where(my, Y - np.where(my, Y, 0).sum(axis=0) / my.sum(axis=0), 0)
+        mx, my = mx.astype(float), my.astype(float)
+
+        n = mx.T @ my
+        sx, sy = x0.T @ my, mx.T @ y0
+        cov = x0.T @ y0 - sx * sy / n
+        vx = (x0 ** 2).T @ my - sx ** 2 / n
+        vy = mx.T @ (y0 ** 2) - sy ** 2 / n
+        r = np.clip(cov / np.sqrt(vx * vy), -1, 1)
+        dof = n - 2
+        t = r * np.sqrt(dof / (1 - r ** 2))
+        p = np.where(np.abs(r) == 1, 0.0, 2 * stats.t.sf(np.abs(t), dof))
+    r[n < 2] = np.nan
+    p[(n < 3) | np.isnan(r)] = np.nan
+    return r, p, n.astype(int)
+
+def _pairwise_spearman(X, Y):
+    """
+    Spearman correlations between every column of X and every column of Y over pairwise-complete rows.
+
+    Rows are ranked once per target and per distinct missing-value pattern of the drivers, and the
+    ranks are correlated with _pairwise_pearson.
+
+    Parameters:
+    - X (np.ndarray): An (n, d) float array, NaN for missing values.
+    - Y (np.ndarray): An (n, t) float array, NaN for missing values.
+
+    Returns:
+    - tuple: (r, p, n) arrays of shape (d, t) with the coefficients, two-sided p-values and pair counts.
+    """
+    d, t = X.shape[1], Y.shape[1]
+    r, p, n = np.full((d, t), np.nan), np.full((d, t), np.nan), np.zeros((d, t), dtype=int)
+    mx = np.isfinite(X)
+    patterns = {}
+    for i in range(d):
+        patterns.setdefault(mx[:, i].tobytes(), []).append(i)
+    for j in range(t):
+        my = np.isfinite(Y[:, j])
+        for cols in patterns.values():
+            rows = my & mx[:, cols[0]]
+            rx = stats.rankdata(X[rows][:, cols], axis=0)
+            ry = stats.rankdata(Y[rows, j])[:, None]
+            r[cols, j], p[cols, j], n[cols, j] = [a[:, 0] for a in _pairwise_pearson(rx, ry)]
+    return r, p, n
+
+@instrumented
+def corr_matrix(df, drivers, targets, methods=['pearson', 'spearman'], by=None):
+    """
+    Calculate correlation coefficients, p-values and sample sizes between every driver and every target column.
+
+    Each (driver, target) pair uses all rows where both are present (pairwise-complete), without copying
+    or modifying df. Pearson coefficients for all pairs come from one set of matrix products.
+    df may also be a dict of equally shaped arrays, e.g. panel_store.store_columns, whose cells are the rows.
+
+    Parameters:
+    - df (pd.DataFrame or dict): DataFrame containing the data, or a dict of column name to array.
+    - drivers (list): Column names of the explanatory variables (e.g. ['FREQ', 'DAMAGE']).
+    - targets (list): Column names of the outcomes (e.g. the lag HPI change columns).
+    - methods (list, optional): Any of 'pearson' and 'spearman'. Default is both.
+    - by (str or list, optional): Column(s) to break the results out by, e.g. 'State'. Default is None.
+
+    Raises:
+    - AssertionError: If df is not a DataFrame or dict, drivers/targets/methods are not lists, a method is unknown,
+                      or by is given with a dict.
+
+    Returns:
+    - pd.DataFrame: Tidy result with the 'by' columns (if any) and 'method', 'driver', 'target', 'r', 'p', 'n',
+                    in driver-major order. Pass it to cal_corr_p or corr_table.
+    """
+    assert isinstance(df, (pd.DataFrame, dict)) and isinstance(drivers, list) and isinstance(targets, list)
+    assert isinstance(methods, list) and set(methods) <= {'pearson', 'spearman'}
+    assert by is None or (isinstance(by, (str, list)) and isinstance(df, pd.DataFrame))
+
+    if isinstance(df, dict):
+        X = np.column_stack([np.ravel(df[c]).astype(float, copy=False) for c in drivers])
+        Y = np.column_stack([np.ravel(df[c]).astype(float, copy=False) for c in targets])
+    else:
+        X = df[drivers].to_numpy(dtype=float)
+        Y = df[targets].to_numpy(dtype=float)
+    by_cols = [] if by is None else ([by] if isinstance(by, str) else by)
+    groups = {(): np.arange(len(X))} if not by_cols else df.groupby(by_cols, sort=True, observed=True).indices
+
+    results = []
+    for group, idx in groups.items():
+        for method in methods:
+            calc = _pairwise_pearson if method == 'pearson' else _pairwise_spearman
+            r, p, n = calc(X[idx], Y[idx])
+            result = pd.DataFrame({'method': method,
+                                   'driver': np.repeat(drivers, len(targets)),
+                                   'target': np.tile(targets, len(drivers)),
+                                   'r': r.ravel(), 'p': p.ravel(), 'n': n.ravel()})
+            for col, value in zip(by_cols, group if isinstance(group, tuple) else (group,)):
+                result.insert(by_cols.index(col), col, value)
+            results.append(result)
+    return pd.concat(results, ignore_index=True)
+
+@instrumented
+def corr_table(result, value='r', method='pearson'):
+    """
+    Reshape a corr_matrix result into a driver x target table.
+
+    Parameters:
+    - result (pd.DataFrame): The tidy output of corr_matrix without 'by' columns.
+    - value (str, optional): 'r', 'p' or 'n'. Default is 'r'.
+    - method (str, optional): 'pearson' or 'spearman'. Default is 'pearson'.
+
+    Raises:
+    - AssertionError: If result is not a DataFrame or value is not one of 'r', 'p', 'n'.
+
+    Returns:
+    - pd.DataFrame: Drivers as rows and targets as columns, in the order they were passed to corr_matrix.
+    """
+    assert isinstance(result, pd.DataFrame) and value in ('r', 'p', 'n')
+
+    result = result[result['method'] == method]
+    table = result.pivot(index='driver', columns='target', values=value)
+    return table.loc[result['driver'].unique(), result['target'].unique()]
+
+@instrumented
+def cal_corr_p(data, p_data=None, method='pearson'):
     """
     Format correlation coefficients with p-values into a list of strings.
 
     Parameters:
-    - data (list): List of correlation coefficients.
-    - p_data (list): List of p-values corresponding to the correlation coefficients.
+    - data (list or pd.DataFrame): List of correlation coefficients, or the tidy output of corr_matrix.
+    - p_data (list, optional): List of p-values corresponding to the correlation coefficients.
+                               Not used when data is a corr_matrix result.
+    - method (str, optional): Method to format when data is a corr_matrix result. Default is 'pearson'.
 
     Raises:
-    - AssertionError: If data or p_data is not a list.
+    - AssertionError: If data is neither a list nor a DataFrame, or if p_data is not a list when data is a list.
 
     Returns:
     - list: Formatted list of strings representing correlation coefficients with significance indicators.
     """
+    assert isinstance(data, (list, pd.DataFrame))
+
+    if isinstance(data, pd.DataFrame):
+        p_data = corr_table(data, 'p', method).values.tolist()
+        data = corr_table(data, 'r', method).values.tolist()
     assert isinstance(data, list) and isinstance(p_data, list)
 
     corr_p = []
@@ -53,41 +208,421 @@ def cal_corr_p(data, p_data):
         corr_p.append(row)
     return corr_p
 
-def get_nearest_county(heavily_affected_group, less_affected_group):
+def _unit_vectors(geometries):
+    """
+    Convert geometries to unit vectors on the sphere at their centroids.
+
+    Chord distances between unit vectors are monotonic in great-circle distance, so a KD-tree over them
+    answers nearest-neighbour queries by true distance.
+
+    Parameters:
+    - geometries (pd.Series): Shapely geometries in longitude/latitude, or a GeoSeries in any CRS.
+
+    Returns:
+    - np.ndarray: An (n, 3) array of unit vectors, NaN where the geometry is missing.
+    """
+    crs = getattr(geometries, 'crs', None)
+    if crs is not None and not crs.is_geographic:
+        geometries = geometries.to_crs(4326)
+    centroids = shapely.centroid(np.asarray(geometries, dtype=object))
+    lon = np.radians(shapely.get_x(centroids))
+    lat = np.radians(shapely.get_y(centroids))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def _chord_to_km(chord):
+    """
+    Convert chord lengths on the unit sphere to great-circle distances in kilometers.
+
+    Parameters:
+    - chord (np.ndarray): Chord lengths.
+
+    Returns:
+    - np.ndarray: Great-circle distances in kilometers.
+    """
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+def _greedy_unique(treated, control, distance, k):
+    """
+    Greedily assign candidate pairs in order of distance so that every control is used at most once
+    and every treated unit receives at most k controls.
+
+    Parameters:
+    - treated (np.ndarray): Treated positions of the candidate pairs.
+    - control (np.ndarray): Control positions of the candidate pairs.
+    - distance (np.ndarray): Distances of the candidate pairs.
+    - k (int): Maximum number of controls per treated unit.
+
+    Returns:
+    - np.ndarray: Boolean mask of the accepted pairs.
+    """
+    order = np.argsort(distance, kind='stable')
+    accepted = np.zeros(len(distance), dtype=bool)
+    used = set()
+    filled = {}
+    for i in order:
+        t, c = treated[i], control[i]
+        if c in used or filled.get(t, 0) >= k:
+            continue
+        accepted[i] = True
+        used.add(c)
+        filled[t] = filled.get(t, 0) + 1
+    return accepted
+
+def _kdtree_match(points_t, points_c, k, bound, replace):
+    """
+    Find the k nearest control points of every treated point with batched KD-tree queries.
+
+    Without replacement, pairs are assigned greedily from the closest overall, and treated points whose
+    candidates were taken are re-queried against the remaining controls.
+
+    Parameters:
+    - points_t (np.ndarray): An (n, d) array of treated points, rows with NaN are never matched.
+    - points_c (np.ndarray): An (m, d) array of control points, rows with NaN are never used.
+    - k (int): Number of neighbours per treated point.
+    - bound (float): Maximum Euclidean distance of a match, np.inf for none.
+    - replace (bool): Whether a control may be matched to several treated points.
+
+    Returns:
+    - tuple: (treated, control, distance) arrays of the accepted pairs, with positions in the inputs.
+    """
+    open_t = np.flatnonzero(~np.isnan(points_t).any(axis=1))
+    open_c = np.flatnonzero(~np.isnan(points_c).any(axis=1))
+
+    pairs_t, pairs_c, pairs_d = [], [], []
+    need = np.full(len(points_t), k)
+    while len(open_t) and len(open_c):
+        kq = min(int(need[open_t].max()) * (1 if replace else 2), len(open_c))
+        dist, pos = cKDTree(points_c[open_c]).query(points_t[open_t], k=kq, distance_upper_bound=bound)
+        dist, pos = dist.reshape(len(open_t), kq), pos.reshape(len(open_t), kq)
+        t = np.repeat(open_t, kq)
+        found = np.isfinite(dist.ravel())
+        t, c, d = t[found], open_c[pos.ravel()[found]], dist.ravel()[found]
+        if replace:
+            keep = (np.arange(kq)[None, :] < need[open_t][:, None]).ravel()[found]
+            pairs_t.append(t[keep]); pairs_c.append(c[keep]); pairs_d.append(d[keep])
+            break
+        accepted = _greedy_unique(t, c, d, k)
+        if not accepted.any():
+            break
+        pairs_t.append(t[accepted]); pairs_c.append(c[accepted]); pairs_d.append(d[accepted])
+        np.subtract.at(need, t[accepted], 1)
+        open_c = np.setdiff1d(open_c, c[accepted])
+        open_t = open_t[need[open_t] > 0]
+
+    if not pairs_t:
+        return np.array([], dtype=int), np.array([], dtype=int), np.array([], dtype=float)
+    return np.concatenate(pairs_t), np.concatenate(pairs_c), np.concatenate(pairs_d)
+
+@instrumented
+def match_nearest(treated, controls, k=1, caliper=None, replace=True):
+    """
+    Match every treated geometry to its k nearest control geometries by great-circle distance between centroids.
+
+    All treated units are queried in one batch against a KD-tree of control centroids. Without replacement,
+    pairs are assigned greedily from the closest overall, and treated units whose candidates were taken
+    are re-queried against the remaining controls.
+
+    Parameters:
+    - treated (pd.Series): Geometries of the treated units (longitude/latitude shapely objects or a GeoSeries).
+    - controls (pd.Series): Geometries of the candidate control units.
+    - k (int, optional): Number of neighbours per treated unit. Default is 1.
+    - caliper (float, optional): Maximum match distance in kilometers. Default is None, which allows any distance.
+    - replace (bool, optional): Whether a control may be matched to several treated units. Default is True.
+
+    Raises:
+    - AssertionError: If treated or controls is not a pandas Series, k is not a positive integer,
+                      caliper is not a positive number, or replace is not a bool.
+
+    Returns:
+    - pd.DataFrame: One row per match with columns 'treated' and 'control' (positions in the inputs),
+                    'rank' (0 for the nearest) and 'distance_km', sorted by treated position and rank.
+    """
+    assert isinstance(treated, pd.Series) and isinstance(controls, pd.Series)
+    assert isinstance(k, int) and k > 0 and isinstance(replace, bool)
+    assert caliper is None or (isinstance(caliper, (int, float)) and caliper > 0)
+
+    xyz_t = _unit_vectors(treated)
+    xyz_c = _unit_vectors(controls)
+    bound = np.inf if caliper is None else 2 * np.sin(min(caliper / EARTH_RADIUS_KM, np.pi) / 2) + 1e-12
+    pairs_t, pairs_c, pairs_d = _kdtree_match(xyz_t, xyz_c, k, bound, replace)
+
+    matches = pd.DataFrame({'treated': pairs_t, 'control': pairs_c, 'distance_km': _chord_to_km(pairs_d)})
+    matches.sort_values(['treated', 'distance_km'], inplace=True, kind='stable')
+    matches.insert(2, 'rank', matches.groupby('treated').cumcount())
+    return matches.reset_index(drop=True)
+
+@instrumented
+def get_nearest_county(heavily_affected_group, less_affected_group, caliper=None, replace=True):
     """
     Assign nearest neighbors from less_affected_group to each row in heavily_affected_group based on spatial proximity.
 
+    Proximity is the great-circle distance between county centroids, computed for all rows at once by match_nearest.
+
     Parameters:
     - heavily_affected_group (pd.DataFrame): DataFrame containing heavily affected group data with a 'geometry' column.
     - less_affected_group (pd.DataFrame): DataFrame containing less affected group data with a 'geometry' column.
+    - caliper (float, optional): Maximum neighbor distance in kilometers. Default is None, which allows any distance.
+    - replace (bool, optional): Whether a less affected county may be the neighbor of several rows. Default is True.
 
     Raises:
     - AssertionError: If heavily_affected_group or less_affected_group is not a DataFrame.
 
     Returns:
-    - pd.DataFrame: The heavily_affected_group DataFrame with added columns 'neighbor_state', 'neighbor_county', and 'neighbor_distance'.
+    - pd.DataFrame: The heavily_affected_group DataFrame with added columns 'neighbor_state', 'neighbor_county', and
+                    'neighbor_distance' (in kilometers), plus 'neighbor_county_key' when less_affected_group has a
+                    'county_key' column. Rows without a neighbor within the caliper get NaN.
     """
     assert isinstance(heavily_affected_group, pd.DataFrame) and isinstance(less_affected_group, pd.DataFrame)
 
-    # Create spatial index for less_affected_group
-    spatial_index = index.Index()
-    for i, geom in enumerate(less_affected_group['geometry']):
-        spatial_index.insert(i, geom.bounds)
-
-    # Iterate row in heavily_affected_group
-    for idx, row in heavily_affected_group.iterrows():
-        point = row['geometry']
-        nearest_idx = list(spatial_index.nearest(point.bounds, 1))[0]
-        nearest_neighbor = less_affected_group.loc[nearest_idx]
-        heavily_affected_group.at[idx, 'neighbor_state'] = nearest_neighbor['State']
-        heavily_affected_group.at[idx, 'neighbor_county'] = nearest_neighbor['County']
-        heavily_affected_group.at[idx, 'neighbor_distance'] = nearest_neighbor['geometry'].distance(point)
+    matches = match_nearest(heavily_affected_group['geometry'], less_affected_group['geometry'],
+                            k=1, caliper=caliper, replace=replace)
+    rows = np.full(len(heavily_affected_group), -1)
+    rows[matches['treated'].to_numpy()] = matches['control'].to_numpy()
+    distance = np.full(len(heavily_affected_group), np.nan)
+    distance[matches['treated'].to_numpy()] = matches['distance_km'].to_numpy()
+    found = rows >= 0
+
+    columns = [('neighbor_state', 'State'), ('neighbor_county', 'County')]
+    if 'county_key' in less_affected_group.columns:
+        columns.append(('neighbor_county_key', 'county_key'))
+    for col, source in columns:
+        values = np.full(len(heavily_affected_group), np.nan, dtype=object)
+        values[found] = less_affected_group[source].to_numpy()[rows[found]]
+        heavily_affected_group[col] = values
+    heavily_affected_group['neighbor_distance'] = distance
     return heavily_affected_group
 
+MATCH_COVARIATES = ['hpi_level', 'hpi_trend', 'x_km', 'y_km', 'base_freq']
+
+@instrumented
+def county_year_covariates(panel, counties, window=3, unit='county_key', time='Year'):
+    """
+    Build pre-period matching covariates for every row of a county-year panel.
+
+    'hpi_level' is the log HPI of the previous year, 'hpi_trend' the mean annual log HPI change over the
+    previous window years, 'x_km' and 'y_km' the county centroid in the equal-area map projection, and
+    'base_freq' the mean storm frequency over the previous window years.
+
+    Parameters:
+    - panel (pd.DataFrame): Panel with the unit, time, 'HPI' and 'FREQ' columns, e.g. from build_county_year_panel.
+    - counties (gpd.GeoDataFrame): County polygons with 'STATEFP' and 'COUNTYFP' columns.
+    - window (int, optional): Number of pre-period years for the trend and baseline frequency. Default is 3.
+    - unit (str, optional): County key column of panel. Default is 'county_key'.
+    - time (str, optional): Year column of panel. Default is 'Year'.
+
+    Raises:
+    - AssertionError: If panel is not a DataFrame, a column is missing, or window is not a positive integer.
+
+    Returns:
+    - pd.DataFrame: The MATCH_COVARIATES columns with the index of panel, NaN where the history is incomplete.
+    """
+    assert isinstance(panel, pd.DataFrame) and all(c in panel.columns for c in [unit, time, 'HPI', 'FREQ'])
+    assert isinstance(window, int) and window > 0 and hasattr(counties, 'geometry')
+
+    frame = panel[[unit, time, 'FREQ']].assign(log_hpi=np.log(panel['HPI'].to_numpy(dtype=float)))
+    lags = panel_shift(frame, [unit], time, ['log_hpi', 'FREQ'], list(range(1, window + 2)))
+    level = lags['log_hpi_lag1']
+    trend = (level - lags['log_hpi_lag{}'.format(window + 1)]) / window
+    freq = lags[['FREQ_lag{}'.format(p) for p in range(1, window + 1)]].mean(axis=1, skipna=False)
+
+    centroids = counties.to_crs(MAP_CRS).geometry.centroid
+    keys = county_key(counties['STATEFP'].astype(np.int64), counties['COUNTYFP'].astype(np.int64))
+    rows = pd.Index(keys).get_indexer(panel[unit])
+    x = np.where(rows >= 0, centroids.x.to_numpy()[rows] / 1000, np.nan)
+    y = np.where(rows >= 0, centroids.y.to_numpy()[rows] / 1000, np.nan)
+    return pd.DataFrame({'hpi_level': level, 'hpi_trend': trend, 'x_km': x, 'y_km': y, 'base_freq': freq},
+                        index=panel.index)
+
+@instrumented
+def match_covariates(treated, controls, covariates=MATCH_COVARIATES, exact=None, k=1, caliper=None, replace=True,
+                     weights=None):
+    """
+    Match treated rows to their k nearest control rows on standardized covariates.
+
+    Covariates are scaled by the mean and standard deviation of the treated and control rows together (and
+    optionally weighted), so distances are in pooled standard deviations. Rows must agree exactly on the
+    exact columns, e.g. 'Year' for county-year matching; each stratum is one batched KD-tree query.
+
+    Parameters:
+    - treated (pd.DataFrame): Treated rows with the covariate and exact columns.
+    - controls (pd.DataFrame): Candidate control rows with the same columns.
+    - covariates (list, optional): Numeric covariate columns. Default is MATCH_COVARIATES (see county_year_covariates).
+    - exact (list, optional): Columns that must be equal within a pair. Default is None.
+    - k (int, optional): Number of controls per treated row. Default is 1.
+    - caliper (float, optional): Maximum match distance in pooled standard deviations. Default is None, which allows any distance.
+    - replace (bool, optional): Whether a control may be matched to several treated rows. Default is True.
+    - weights (list, optional): Relative weight of each covariate in the distance. Default is None for equal weights.
+
+    Raises:
+    - AssertionError: If any input argument is not of the expected type.
+
+    Returns:
+    - pd.DataFrame: One row per match with 'treated' and 'control' (positions in the inputs), 'rank' (0 for the
+                    nearest) and 'distance', sorted by treated position and rank. Rows with a missing covariate are not matched.
+    """
+    exact = [] if exact is None else exact
+    assert isinstance(treated, pd.DataFrame) and isinstance(controls, pd.DataFrame)
+    assert isinstance(covariates, list) and isinstance(exact, list)
+    assert all(c in treated.columns and c in controls.columns for c in covariates + exact)
+    assert isinstance(k, int) and k > 0 and isinstance(replace, bool)
+    assert caliper is None or (isinstance(caliper, (int, float)) and caliper > 0)
+    assert weights is None or (isinstance(weights, list) and len(weights) == len(covariates))
+
+    X_t = treated[covariates].to_numpy(dtype=float)
+    X_c = controls[covariates].to_numpy(dtype=float)
+    both = np.vstack([X_t, X_c])
+    mean, sd = np.nanmean(both, axis=0), np.nanstd(both, axis=0)
+    scale = np.where(sd > 0, 1 / np.where(sd > 0, sd, 1), 0)
+    if weights is not None:
+        scale = scale * np.sqrt(np.asarray(weights, dtype=float))
+    Z_t, Z_c = (X_t - mean) * scale, (X_c - mean) * scale
+
+    if exact:
+        strata = pd.concat([treated[exact], controls[exact]], ignore_index=True)
+        codes = strata.groupby(exact, sort=False, dropna=False).ngroup().to_numpy()
+    else:
+        codes = np.zeros(len(treated) + len(controls), dtype=np.int64)
+    codes_t, codes_c = codes[:len(treated)], codes[len(treated):]
+    order_c = np.argsort(codes_c, kind='stable')
+    bounds_c = np.searchsorted(codes_c[order_c], np.arange(codes.max() + 2 if len(codes) else 1))
+    order_t = np.argsort(codes_t, kind='stable')
+    bounds_t = np.searchsorted(codes_t[order_t], np.arange(codes.max() + 2 if len(codes) else 1))
+
+    bound = np.inf if caliper is None else caliper
+    pairs_t, pairs_c, pairs_d = [], [], []
+    for g in range(len(bounds_t) - 1):
+        rows_t = order_t[bounds_t[g]:bounds_t[g + 1]]
+        rows_c = order_c[bounds_c[g]:bounds_c[g + 1]]
+        if len(rows_t) and len(rows_c):
+            t, c, d = _kdtree_match(Z_t[rows_t], Z_c[rows_c], k, bound, replace)
+            pairs_t.append(rows_t[t]); pairs_c.append(rows_c[c]); pairs_d.append(d)
+
+    matches = pd.DataFrame({'treated': np.concatenate(pairs_t) if pairs_t else np.array([], dtype=int),
+                            'control': np.concatenate(pairs_c) if pairs_c else np.array([], dtype=int),
+                            'distance': np.concatenate(pairs_d) if pairs_d else np.array([], dtype=float)})
+    matches.sort_values(['treated', 'distance'], inplace=True, kind='stable')
+    matches.insert(2, 'rank', matches.groupby('treated').cumcount())
+    return matches.reset_index(drop=True)
+
+@instrumented
+def balance_table(treated, controls, matches, covariates=MATCH_COVARIATES):
+    """
+    Compare covariate balance between treated and control rows before and after matching.
+
+    The standardized mean difference (SMD) divides the difference in means by the pooled standard deviation
+    of the unmatched samples, so before and after values are on the same scale; |SMD| < 0.1 is commonly
+    read as balanced. After matching, treated rows are those with a match and each matched control is
+    weighted by 1 / (number of controls of its treated row).
+
+    Parameters:
+    - treated (pd.DataFrame): The treated rows passed to match_covariates.
+    - controls (pd.DataFrame): The control rows passed to match_covariates.
+    - matches (pd.DataFrame): The output of match_covariates (or match_nearest).
+    - covariates (list, optional): Numeric covariate columns. Default is MATCH_COVARIATES.
+
+    Raises:
+    - AssertionError: If any input argument is not a DataFrame or covariates is not a list.
+
+    Returns:
+    - pd.DataFrame: One row per covariate with 'mean_treated', 'mean_control', 'smd_before', 'mean_treated_matched',
+                    'mean_control_matched', 'smd_after' and 'var_ratio_after'.
+    """
+    assert isinstance(treated, pd.DataFrame) and isinstance(controls, pd.DataFrame) and isinstance(matches, pd.DataFrame)
+    assert isinstance(covariates, list)
+
+    X_t = treated[covariates].to_numpy(dtype=float)
+    X_c = controls[covariates].to_numpy(dtype=float)
+    pooled = np.sqrt((np.nanvar(X_t, axis=0, ddof=1) + np.nanvar(X_c, axis=0, ddof=1)) / 2)
+
+    t = matches['treated'].to_numpy()
+    w = 1 / matches.groupby('treated')['control'].transform('size').to_numpy(dtype=float)
+    M_t = X_t[np.unique(t)]
+    M_c = X_c[matches['control'].to_numpy()]
+
+    def weighted(values, w):
+        ok = np.isfinite(values)
+        ww = w[:, None] * ok
+        mean = np.nansum(values * ww, axis=0) / ww.sum(axis=0)
+        var = np.nansum(ww * (values - mean) ** 2, axis=0) / ww.sum(axis=0)
+        return mean, var
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_ct, var_ct = weighted(M_c, w)
+        table = pd.DataFrame({
+            'covariate': covariates,
+            'mean_treated': np.nanmean(X_t, axis=0),
+            'mean_control': np.nanmean(X_c, axis=0),
+            'smd_before': (np.nanmean(X_t, axis=0) - np.nanmean(X_c, axis=0)) / pooled,
+            'mean_treated_matched': np.nanmean(M_t, axis=0),
+            'mean_control_matched': mean_ct,
+            'smd_after': (np.nanmean(M_t, axis=0) - mean_ct) / pooled,
+            'var_ratio_after': np.nanvar(M_t, axis=0) / var_ct,
+        })
+    return table
+
+@instrumented
+def paired_ttests(df, pairs, confidence=0.95, wilcoxon=False):
+    """
+    Calculate paired t-tests for many (h, l) column pairs at once, without modifying df.
+
+    Each pair uses the rows where both of its columns are present. Differences, means, standard errors,
+    t-statistics, p-values and confidence intervals are computed for all pairs as masked array operations.
+
+    Parameters:
+    - df (pd.DataFrame): DataFrame containing the paired samples.
+    - pairs (list): List of (h, l) column name tuples; the difference is h - l.
+    - confidence (float, optional): Confidence level of the interval for the mean difference. Default is 0.95.
+    - wilcoxon (bool, optional): Whether to add Wilcoxon signed-rank results. Default is False.
+
+    Raises:
+    - AssertionError: If df is not a DataFrame, pairs is not a list of 2-tuples, confidence is not in (0, 1),
+                      or wilcoxon is not a bool.
+
+    Returns:
+    - pd.DataFrame: One row per pair with columns 'h', 'l', 'n', 'mean_h', 'mean_l', 'mean_diff', 't', 'p',
+                    'ci_low', 'ci_high', and 'w_stat', 'w_p' if wilcoxon is True.
+    """
+    assert isinstance(df, pd.DataFrame) and isinstance(pairs, list)
+    assert all(isinstance(pair, tuple) and len(pair) == 2 for pair in pairs)
+    assert isinstance(confidence, float) and 0 < confidence < 1 and isinstance(wilcoxon, bool)
+
+    H = df[[h for h, _ in pairs]].to_numpy(dtype=float)
+    L = df[[l for _, l in pairs]].to_numpy(dtype=float)
+    D = H - L
+    mask = np.isfinite(D)
+    n = mask.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_h = np.where(mask, H, 0).sum(axis=0) / n
+        mean_l = np.where(mask, L, 0).sum(axis=0) / n
+        mean_diff = np.where(mask, D, 0).sum(axis=0) / n
+        var = np.where(mask, (D - mean_diff) ** 2, 0).sum(axis=0) / (n - 1)
+        se = np.sqrt(var / n)
+        t = mean_diff / se
+        p = 2 * stats.t.sf(np.abs(t), n - 1)
+        half = stats.t.ppf(0.5 + confidence / 2, n - 1) * se
+
+    result = pd.DataFrame({'h': [h for h, _ in pairs], 'l': [l for _, l in pairs], 'n': n,
+                           'mean_h': mean_h, 'mean_l': mean_l, 'mean_diff': mean_diff, 't': t, 'p': p,
+                           'ci_low': mean_diff - half, 'ci_high': mean_diff + half})
+    if wilcoxon:
+        w_stat, w_p = [], []
+        for j in range(D.shape[1]):
+            d = D[mask[:, j], j]
+            w = stats.wilcoxon(d) if np.any(d != 0) else (np.nan, np.nan)
+            w_stat.append(w[0])
+            w_p.append(w[1])
+        result['w_stat'] = w_stat
+        result['w_p'] = w_p
+    return result
+
+@instrumented
 def cal_ttest(data, data1):
     """
     Calculate the paired t-test for two related samples.
 
+    Rows with a missing value in either column are ignored; data1 is not modified.
+
     Parameters:
     - data (tuple): Tuple containing two column names for the samples in data1.
     - data1 (pd.DataFrame): DataFrame containing the data for the paired t-test.
@@ -100,15 +635,16 @@ def cal_ttest(data, data1):
     """
     assert isinstance(data, tuple) and isinstance(data1, pd.DataFrame)
 
-    data1.dropna(subset=[data[0],data[1]], inplace=True)
-    t,p = stats.ttest_rel(data1[data[0]], data1[data[1]])
-    mean_diff = data1[data[0]].mean() - data1[data[1]].mean()
-    return mean_diff,t,p
+    result = paired_ttests(data1, [data]).iloc[0]
+    return result['mean_diff'], result['t'], result['p']
 
+@instrumented
 def cal_freq(data, data1):
     """
     Calculate the paired t-test for multiple related samples.
 
+    Every pair uses its own complete rows; data1 is not modified.
+
     Parameters:
     - data (list): List containing column names for the samples in data1.
     - data1 (pd.DataFrame): DataFrame containing the data for the paired t-tests.
@@ -121,13 +657,244 @@ def cal_freq(data, data1):
     """
     assert isinstance(data, list) and isinstance(data1, pd.DataFrame)
 
-    mean_diff_freq = []
-    t_freq = []
-    p_freq = []
-    for col in data:
-        mean_diff,t,p = cal_ttest(col, data1)
-        mean_diff_freq.append(mean_diff)
-        t_freq.append(t)
-        p_freq.append(p)
+    result = paired_ttests(data1, data)
+    return result['mean_diff'].tolist(), result['t'].tolist(), result['p'].tolist()
+
+def _resample_batches(worker, args, n_resamples, seed, batch_size, max_workers):
+    """
+    Run worker over fixed-size batches of resamples, each with its own RNG stream, in a process pool.
+
+    Batch sizes and seeds depend only on n_resamples, seed and batch_size, so the concatenated draws are
+    identical for any number of workers.
+
+    Parameters:
+    - worker (callable): Module-level function worker(args, seed_sequence, size) returning an array of draws.
+    - args (tuple): Picklable arguments shared by all batches.
+    - n_resamples (int): Total number of resamples.
+    - seed (int): Seed of the root np.random.SeedSequence.
+    - batch_size (int): Number of resamples per batch.
+    - max_workers (int): Number of worker processes; 1 runs the batches in this process.
+
+    Returns:
+    - np.ndarray: The draws of all batches stacked along the first axis.
+    """
+    sizes = [batch_size] * (n_resamples // batch_size) + ([n_resamples % batch_size] if n_resamples % batch_size else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if max_workers == 1 or len(sizes) == 1:
+        draws = [worker(args, ss, size) for ss, size in zip(seeds, sizes)]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as ex:
+            draws = list(ex.map(worker, [args] * len(sizes), seeds, sizes))
+    return np.concatenate(draws, axis=0)
+
+def _mean_diff_batch(args, seed_sequence, size):
+    """
+    Draw cluster-bootstrap and cluster sign-flip mean differences for one batch.
+
+    Parameters:
+    - args (tuple): (S, N) arrays of per-cluster sums and counts of the differences, shape (clusters, pairs).
+    - seed_sequence (np.random.SeedSequence): The RNG stream of this batch.
+    - size (int): Number of resamples in the batch.
+
+    Returns:
+    - np.ndarray: Array of shape (size, 2, pairs) with bootstrap means in [:, 0] and sign-flip means in [:, 1].
+    """
+    S, N = args
+    rng = np.random.default_rng(seed_sequence)
+    clusters = S.shape[0]
+    weights = rng.multinomial(clusters, np.full(clusters, 1 / clusters), size=size).astype(float)
+    signs = rng.choice(np.array([-1.0, 1.0]), size=(size, clusters))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        boot = (weights @ S) / (weights @ N)
+        flip = (signs @ S) / N.sum(axis=0)
+    return np.stack([boot, flip], axis=1)
+
+def _corr_batch(args, seed_sequence, size):
+    """
+    Draw cluster-bootstrap and cluster-permutation Pearson correlations for one batch.
+
+    Parameters:
+    - args (tuple): (moments, Xs, Ys). moments has shape (6, clusters, drivers * targets) with the per-cluster
+                    n, sum x, sum y, sum x^2, sum y^2 and sum xy of every pair. Xs has shape
+                    (3, drivers, clusters, periods) with the zero-filled values, presence mask and squares of the
+                    drivers, and Ys has shape (clusters * periods, 3 * targets) with the mask, values and squares
+                    of the targets.
+    - seed_sequence (np.random.SeedSequence): The RNG stream of this batch.
+    - size (int): Number of resamples in the batch.
+
+    Returns:
+    - np.ndarray: Array of shape (size, 2, drivers * targets) with bootstrap r in [:, 0] and permutation r in [:, 1].
+    """
+    moments, Xs, Ys = args
+    rng = np.random.default_rng(seed_sequence)
+    clusters = moments.shape[1]
+    weights = rng.multinomial(clusters, np.full(clusters, 1 / clusters), size=size).astype(float)
+    n, sx, sy, sxx, syy, sxy = [weights @ m for m in moments]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        boot = (sxy - sx * sy / n) / np.sqrt((sxx - sx ** 2 / n) * (syy - sy ** 2 / n))
+
+    # permutations in matrix products over chunks of draws whose gathered driver series fit
+    # PERMUTATION_CHUNK_BYTES; rows are (statistic, driver, draw)
+    drivers, targets = Xs.shape[1], Ys.shape[1] // 3
+    order = np.argsort(rng.random((size, clusters)), axis=1)
+    chunk = max(1, PERMUTATION_CHUNK_BYTES // (Xs.size * Xs.itemsize))
+    R = np.empty((3, drivers, size, 3, targets))
+    for lo in range(0, size, chunk):
+        hi = min(lo + chunk, size)
+        gathered = np.take(Xs, order[lo:hi], axis=2).reshape(3 * drivers * (hi - lo), -1)
+        R[:, :, lo:hi] = (gathered @ Ys).reshape(3, drivers, hi - lo, 3, targets)
+    R = R.transpose(0, 3, 2, 1, 4).reshape(3, 3, size, drivers * targets)
+    n, sx, sy, sxx, syy, sxy = R[1, 0], R[0, 0], R[1, 1], R[2, 0], R[1, 2], R[0, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        perm = (sxy - sx * sy / n) / np.sqrt((sxx - sx ** 2 / n) * (syy - sy ** 2 / n))
+    return np.stack([boot, perm], axis=1)
+
+def _cluster_codes(df, cluster):
+    """
+    Integer codes of the clusters of every row.
+
+    Parameters:
+    - df (pd.DataFrame): The panel DataFrame.
+    - cluster (str or list): Column(s) identifying a cluster.
+
+    Returns:
+    - tuple: (codes, number of clusters).
+    """
+    codes = df.groupby(cluster, sort=False, dropna=False).ngroup().to_numpy()
+    return codes, int(codes.max()) + 1 if len(codes) else 0
+
+def _resample_summary(observed, boot, null, confidence):
+    """
+    Percentile confidence intervals and two-sided resampling p-values.
+
+    Parameters:
+    - observed (np.ndarray): Observed statistics, one per column.
+    - boot (np.ndarray): Bootstrap draws, shape (resamples, columns).
+    - null (np.ndarray): Draws under the null hypothesis, shape (resamples, columns).
+    - confidence (float): Confidence level.
+
+    Returns:
+    - dict: 'ci_low', 'ci_high' and 'p_perm' arrays.
+    """
+    alpha = (1 - confidence) / 2
+    with np.errstate(invalid='ignore'):
+        exceed = (np.abs(null) >= np.abs(observed) - 1e-12).sum(axis=0)
+        return {'ci_low': np.nanquantile(boot, alpha, axis=0), 'ci_high': np.nanquantile(boot, 1 - alpha, axis=0),
+                'p_perm': (1 + exceed) / (1 + np.isfinite(null).sum(axis=0))}
+
+@instrumented
+def cluster_resample_mean_diff(df, pairs, cluster=['State', 'County'], n_resamples=10000, confidence=0.95,
+                               seed=0, max_workers=None, batch_size=500):
+    """
+    Cluster-bootstrap confidence intervals and sign-flip permutation p-values for paired mean differences.
+
+    Rows are resampled, and differences sign-flipped, a whole cluster (county) at a time, so the
+    dependence between years of the same county is kept. Draws are split into batches with their own
+    seeded RNG streams and run in a process pool; results depend on seed but not on max_workers.
+
+    Parameters:
+    - df (pd.DataFrame): DataFrame containing the paired samples, e.g. storm_hpi_h.
+    - pairs (list): List of (h, l) column name tuples; the difference is h - l.
+    - cluster (str or list, optional): Column(s) identifying a cluster. Default is ['State', 'County'].
+    - n_resamples (int, optional): Number of bootstrap and permutation draws. Default is 10000.
+    - confidence (float, optional): Confidence level of the percentile interval. Default is 0.95.
+    - seed (int, optional): Seed of the resampling. Default is 0.
+    - max_workers (int, optional): Number of worker processes. Default is None, which uses os.cpu_count().
+    - batch_size (int, optional): Number of draws per batch. Default is 500.
+
+    Raises:
+    - AssertionError: If any input argument is not of the expected type.
+
+    Returns:
+    - pd.DataFrame: One row per pair with columns 'h', 'l', 'n', 'clusters', 'mean_diff', 'ci_low', 'ci_high' and 'p_perm'.
+    """
+    assert isinstance(df, pd.DataFrame) and isinstance(pairs, list) and isinstance(cluster, (str, list))
+    assert all(isinstance(pair, tuple) and len(pair) == 2 for pair in pairs)
+    assert isinstance(n_resamples, int) and n_resamples > 0 and isinstance(confidence, float) and 0 < confidence < 1
+    assert isinstance(seed, int) and isinstance(batch_size, int) and batch_size > 0
+    assert max_workers is None or (isinstance(max_workers, int) and max_workers > 0)
+
+    D = df[[h for h, _ in pairs]].to_numpy(dtype=float) - df[[l for _, l in pairs]].to_numpy(dtype=float)
+    mask = np.isfinite(D)
+    codes, clusters = _cluster_codes(df, cluster)
+    S = np.zeros((clusters, len(pairs)))
+    N = np.zeros((clusters, len(pairs)))
+    np.add.at(S, codes, np.where(mask, D, 0))
+    np.add.at(N, codes, mask)
+
+    draws = _resample_batches(_mean_diff_batch, (S, N), n_resamples, seed, batch_size, max_workers or os.cpu_count() or 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        observed = S.sum(axis=0) / N.sum(axis=0)
+    summary = _resample_summary(observed, draws[:, 0], draws[:, 1], confidence)
+    return pd.DataFrame({'h': [h for h, _ in pairs], 'l': [l for _, l in pairs], 'n': N.sum(axis=0).astype(int),
+                         'clusters': (N > 0).sum(axis=0), 'mean_diff': observed, **summary})
+
+@instrumented
+def cluster_resample_corr(df, drivers, targets, cluster=['State', 'County'], time='Year', n_resamples=10000,
+                          confidence=0.95, seed=0, max_workers=None, batch_size=50):
+    """
+    Cluster-bootstrap confidence intervals and cluster-permutation p-values for Pearson correlations.
+
+    The bootstrap resamples whole clusters through per-cluster sufficient statistics. The permutation
+    test reassigns each cluster's driver series to another cluster's targets (matched by time), which keeps
+    the serial dependence within counties under the null hypothesis. Pairs use pairwise-complete rows.
+    Results depend on seed but not on max_workers.
+
+    Parameters:
+    - df (pd.DataFrame): Panel DataFrame with one row per cluster and time.
+    - drivers (list): Column names of the explanatory variables.
+    - targets (list): Column names of the outcomes.
+    - cluster (str or list, optional): Column(s) identifying a cluster. Default is ['State', 'County'].
+    - time (str, optional): Name of the time column. Default is 'Year'.
+    - n_resamples (int, optional): Number of bootstrap and permutation draws. Default is 10000.
+    - confidence (float, optional): Confidence level of the percentile interval. Default is 0.95.
+    - seed (int, optional): Seed of the resampling. Default is 0.
+    - max_workers (int, optional): Number of worker processes. Default is None, which uses os.cpu_count().
+    - batch_size (int, optional): Number of draws per batch. Default is 50.
+
+    Raises:
+    - AssertionError: If any input argument is not of the expected type or a cluster has several rows for one time.
+
+    Returns:
+    - pd.DataFrame: One row per (driver, target) with columns 'driver', 'target', 'n', 'r', 'ci_low', 'ci_high' and 'p_perm'.
+    """
+    assert isinstance(df, pd.DataFrame) and isinstance(drivers, list) and isinstance(targets, list)
+    assert isinstance(cluster, (str, list)) and isinstance(time, str)
+    assert isinstance(n_resamples, int) and n_resamples > 0 and isinstance(confidence, float) and 0 < confidence < 1
+    assert isinstance(seed, int) and isinstance(batch_size, int) and batch_size > 0
+    assert max_workers is None or (isinstance(max_workers, int) and max_workers > 0)
+    keys = [cluster] if isinstance(cluster, str) else cluster
+    assert not df.duplicated(keys + [time]).any(), "df has several rows for the same cluster and time"
+
+    Xr = df[drivers].to_numpy(dtype=float)
+    Yr = df[targets].to_numpy(dtype=float)
+    r, _, n = _pairwise_pearson(Xr, Yr)
+    codes, clusters = _cluster_codes(df, cluster)
+
+    # per-cluster moments of every pair, centered by the pooled means for numerical stability
+    xi = np.repeat(np.arange(len(drivers)), len(targets))
+    ti = np.tile(np.arange(len(targets)), len(drivers))
+    x, y = Xr[:, xi], Yr[:, ti]
+    mask = np.isfinite(x) & np.isfinite(y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.where(mask, x - np.where(mask, x, 0).sum(axis=0) / mask.sum(axis=0), 0)
+        y = np.where(mask, y - np.where(mask, y, 0).sum(axis=0) / mask.sum(axis=0), 0)
+    moments = np.zeros((6, clusters, len(xi)))
+    for m, values in enumerate([mask, x, y, x * x, y * y, x * y]):
+        np.add.at(moments[m], codes, values)
+
+    # cluster x time layout for the permutations, centered like the moments
+    time_codes, periods = pd.factorize(df[time])
+    X = np.full((clusters, len(periods), len(drivers)), np.nan)
+    Y = np.full((clusters, len(periods), len(targets)), np.nan)
+    X[codes, time_codes] = Xr - np.nanmean(Xr, axis=0)
+    Y[codes, time_codes] = Yr - np.nanmean(Yr, axis=0)
+    mx, my = np.isfinite(X), np.isfinite(Y)
+    X, Y = np.where(mx, X, 0), np.where(my, Y, 0)
+    Xs = np.ascontiguousarray(np.stack([X, mx, X * X]).transpose(0, 3, 1, 2))
+    Ys = np.stack([my, Y, Y * Y]).transpose(1, 2, 0, 3).reshape(clusters * len(periods), -1)
 
-    return mean_diff_freq, t_freq, p_freq
\ No newline at end of file
+    draws = _resample_batches(_corr_batch, (moments, Xs, Ys), n_resamples, seed, batch_size, max_workers or os.cpu_count() or 1)
+    summary = _resample_summary(r.ravel(), draws[:, 0], draws[:, 1], confidence)
+    return pd.DataFrame({'driver': np.repeat(drivers, len(targets)), 'target': np.tile(targets, len(drivers)),
+                         'n': n.ravel(), 'r': r.ravel(), **summary})
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts package is imported from the repository root, as in the notebook
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
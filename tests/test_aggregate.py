@@ -0,0 +1,28 @@
+import pandas as pd
+from benchmarks.synthetic import make_storm_events, write_storm_files
+from scripts.aggregate import aggregate_storm_events
+from scripts.clean import parse_damage
+
+def test_streaming_aggregate_matches_full_load(tmp_path, monkeypatch):
+    storm = make_storm_events(1).sample(3000, random_state=0)
+    write_storm_files(storm, str(tmp_path / 'data'))
+    monkeypatch.chdir(tmp_path)
+    keys = ['STATE', 'YEAR', 'EVENT_TYPE']
+
+    groups, top = aggregate_storm_events("/data/*.csv.gz", keys=keys, top_k=3, chunksize=250)
+
+    full = pd.concat([pd.read_csv(f) for f in sorted((tmp_path / 'data').glob('*.csv.gz'))], ignore_index=True)
+    full['DAMAGE_P'] = parse_damage(full['DAMAGE_PROPERTY']) / 1000000
+    full['DAMAGE_C'] = parse_damage(full['DAMAGE_CROPS']) / 1000000
+    full = full.dropna(subset=['DAMAGE_P', 'DAMAGE_C'])
+    full['DAMAGE'] = full['DAMAGE_P'] + full['DAMAGE_C']
+    expected = full.groupby(keys).agg(FREQ=('EVENT_ID', 'size'), DAMAGE_P=('DAMAGE_P', 'sum'),
+                                      DAMAGE_C=('DAMAGE_C', 'sum'), DAMAGE=('DAMAGE', 'sum'),
+                                      DAMAGE_MIN=('DAMAGE', 'min'), DAMAGE_MAX=('DAMAGE', 'max')).reset_index()
+
+    result = groups.reset_index() if keys[0] not in groups.columns else groups
+    result = result[expected.columns].sort_values(keys).reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected.sort_values(keys).reset_index(drop=True), check_dtype=False)
+
+    expected_top = full.sort_values(['DAMAGE', 'EVENT_ID'], ascending=[False, True]).groupby(keys).head(3)
+    assert sorted(top['EVENT_ID']) == sorted(expected_top['EVENT_ID'])
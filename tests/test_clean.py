@@ -0,0 +1,11 @@
+import pandas as pd
+from scripts.clean import parse_damage, compact_dtypes
+
+def test_parse_damage_report_lists_only_unparsed_categories():
+    series = pd.Series(['1K', '2M', 'abc', 'abc', None, 'x']).astype('category')
+    _, report = parse_damage(series, validate=True)
+    assert report['unparsed_values'].to_dict() == {'abc': 2, 'x': 1}
+
+def test_compact_dtypes_accepts_integer_ratio():
+    df = pd.DataFrame({'STATE': ['TX', 'CA', 'NY'], 'DAMAGE': [1.0, 2.0, 3.0]})
+    assert isinstance(compact_dtypes(df, max_unique_ratio=1)['STATE'].dtype, pd.CategoricalDtype)
@@ -0,0 +1,26 @@
+import pandas as pd
+import numpy as np
+from scripts.county_panel import build_county_lookup, build_county_year_panel
+
+def _counties():
+    return pd.DataFrame({'STATEFP': ['12', '46', '24', '24'], 'COUNTYFP': ['086', '102', '510', '005'],
+                         'STUSPS': ['FL', 'SD', 'MD', 'MD'],
+                         'NAME': ['Miami-Dade', 'Oglala Lakota', 'Baltimore', 'Baltimore'],
+                         'NAMELSAD': ['Miami-Dade County', 'Oglala Lakota County', 'Baltimore city', 'Baltimore County'],
+                         'LSAD': ['06', '06', '25', '06']})
+
+def test_panel_keys_renamed_counties():
+    lookup = build_county_lookup(_counties())
+    storm = pd.DataFrame({'EVENT_ID': [1, 2, 3, 4, 5], 'YEAR': [2000] * 5,
+                          'STATE_FIPS': [12, 12, 46, 24, 24], 'CZ_TYPE': ['C', 'Z', 'C', 'C', 'Z'],
+                          'CZ_FIPS': [25, 999, 113, 510, 999],
+                          'CZ_NAME': ['DADE', 'MIAMI-DADE', 'SHANNON', 'BALTIMORE (C)', 'BALTIMORE'],
+                          'DAMAGE': [1.0, 2.0, 4.0, 8.0, 16.0]})
+    hpi = pd.DataFrame({'State': ['FL', 'SD', 'MD', 'MD'], 'County': ['Dade', 'Shannon', 'Baltimore City', 'Baltimore'],
+                        'FIPS code': [12025, 46113, np.nan, np.nan], 'Year': [2000] * 4, 'HPI': [100.0] * 4})
+
+    panel, coverage = build_county_year_panel(storm, hpi, lookup)
+    damage = panel.set_index('county_key')['DAMAGE'].to_dict()
+    # retired FIPS 12025 and 46113 map to Miami-Dade and Oglala Lakota; the city and county of Baltimore stay apart
+    assert damage == {12086: 3.0, 46102: 4.0, 24510: 8.0, 24005: 16.0}
+    assert coverage['storm_in_panel'] == 5 and coverage['panel_rows'] == 4
@@ -0,0 +1,17 @@
+import numpy as np
+import pandas as pd
+from scripts.did import did_effects
+
+def test_pooled_se_ignores_duplicated_windows():
+    rng = np.random.default_rng(0)
+    panel = pd.DataFrame([(u, y) for u in range(200) for y in range(2000, 2016)], columns=['unit', 'Year'])
+    panel['HPI'] = np.exp(4 + rng.normal(0, 0.05, len(panel)))
+    panel['DAMAGE'] = (rng.random(len(panel)) < 0.2) * 1.0
+    events = pd.DataFrame({'begin': pd.to_datetime(['2005-01-01', '2008-03-01']),
+                           'end': pd.to_datetime(['2005-06-01', '2008-05-01'])})
+
+    _, once = did_effects(panel, events, 'unit', 'Year')
+    _, repeated = did_effects(panel, pd.concat([events] * 10, ignore_index=True), 'unit', 'Year')
+    assert repeated['events'].iloc[0] == 20 and repeated['windows'].iloc[0] == 2
+    assert np.isclose(once['effect'].iloc[0], repeated['effect'].iloc[0])
+    assert np.isclose(once['se'].iloc[0], repeated['se'].iloc[0])
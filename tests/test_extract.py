@@ -0,0 +1,20 @@
+import pandas as pd
+import numpy as np
+from scripts.extract import cached_frame
+
+def test_cached_frame_hit_equals_miss(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / "source.csv"
+    source.write_text("x\n1\n")
+    frame = pd.DataFrame({
+        'mixed': pd.Series([0, '10K', 2.5, np.nan, '1M'], dtype=object),
+        'text': pd.Series(['a', None, 'c', 'd', 'e'], dtype=object),
+        'value': [1.0, 2.0, np.nan, 4.0, 5.0],
+        'kind': pd.Categorical(['C', 'Z', 'C', 'C', 'Z']),
+        'mixed_category': pd.Categorical([0, '10K', 0, np.nan, '1M']),
+    }, index=[10, 11, 12, 13, 14])
+
+    miss = cached_frame([str(source)], lambda: frame.copy(), params={'test': 1})
+    hit = cached_frame([str(source)], lambda: frame.iloc[:0], params={'test': 1})
+    pd.testing.assert_frame_equal(hit, miss)
+    assert [type(v) for v in hit['mixed']] == [type(v) for v in frame['mixed']]
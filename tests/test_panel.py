@@ -0,0 +1,37 @@
+import pandas as pd
+import numpy as np
+from scripts.panel import panel_shift, lag_hpi_changes, dense_shift, dense_lag_changes
+
+def _gap_panel():
+    # county A misses 2001, county B misses 2003 and 2004
+    rows = [('A', y) for y in range(1998, 2008) if y != 2001] + [('B', y) for y in range(1998, 2008) if y not in (2003, 2004)]
+    panel = pd.DataFrame(rows, columns=['County', 'Year'])
+    panel['HPI'] = 100 + np.arange(len(panel)) * 1.5
+    return panel.sample(frac=1, random_state=0).reset_index(drop=True)
+
+def _dense(panel, column):
+    units = sorted(panel['County'].unique())
+    matrix = np.full((len(units), 10), np.nan)
+    matrix[panel['County'].map(units.index).to_numpy(), panel['Year'].to_numpy() - 1998] = panel[column].to_numpy()
+    return units, matrix
+
+def test_panel_shift_across_gaps_matches_dense_shift():
+    panel = _gap_panel()
+    shifted = panel_shift(panel, ['County'], 'Year', ['HPI'], [1, 2, 3, -2])
+    units, matrix = _dense(panel, 'HPI')
+    rows, cols = panel['County'].map(units.index).to_numpy(), panel['Year'].to_numpy() - 1998
+    for p, name in [(1, 'HPI_lag1'), (2, 'HPI_lag2'), (3, 'HPI_lag3'), (-2, 'HPI_lead2')]:
+        np.testing.assert_array_equal(shifted[name].to_numpy(), dense_shift(matrix, p)[rows, cols])
+
+    # A has no 2001, but its 2002 lag2 is the 2000 value
+    row_2002 = np.flatnonzero((panel['County'] == 'A') & (panel['Year'] == 2002))[0]
+    row_2000 = np.flatnonzero((panel['County'] == 'A') & (panel['Year'] == 2000))[0]
+    assert shifted['HPI_lag2'].iloc[row_2002] == panel['HPI'].iloc[row_2000]
+
+def test_lag_hpi_changes_matches_dense_lag_changes():
+    panel = _gap_panel()
+    lags = lag_hpi_changes(panel, keys=['County'])
+    units, matrix = _dense(panel, 'HPI')
+    rows, cols = panel['County'].map(units.index).to_numpy(), panel['Year'].to_numpy() - 1998
+    for name, values in dense_lag_changes(matrix).items():
+        np.testing.assert_allclose(lags[name].to_numpy(), values[rows, cols], equal_nan=True)
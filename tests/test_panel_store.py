@@ -0,0 +1,26 @@
+import pandas as pd
+import numpy as np
+from scripts.panel_store import build_panel_store, store_view, heatmap_frame
+
+def _panel():
+    rows = [(s, c, y) for s, c in [('TX', 'Harris'), ('CA', 'Kern'), ('TX', 'Bell')] for y in range(2000, 2006)]
+    panel = pd.DataFrame(rows, columns=['State', 'County', 'Year'])
+    panel = panel.drop(index=[4, 13]).sample(frac=1, random_state=0).reset_index(drop=True)
+    panel['HPI'] = 100 + np.arange(len(panel)) * 2.5
+    panel['FREQ'] = np.arange(len(panel)) % 3
+    return panel
+
+def test_store_views_match_pivot_table(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    panel = _panel()
+    store = build_panel_store(panel, metrics=['HPI', 'FREQ'], store_dir='/store')
+
+    for metric in ['HPI', 'FREQ']:
+        expected = panel.pivot_table(values=metric, index=['State', 'County'], columns='Year')
+        frame = heatmap_frame(store, metric)
+        pd.testing.assert_frame_equal(frame, expected, check_dtype=False, check_names=False)
+        assert np.shares_memory(frame.to_numpy(), store['values'])
+
+    unit = store_view(store, unit=('TX', 'Bell'))
+    assert unit.shape == (6, 2) and np.shares_memory(unit, store['values'])
+    assert store_view(store, 'HPI', ('TX', 'Harris'), 2003) == panel.query("County == 'Harris' and Year == 2003")['HPI'].item()
@@ -0,0 +1,23 @@
+import numpy as np
+import plotly.graph_objects as go
+from scripts.plotly_plots import _round_significant, _compact_figure
+
+def test_round_significant_per_value():
+    rounded = _round_significant([123456.7, 0.000123456, -3.14159265, 0.0, np.nan], 4)
+    np.testing.assert_array_equal(rounded, [123500.0, 0.0001235, -3.142, 0.0, np.nan])
+
+def test_compact_figure_keeps_unsorted_lines():
+    x = np.random.default_rng(0).random(20000)
+    unsorted = _compact_figure(go.Figure(go.Scatter(x=x, y=np.sin(10 * x))), max_points=5000)
+    assert len(unsorted.data[0].x) == 20000
+    x = np.sort(x)
+    ordered = _compact_figure(go.Figure(go.Scatter(x=x, y=np.sin(10 * x))), max_points=5000)
+    assert len(ordered.data[0].x) == 5000
+
+def test_compact_figure_keeps_distinct_x():
+    quarters = np.arange(1990, 2024, 0.25)
+    fig = _compact_figure(go.Figure(go.Scatter(x=quarters, y=np.arange(len(quarters)) * 1.2345)))
+    np.testing.assert_array_equal(fig.data[0].x, quarters)
+    index = np.array([123456.0, 123478.0, 123500.0])
+    fig = _compact_figure(go.Figure(go.Scatter(x=index, y=[1.0, 2.0, 3.0])))
+    assert len(np.unique(fig.data[0].x)) == 3
@@ -0,0 +1,35 @@
+import numpy as np
+import geopandas as gpd
+import shapely
+from scripts.spatial import spatial_weights, morans_i
+
+def _grid(size=4):
+    i = np.arange(size * size)
+    x0, y0 = -100 + (i % size) * 0.5, 35 + (i // size) * 0.5
+    return gpd.GeoDataFrame({'STATEFP': '48', 'COUNTYFP': [str(c + 1).zfill(3) for c in i]},
+                            geometry=shapely.box(x0, y0, x0 + 0.5, y0 + 0.5), crs="EPSG:4269")
+
+def test_contiguity_weights_are_symmetric():
+    counties = _grid()
+    for kind, interior, corner in (('queen', 8, 3), ('rook', 4, 2)):
+        W, keys = spatial_weights(counties, kind=kind, transform='b')
+        dense = W.toarray()
+        np.testing.assert_array_equal(dense, dense.T)
+        assert dense.diagonal().sum() == 0 and dense[5].sum() == interior and dense[0].sum() == corner
+        assert list(keys) == [48001 + c for c in range(16)]
+
+def test_morans_i_matches_hand_computation():
+    size = 4
+    W, _ = spatial_weights(_grid(size), kind='rook', transform='b')
+    values = np.random.default_rng(0).normal(size=size * size) + np.arange(size * size) / 4
+
+    hand = np.zeros((size * size, size * size))
+    for a in range(size * size):
+        for b in range(size * size):
+            ra, ca, rb, cb = a // size, a % size, b // size, b % size
+            hand[a, b] = abs(ra - rb) + abs(ca - cb) == 1
+    z = values - values.mean()
+    expected = len(z) / hand.sum() * (z @ hand @ z) / (z @ z)
+
+    result = morans_i(W, values, permutations=99)
+    assert np.isclose(result['I'], expected) and result['EI'] == -1 / 15
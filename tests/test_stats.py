@@ -0,0 +1,22 @@
+import pandas as pd
+import numpy as np
+from scripts.stats import match_covariates
+
+def _groups():
+    treated = pd.DataFrame({'x': [0.0, 0.05, 50.0], 'Year': [2000, 2000, 2000]})
+    controls = pd.DataFrame({'x': [0.02, 1.0, 2.0, 0.03], 'Year': [2000, 2000, 2000, 2001]})
+    return treated, controls
+
+def test_match_covariates_caliper_and_one_to_one():
+    treated, controls = _groups()
+    sd = np.std(np.r_[treated['x'], controls['x']])
+
+    shared = match_covariates(treated, controls, ['x'], exact=['Year'])
+    assert shared['control'].tolist() == [0, 0, 2]
+
+    one_to_one = match_covariates(treated, controls, ['x'], exact=['Year'], caliper=0.5, replace=False)
+    assert one_to_one['treated'].tolist() == [0, 1]
+    assert sorted(one_to_one['control']) == [0, 1]
+    assert (one_to_one['distance'] <= 0.5).all()
+    expected = np.abs(treated['x'].to_numpy()[one_to_one['treated']] - controls['x'].to_numpy()[one_to_one['control']]) / sd
+    np.testing.assert_allclose(one_to_one['distance'], expected)